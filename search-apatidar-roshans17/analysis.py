@@ -0,0 +1,137 @@
+"""
+Provides the text analysis shared by the indexer and the querier: precompiled tokenizing patterns and a
+memoized stop/stem step, so a surface form is checked against the stop words and stemmed only once
+"""
+import re
+from functools import lru_cache
+
+# NLTK's English stop words, bundled so that no corpus has to be downloaded or loaded
+STOP_WORDS = frozenset([
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd",
+    'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 'hers',
+    'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what', 'which',
+    'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been',
+    'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but',
+    'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 'about', 'against',
+    'between', 'into', 'through', 'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down',
+    'in', 'out', 'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when',
+    'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no',
+    'nor', 'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don',
+    "don't", 'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't",
+    'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 'haven',
+    "haven't", 'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan',
+    "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 'wouldn',
+    "wouldn't"
+])
+
+# links ([[...]]), words with an apostrophe inside and plain words, the inside of a link and a word being
+# captured by separate groups so that a single scan of a page tells them apart
+PAGE_TOKEN_REGEX = re.compile(r"\[\[(?P<link>[^\[]+?)\]\]|(?P<word>[a-zA-Z0-9]+'[a-zA-Z0-9]+|[a-zA-Z0-9]+)")
+# the same words without links, for search queries
+WORD_REGEX = re.compile(r"[a-zA-Z0-9]+'[a-zA-Z0-9]+|[a-zA-Z0-9]+")
+# the character of a search query term that stands for any sequence of characters (celt*, c*tic)
+WILDCARD = "*"
+# the words of a search query, along with its wildcard terms, which must start with a letter or digit so that
+# they can be expanded by a range scan of the sorted term dictionary
+QUERY_TOKEN_REGEX = re.compile(r"(?P<pattern>[a-zA-Z0-9][a-zA-Z0-9']*\*[a-zA-Z0-9'*]*)|"
+                               r"(?P<word>[a-zA-Z0-9]+'[a-zA-Z0-9]+|[a-zA-Z0-9]+)")
+# a quoted phrase of a search query
+PHRASE_REGEX = re.compile(r'"([^"]*)"')
+# the words of a (lowercased) link's text
+LINK_WORD_REGEX = re.compile(r"[a-z]+[a-z]")
+
+
+class Analyzer:
+    def __init__(self, max_size: int = None):
+        """
+        :param max_size: the number of surface forms whose terms are remembered, least recently used first
+        out; None remembers every surface form (the vocabulary is Zipfian, so this stays small)
+        """
+        self.max_size = max_size
+        # the Porter stemmer, loaded the first time a word is stemmed (importing NLTK is slow)
+        self.stemmer = None
+        self.term = lru_cache(maxsize=max_size)(self.analyze)
+
+    def analyze(self, word: str):
+        """
+        Turns a surface form into the term it is indexed under
+        :param self
+        :param word: a token as it appears in the text
+        :return: the lowercased, stemmed word, or None if it is a stop word
+        """
+        lower_case_word = word.lower()
+        if lower_case_word in STOP_WORDS:
+            return None
+        if self.stemmer is None:
+            from nltk.stem import PorterStemmer
+            self.stemmer = PorterStemmer()
+        return self.stemmer.stem(lower_case_word)
+
+    def stop_stem(self, words: list):
+        """
+        Removes stop words from a list of tokens and stems the rest
+        :param self
+        :param words: list of tokens
+        :return: the terms of the tokens that are not stop words, in order
+        """
+        term = self.term
+        terms = []
+        for word in words:
+            stemmed = term(word)
+            if stemmed is not None:
+                terms.append(stemmed)
+        return terms
+
+    def query_terms(self, user_input: str):
+        """
+        Analyzes a search query the same way page text is analyzed
+        Wildcard terms are only lowercased, since they are matched against the stemmed terms of the index
+        :param self
+        :param user_input: the search query
+        :return: the terms of the query, in order
+        """
+        if WILDCARD not in user_input:
+            return self.stop_stem(WORD_REGEX.findall(user_input))
+        terms = []
+        for pattern, word in QUERY_TOKEN_REGEX.findall(user_input):
+            term = pattern.lower() if pattern else self.term(word)
+            if term is not None:
+                terms.append(term)
+        return terms
+
+    def query_phrases(self, user_input: str):
+        """
+        Analyzes the quoted phrases of a search query
+        :param self
+        :param user_input: the search query
+        :return: a tuple of the terms of each phrase (phrases with no terms left are dropped); wildcard terms
+        are left out of phrases, which are matched word by word
+        """
+        if '"' not in user_input:
+            return ()
+        phrases = [tuple(term for term in self.query_terms(phrase) if WILDCARD not in term)
+                   for phrase in PHRASE_REGEX.findall(user_input)]
+        return tuple(phrase for phrase in phrases if phrase)
+
+    def cache_stats(self):
+        """
+        Reports how well the term cache is doing
+        :param self
+        :return: a dictionary of cache hits, misses, size and hit rate
+        """
+        info = self.term.cache_info()
+        lookups = info.hits + info.misses
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize,
+                "hit_rate": info.hits / lookups if lookups else 0}
+
+    def clear(self):
+        """
+        Empties the term cache and resets its counters
+        :param self
+        :return: n/a
+        """
+        self.term.cache_clear()
+
+
+# the analyzer shared by everything in the process
+ANALYZER = Analyzer()
@@ -0,0 +1,488 @@
+"""
+Benchmarks the indexer and the querier on a synthetic wiki and reports the timings as JSON, so that runs
+before and after a change can be compared
+The generated wiki draws its words from a Zipfian vocabulary (a few very common words, a long tail of rare
+ones) and links each page to others drawn from a Zipfian distribution over pages, so that some pages
+collect far more links than others, as in a real wiki
+With --fuzzy, it instead measures how long correcting a misspelled query word takes as the vocabulary grows,
+with the trigram index and with a scan of the whole vocabulary, with --formats, how large the text and binary
+words files of a given wiki are and how fast they are decoded, and with --index-workers, how long indexing a given
+wiki takes with each number of worker processes
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as et
+from xml.sax.saxutils import escape
+
+import numpy as np
+from index import Index
+from query import Query
+from file_io import write_title_file, write_docs_file, write_words_file, write_binary_words_file, \
+    write_links_file, links_path, write_trigrams_file, trigrams_path, TrigramIndex, read_words_file, postings_path, \
+    BinaryWordsIndex, ArrayWordsIndex
+from fuzzy import edit_distances, max_distance
+from profiling import percentile
+
+# syllables the synthetic words are spelled with
+SYLLABLES = ["ba", "ko", "ri", "tu", "me", "sa", "di", "no", "lu", "ve",
+             "ga", "pi", "zo", "he", "fa", "ju", "ra", "te", "mo", "ki"]
+
+
+def make_word(rank: int):
+    """
+    Spells a distinct pronounceable word for every vocabulary rank
+    :param rank: the position of the word in the vocabulary, most common first
+    :return: the word
+    """
+    syllables = []
+    rank += len(SYLLABLES)
+    while rank:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return "".join(syllables)
+
+
+def zipf_probabilities(size: int, exponent: float):
+    """
+    Computes the probabilities of a Zipfian distribution, the k-th most common item being drawn
+    in proportion to 1 / k^exponent
+    :param size: the number of items
+    :param exponent: how skewed the distribution is (0 is uniform)
+    :return: an array of the probability of each item, most common first
+    """
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_wiki(xml: str, pages: int, vocabulary: int = 20000, words_per_page: int = 200,
+                  links_per_page: float = 5, exponent: float = 1.1, seed: int = 0):
+    """
+    Writes a synthetic wiki XML file in the format the indexer reads
+    :param xml: filepath the wiki is written to
+    :param pages: the number of pages
+    :param vocabulary: the number of distinct words
+    :param words_per_page: the average number of words on a page
+    :param links_per_page: the average number of links on a page (the density of the link graph)
+    :param exponent: the Zipf exponent of both the words and the link targets
+    :param seed: seed of the random generator, so that the same parameters always give the same wiki
+    :return: the list of vocabulary words, most common first
+    """
+    rng = np.random.default_rng(seed)
+    words = [make_word(rank) for rank in range(vocabulary)]
+    titles = [words[page % vocabulary].capitalize() + " " + str(page) for page in range(pages)]
+    word_probabilities = zipf_probabilities(vocabulary, exponent)
+    # the most linked-to pages are spread over the ids instead of all being the first pages
+    popular_pages = rng.permutation(pages)
+    page_probabilities = zipf_probabilities(pages, exponent)
+    with open(xml, "w", encoding="utf-8") as xml_fh:
+        xml_fh.write("<xml>\n")
+        for page in range(pages):
+            tokens = [words[rank] for rank in rng.choice(vocabulary, size=rng.poisson(words_per_page),
+                                                         p=word_probabilities)]
+            for target in popular_pages[rng.choice(pages, size=rng.poisson(links_per_page), p=page_probabilities)]:
+                position = int(rng.integers(len(tokens) + 1))
+                if rng.random() < .5:
+                    tokens.insert(position, "[[" + titles[target] + "]]")
+                else:
+                    tokens.insert(position, "[[" + titles[target] + "|" + words[int(rng.integers(vocabulary))] + "]]")
+            xml_fh.write("<page>\n<title>\n" + escape(titles[page]) + "\n</title>\n<id>\n" + str(page) +
+                         "\n</id>\n<text>\n" + escape(" ".join(tokens)) + "\n</text>\n</page>\n")
+        xml_fh.write("</xml>\n")
+    return words
+
+
+def generate_queries(words: list, count: int, exponent: float = 1.1, seed: int = 0):
+    """
+    Draws search queries of one to three words from the same Zipfian vocabulary as the wiki
+    :param words: the vocabulary words, most common first
+    :param count: the number of queries
+    :param exponent: the Zipf exponent the words are drawn with
+    :param seed: seed of the random generator
+    :return: the list of queries
+    """
+    rng = np.random.default_rng(seed + 1)
+    probabilities = zipf_probabilities(len(words), exponent)
+    return [" ".join(words[rank] for rank in rng.choice(len(words), size=rng.integers(1, 4), p=probabilities))
+            for _ in range(count)]
+
+
+def timed(phases: dict, name: str, function, *args):
+    """
+    Runs a function and records how long it took
+    :param phases: the dictionary of phase names to seconds the timing is added to
+    :param name: the name of the phase
+    :param function: the function to run
+    :param args: the arguments of the function
+    :return: what the function returned
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    phases[name] = time.perf_counter() - start
+    return result
+
+
+def benchmark_index(xml: str, directory: str):
+    """
+    Indexes a wiki one phase at a time, timing each phase, and writes the index files
+    :param xml: filepath to the wiki
+    :param directory: the directory the index files are written to
+    :return: a pair of the indexing statistics (phase timings in seconds, PageRank iterations, pages and
+    terms) and the (titles, docs, words) filepaths
+    """
+    titles, docs, words = (os.path.join(directory, name) for name in ("titles.txt", "docs.txt", "words"))
+    phases = {}
+    ID = Index(None)
+    ID.xml = xml
+    ID.tree = timed(phases, "xml_parse", et.parse, xml)
+    ID.root = ID.tree.getroot()
+    timed(phases, "title_parse", ID.title_parse)
+    timed(phases, "word_parse", ID.word_parse)
+    timed(phases, "page_rank", ID.page_rank)
+    timed(phases, "write_title_file", write_title_file, titles, ID.title_dict)
+    timed(phases, "write_docs_file", write_docs_file, docs, ID.curr_dict_pr, ID.max_word_dict)
+    timed(phases, "write_links_file", write_links_file, links_path(docs), ID.link_titles)
+    timed(phases, "write_words_file", write_words_file, words + ".txt", ID.words_dict)
+    timed(phases, "write_binary_words_file", write_binary_words_file, words, ID.words_dict, len(ID.title_dict))
+    timed(phases, "write_trigrams_file", write_trigrams_file, trigrams_path(words), ID.doc_counts())
+    return {"phases_s": phases, "total_s": sum(phases.values()), "page_rank_iterations": ID.page_rank_iterations,
+            "pages": len(ID.title_dict), "terms": len(ID.words_dict)}, (titles, docs, words)
+
+
+def latency_stats(latencies: list):
+    """
+    Summarizes query latencies
+    :param latencies: the latency of every query, in milliseconds
+    :return: a dictionary of the mean, p50, p90, p99 and max latencies
+    """
+    latencies = sorted(latencies)
+    return {"queries": len(latencies), "mean_ms": sum(latencies) / len(latencies) if latencies else 0,
+            "p50_ms": percentile(latencies, .50), "p90_ms": percentile(latencies, .90),
+            "p99_ms": percentile(latencies, .99), "max_ms": latencies[-1] if latencies else 0}
+
+
+def benchmark_query(titles: str, docs: str, words: str, queries: list, use_page_rank: bool = False):
+    """
+    Measures how long the querier takes to load the index and to answer each query, once with its caches
+    disabled (every query runs the whole pipeline) and once more with them warm
+    :param titles: filepath to the titles file
+    :param docs: filepath to the docs file
+    :param words: filepath to the words file
+    :param queries: the queries to run
+    :param use_page_rank: indicator to multiply relevance scores by page ranks
+    :return: a dictionary of the startup time (in seconds) and the latency statistics of both runs
+    """
+    start = time.perf_counter()
+    querier = Query(result_cache_bytes=0, postings_cache_bytes=0)
+    querier.load(titles, docs, words)
+    startup = time.perf_counter() - start
+    querier.use_page_rank = use_page_rank
+
+    stats = {"startup_s": startup}
+    for name in ("uncached", "cached"):
+        if name == "cached":
+            querier = Query()
+            querier.load(titles, docs, words)
+            querier.use_page_rank = use_page_rank
+            for user_input in queries:
+                querier.rank(user_input)
+        latencies = []
+        for user_input in queries:
+            query_start = time.perf_counter()
+            querier.rank(user_input)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+        stats[name] = latency_stats(latencies)
+    return stats
+
+
+def run_benchmark(pages: int, vocabulary: int = 20000, words_per_page: int = 200, links_per_page: float = 5,
+                  exponent: float = 1.1, seed: int = 0, queries: int = 500, use_page_rank: bool = False,
+                  directory: str = None):
+    """
+    Generates a synthetic wiki, then benchmarks indexing it and querying the index
+    :param pages: the number of pages
+    :param vocabulary: the number of distinct words
+    :param words_per_page: the average number of words on a page
+    :param links_per_page: the average number of links on a page
+    :param exponent: the Zipf exponent of the words, the link targets and the queries
+    :param seed: seed of the random generator
+    :param queries: the number of queries to time
+    :param use_page_rank: indicator to multiply relevance scores by page ranks
+    :param directory: the directory the wiki and the index files are written to (a temporary directory by default)
+    :return: a dictionary of the parameters, the environment and every measurement
+    """
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as temp_dir:
+        directory = directory or temp_dir
+        xml = os.path.join(directory, "wiki.xml")
+        start = time.perf_counter()
+        words = generate_wiki(xml, pages, vocabulary, words_per_page, links_per_page, exponent, seed)
+        generation = time.perf_counter() - start
+        index_stats, files = benchmark_index(xml, directory)
+        query_stats = benchmark_query(*files, generate_queries(words, queries, exponent, seed), use_page_rank)
+        return {"parameters": {"pages": pages, "vocabulary": vocabulary, "words_per_page": words_per_page,
+                               "links_per_page": links_per_page, "exponent": exponent, "seed": seed,
+                               "queries": queries, "pagerank": use_page_rank},
+                "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                                "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                "generation_s": generation, "xml_bytes": os.path.getsize(xml),
+                "index": index_stats, "query": query_stats}
+
+
+def misspell(word: str, rng: np.random.Generator):
+    """
+    Makes a typo in a word: a letter substituted, inserted or deleted, or two neighbouring letters swapped
+    :param word: the word
+    :param rng: the random generator
+    :return: the misspelled word
+    """
+    letters = list(word)
+    typo = int(rng.integers(4))
+    position = int(rng.integers(len(letters)))
+    letter = chr(ord("a") + int(rng.integers(26)))
+    if typo == 0:
+        letters[position] = letter
+    elif typo == 1:
+        letters.insert(position, letter)
+    elif typo == 2 and len(letters) > 1:
+        del letters[position]
+    elif position + 1 < len(letters):
+        letters[position], letters[position + 1] = letters[position + 1], letters[position]
+    return "".join(letters)
+
+
+def benchmark_fuzzy(vocabulary: int, queries: int = 500, exponent: float = 1.1, seed: int = 0):
+    """
+    Measures how long correcting misspelled words takes for a vocabulary of synthetic words, with the
+    trigram index (the querier's correction) and with a scan computing the edit distance to every term
+    :param vocabulary: the number of distinct words
+    :param queries: the number of misspelled words to correct
+    :param exponent: the Zipf exponent of the page counts of the words and of the words misspelled
+    :param seed: seed of the random generator
+    :return: a dictionary of the time taken to write the trigram index (in seconds), the latency statistics of
+    both ways of correcting, the fraction of words they corrected and the fraction they corrected back to the
+    word that was misspelled
+    """
+    rng = np.random.default_rng(seed + 2)
+    words = [make_word(rank) for rank in range(vocabulary)]
+    # the k-th most common word appears on about 1 / k^exponent of the pages of a million page corpus
+    doc_counts = np.maximum(1, (10**6 * zipf_probabilities(vocabulary, exponent))).astype(np.int64)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as directory:
+        trigrams = os.path.join(directory, "words.trigrams")
+        start = time.perf_counter()
+        write_trigrams_file(trigrams, dict(zip(words, doc_counts.tolist())))
+        writing = time.perf_counter() - start
+        querier = Query(result_cache_bytes=0, postings_cache_bytes=0)
+        querier.trigram_index = TrigramIndex(trigrams)
+        typos = [(words[rank], misspell(words[rank], rng)) for rank in
+                 rng.choice(vocabulary, size=queries, p=zipf_probabilities(vocabulary, exponent))]
+        typos = [(word, typo) for word, typo in typos if querier.trigram_index.find(typo) == -1]
+
+        latencies = []
+        corrections = []
+        for _, typo in typos:
+            query_start = time.perf_counter()
+            corrections.append(querier.correction(typo))
+            latencies.append((time.perf_counter() - query_start) * 1000)
+        # the scan compares the word with every term, held in memory, and keeps the closest, most common one
+        sorted_words, lengths = querier.trigram_index.terms_at(np.arange(vocabulary))
+        sorted_counts = querier.trigram_index.entries["doc_count"].astype(np.int64)
+        scan_latencies = []
+        scan_corrections = []
+        for _, typo in typos:
+            query_start = time.perf_counter()
+            distances = edit_distances(typo, sorted_words, lengths)
+            best = np.lexsort((-sorted_counts, distances))[0]
+            scan_corrections.append(querier.trigram_index.term_at(best).decode("utf-8")
+                                    if distances[best] <= max_distance(typo) else None)
+            scan_latencies.append((time.perf_counter() - query_start) * 1000)
+        querier.trigram_index.close()
+    stats = {"vocabulary": vocabulary, "write_trigrams_file_s": writing}
+    for name, found, timings in (("trigrams", corrections, latencies), ("scan", scan_corrections, scan_latencies)):
+        stats[name] = dict(latency_stats(timings),
+                           corrected=sum(correction is not None for correction in found) / max(1, len(typos)),
+                           restored=sum(correction == word for correction, (word, _) in zip(found, typos)) /
+                           max(1, len(typos)))
+    return stats
+
+
+def run_fuzzy_benchmark(vocabularies: list, queries: int = 500, exponent: float = 1.1, seed: int = 0):
+    """
+    Benchmarks correcting misspelled words for vocabularies of growing sizes
+    :param vocabularies: the numbers of distinct words
+    :param queries: the number of misspelled words to correct for each vocabulary
+    :param exponent: the Zipf exponent of the page counts of the words and of the words misspelled
+    :param seed: seed of the random generator
+    :return: a dictionary of the parameters, the environment and the measurements for every vocabulary
+    """
+    return {"parameters": {"vocabularies": vocabularies, "queries": queries, "exponent": exponent, "seed": seed},
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "fuzzy": [benchmark_fuzzy(vocabulary, queries, exponent, seed) for vocabulary in vocabularies]}
+
+
+def best_time(function, *args, repeat: int = 5):
+    """
+    Runs a function several times and keeps its fastest run, the one least disturbed by the rest of the machine
+    :param function: the function to run
+    :param args: the arguments of the function
+    :param repeat: the number of runs
+    :return: the fastest run, in seconds
+    """
+    fastest = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest
+
+
+def benchmark_formats(xml: str, directory: str, repeat: int = 5, lookups: int = 5000, seed: int = 0):
+    """
+    Compares the text and binary words files of the index of a wiki: their size, how long they take to write,
+    to decode whole (as the indexer does to update an index) and to open and look a term's postings up in (as
+    the querier does)
+    :param xml: filepath to the wiki
+    :param directory: the directory the words files are written to
+    :param repeat: the number of runs each timing keeps the fastest of
+    :param lookups: the number of terms (drawn from the vocabulary) whose postings are looked up
+    :param seed: seed of the random generator
+    :return: a dictionary of the measurements for each format
+    """
+    ID = Index(xml)
+    text, binary = os.path.join(directory, "words.txt"), os.path.join(directory, "words")
+    postings = sum(len(ids_to_counts) for ids_to_counts in ID.words_dict.values())
+    rng = np.random.default_rng(seed)
+    vocabulary = sorted(ID.words_dict)
+    terms = [vocabulary[i] for i in rng.choice(len(vocabulary), size=min(lookups, len(vocabulary)), replace=False)]
+
+    def decode_text():
+        read_words_file(text, {})
+
+    def decode_binary():
+        words_index = BinaryWordsIndex(binary)
+        dict(words_index.items())
+        words_index.close()
+
+    def look_up(words_index):
+        for term in terms:
+            words_index.postings(term)
+
+    stats = {"pages": len(ID.title_dict), "terms": len(vocabulary), "postings": postings}
+    write_s = best_time(write_words_file, text, ID.words_dict, repeat=repeat)
+    decode_s = best_time(decode_text, repeat=repeat)
+    open_s = best_time(ArrayWordsIndex, text, len(ID.title_dict), repeat=repeat)
+    lookup_s = best_time(look_up, ArrayWordsIndex(text, len(ID.title_dict)), repeat=repeat)
+    stats["text"] = {"bytes": os.path.getsize(text), "write_s": write_s, "decode_s": decode_s,
+                     "decoded_postings_per_s": postings / decode_s, "open_s": open_s,
+                     "lookup_us": lookup_s / len(terms) * 1e6}
+    write_s = best_time(write_binary_words_file, binary, ID.words_dict, len(ID.title_dict), repeat=repeat)
+    decode_s = best_time(decode_binary, repeat=repeat)
+    open_s = best_time(BinaryWordsIndex, binary, repeat=repeat)
+    lookup_s = best_time(look_up, BinaryWordsIndex(binary), repeat=repeat)
+    stats["binary"] = {"bytes": os.path.getsize(binary) + os.path.getsize(postings_path(binary)),
+                       "dictionary_bytes": os.path.getsize(binary),
+                       "postings_bytes": os.path.getsize(postings_path(binary)), "write_s": write_s,
+                       "decode_s": decode_s, "decoded_postings_per_s": postings / decode_s, "open_s": open_s,
+                       "lookup_us": lookup_s / len(terms) * 1e6}
+    stats["binary_to_text_bytes"] = stats["binary"]["bytes"] / stats["text"]["bytes"]
+    return stats
+
+
+def run_formats_benchmark(xml: str, repeat: int = 5, lookups: int = 5000, seed: int = 0, keep: str = None):
+    """
+    Compares the text and binary words files of the index of a wiki
+    :param xml: filepath to the wiki
+    :param repeat: the number of runs each timing keeps the fastest of
+    :param lookups: the number of terms whose postings are looked up
+    :param seed: seed of the random generator
+    :param keep: if given, the directory the words files are left in (a temporary directory otherwise)
+    :return: a dictionary of the parameters, the environment and the measurements
+    """
+    with tempfile.TemporaryDirectory() as temporary:
+        return {"parameters": {"xml": xml, "repeat": repeat, "lookups": lookups, "seed": seed},
+                "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                                "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                "formats": benchmark_formats(xml, keep or temporary, repeat, lookups, seed)}
+
+
+def benchmark_workers(xml: str, worker_counts: list, repeat: int = 3):
+    """
+    Times indexing a wiki with each number of worker processes, checking that every build gives the same index
+    :param xml: filepath to the wiki
+    :param worker_counts: the numbers of worker processes
+    :param repeat: the number of builds each timing keeps the fastest of
+    :return: a list of the build time and the speedup over the first number of workers, for each number
+    """
+    sweep = []
+    expected = None
+    for workers in worker_counts:
+        # a first build, untimed, warms the page cache and the analyzer's cache up as well
+        built = Index(xml, workers=workers)
+        if expected is None:
+            expected = built
+        if built.words_dict != expected.words_dict or built.curr_dict_pr != expected.curr_dict_pr:
+            raise AssertionError("indexing with " + str(workers) + " workers gave a different index")
+        build_s = best_time(Index, xml, False, workers, repeat=repeat)
+        sweep.append({"workers": workers, "build_s": build_s,
+                      "speedup": sweep[0]["build_s"] / build_s if sweep else 1.0})
+    return sweep
+
+
+def run_workers_benchmark(xml: str, worker_counts: list, repeat: int = 3):
+    """
+    Times indexing a wiki with each number of worker processes
+    :param xml: filepath to the wiki
+    :param worker_counts: the numbers of worker processes
+    :param repeat: the number of builds each timing keeps the fastest of
+    :return: a dictionary of the parameters, the environment (with the number of CPUs the workers can use) and
+    the timings
+    """
+    return {"parameters": {"xml": xml, "worker_counts": worker_counts, "repeat": repeat},
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                            "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+                            else os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "workers": benchmark_workers(xml, worker_counts, repeat)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks indexing and querying a synthetic wiki')
+    parser.add_argument('--pages', type=int, default=2000, help='number of pages in the synthetic wiki')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='number of distinct words')
+    parser.add_argument('--words-per-page', type=int, default=200, help='average number of words on a page')
+    parser.add_argument('--links-per-page', type=float, default=5, help='average number of links on a page')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of the words and link targets')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--queries', type=int, default=500, help='number of queries to time')
+    parser.add_argument('--pagerank', action='store_true', help='multiply relevance scores by page ranks')
+    parser.add_argument('--keep', metavar='DIR', help='keep the wiki and the index files in this directory')
+    parser.add_argument('--fuzzy', metavar='SIZE,...',
+                        help='instead, time correcting --queries misspelled words for vocabularies of these sizes')
+    parser.add_argument('--formats', metavar='XML',
+                        help='instead, compare the size and decoding speed of the text and binary words files of the '
+                        'index of this wiki (such as SmallWiki.xml)')
+    parser.add_argument('--index-workers', metavar='COUNT,...',
+                        help='instead, time indexing --wiki with each of these numbers of worker processes')
+    parser.add_argument('--wiki', default='SmallWiki.xml', help='the wiki indexed by --index-workers')
+    parser.add_argument('--output', help='file the JSON results are written to (stdout by default)')
+    args = parser.parse_args()
+    if args.keep:
+        os.makedirs(args.keep, exist_ok=True)
+    if args.index_workers:
+        results = run_workers_benchmark(args.wiki, [int(count) for count in args.index_workers.split(',')])
+    elif args.formats:
+        results = run_formats_benchmark(args.formats, seed=args.seed, keep=args.keep)
+    elif args.fuzzy:
+        results = run_fuzzy_benchmark([int(size) for size in args.fuzzy.split(',')], args.queries, args.zipf,
+                                      args.seed)
+    else:
+        results = run_benchmark(args.pages, args.vocabulary, args.words_per_page, args.links_per_page, args.zipf,
+                                args.seed, args.queries, args.pagerank, args.keep)
+    if args.output:
+        with open(args.output, "w") as output_fh:
+            json.dump(results, output_fh, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
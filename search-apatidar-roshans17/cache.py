@@ -0,0 +1,81 @@
+"""
+Provides the memory-bounded LRU cache the querier keeps its query results and scored postings in:
+entries are charged an estimated size in bytes, and the least recently used entries are evicted
+whenever the total goes over the budget
+"""
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: the number of bytes the cached entries may use in total; 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        # maps each key to its (value, size) pair, least recently used first
+        self.entries = OrderedDict()
+        # the total estimated size of the cached entries
+        self.size = 0
+        # number of lookups that found their key, did not, and entries evicted to make room
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Looks up a key, marking it as the most recently used
+        :param self
+        :param key: the key to look up
+        :return: the cached value, or None if the key is not cached
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size: int):
+        """
+        Caches a value, evicting the least recently used entries until everything fits in the budget
+        A value bigger than the whole budget is not cached
+        :param self
+        :param key: the key to cache the value under
+        :param value: the value to cache
+        :param size: the estimated size of the value in bytes
+        :return: n/a
+        """
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Empties the cache, keeping its counters
+        :param self
+        :return: n/a
+        """
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Reports how well the cache is doing
+        :param self
+        :return: a dictionary of cache hits, misses, evictions, entries, size and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                "hit_rate": self.hits / lookups if lookups else 0}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,44 @@
+"""
+A command line client for the query server started by [python3 query.py --serve PORT ...]
+Sends the queries given as arguments (or one per line of stdin) and prints the ranked results
+"""
+import argparse
+import json
+import socket
+import sys
+
+
+def send_queries(host: str, port: int, queries: list):
+    """
+    Sends queries to the server over one connection
+    :param host: the server's address
+    :param port: the server's port
+    :param queries: the search queries
+    :return: a generator of response dictionaries, one per query
+    """
+    with socket.create_connection((host, port)) as connection:
+        responses = connection.makefile("r", encoding="utf-8")
+        for user_input in queries:
+            connection.sendall((json.dumps({"query": user_input}) + "\n").encode("utf-8"))
+            yield json.loads(responses.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sends queries to a running query server')
+    parser.add_argument('queries', nargs='*', help='the queries to send (read from stdin if none are given)')
+    parser.add_argument('--host', default='127.0.0.1', help='the server\'s address')
+    parser.add_argument('--port', type=int, required=True, help='the server\'s port')
+    parser.add_argument('--json', action='store_true', help='print the raw JSON responses')
+    args = parser.parse_args()
+    queries = args.queries or [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    for response in send_queries(args.host, args.port, queries):
+        if args.json:
+            print(json.dumps(response))
+        elif "error" in response:
+            print(response["error"])
+        elif not response["results"]:
+            print(f"{response['query']}: no results found")
+        else:
+            print(f"{response['query']} ({response['elapsed_ms']:.2f} ms)")
+            for result in response["results"]:
+                print(f"{result['rank']} {result['title']} ({result['score']:.6g})")
@@ -0,0 +1,154 @@
+"""
+Provides the compressed postings codec of the binary words file: doc ids are stored as gaps between
+consecutive ids and every number is written as a variable-byte integer (7 bits per byte, the high bit set
+on every byte but the last). Both directions are vectorized with NumPy, so a term's whole postings list is
+encoded or decoded in a handful of array operations instead of a Python loop per number
+"""
+import numpy as np
+
+# the low 7 bits of a byte hold data, the high bit marks that more bytes follow
+DATA_BITS = 7
+DATA_MASK = 0x7f
+MORE_FLAG = 0x80
+
+
+def varint_lengths(values: np.ndarray):
+    """
+    Counts the bytes each non-negative integer takes as a variable-byte integer
+    :param values: the integers
+    :return: an array of the number of bytes of each integer
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(DATA_BITS)
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(DATA_BITS)
+    return lengths
+
+
+def encode_varints(values: np.ndarray):
+    """
+    Encodes non-negative integers as variable-byte integers
+    :param values: the integers to encode
+    :return: the encoded bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+    lengths = varint_lengths(values)
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for i in range(int(lengths.max())):
+        has_byte = lengths > i
+        data = (values[has_byte] >> np.uint64(DATA_BITS * i)) & np.uint64(DATA_MASK)
+        more = (lengths[has_byte] > i + 1).astype(np.uint64) * np.uint64(MORE_FLAG)
+        encoded[starts[has_byte] + i] = data | more
+    return encoded.tobytes()
+
+
+def decode_varints(buffer, length: int, offset: int = 0):
+    """
+    Decodes every variable-byte integer in a slice of a buffer at once
+    :param buffer: the buffer holding the encoded bytes (bytes, mmap, ...)
+    :param length: the number of encoded bytes
+    :param offset: where the encoded bytes start in the buffer
+    :return: an array of the decoded integers
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8, count=length, offset=offset)
+    if length == 0:
+        return np.zeros(0, dtype=np.uint64)
+    # the common case of small gaps and counts: every number fits in a single byte
+    if data.max() < MORE_FLAG:
+        return data.astype(np.uint64)
+    ends = np.flatnonzero(data < MORE_FLAG)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # how many bytes into its number each byte is
+    byte_positions = np.arange(length) - np.repeat(starts, ends - starts + 1)
+    shifted = (data & DATA_MASK).astype(np.uint64) << (byte_positions * DATA_BITS).astype(np.uint64)
+    return np.add.reduceat(shifted, starts)
+
+
+def encode_postings(id_nums: np.ndarray, frequencies: np.ndarray):
+    """
+    Encodes a postings list: the gaps between its sorted doc ids, followed by its frequencies
+    :param id_nums: the doc ids, in ascending order
+    :param frequencies: the frequency of the term in each of those docs
+    :return: the encoded bytes
+    """
+    id_nums = np.asarray(id_nums, dtype=np.uint64)
+    gaps = np.diff(id_nums, prepend=np.uint64(0))
+    return encode_varints(np.concatenate((gaps, np.asarray(frequencies, dtype=np.uint64))))
+
+
+def encode_postings_lists(id_nums: list, frequencies: list, doc_counts: list):
+    """
+    Encodes the postings of consecutive terms at once, each as encode_postings would (the gaps between its
+    sorted doc ids, followed by its frequencies)
+    :param id_nums: the sorted doc ids of every term, one term after the other
+    :param frequencies: the matching frequencies
+    :param doc_counts: the number of postings of each term
+    :return: the encoded bytes and an array of the number of bytes of each term
+    """
+    id_nums = np.array(id_nums, dtype=np.uint64)
+    counts = np.array(doc_counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    gaps = np.diff(id_nums, prepend=np.uint64(0))
+    gaps[starts] = id_nums[starts]
+    # a term's gaps go where its postings start twice over (after the gaps and frequencies of the terms before it)
+    gap_positions = np.arange(len(id_nums)) + np.repeat(starts, counts)
+    values = np.empty(2 * len(id_nums), dtype=np.uint64)
+    values[gap_positions] = gaps
+    values[gap_positions + np.repeat(counts, counts)] = np.array(frequencies, dtype=np.uint64)
+    return encode_varints(values), np.add.reduceat(varint_lengths(values), 2 * starts)
+
+
+def decode_postings(buffer, length: int, count: int, offset: int = 0):
+    """
+    Decodes a postings list written by encode_postings
+    :param buffer: the buffer holding the encoded postings
+    :param length: the number of encoded bytes
+    :param count: the number of postings
+    :param offset: where the encoded postings start in the buffer
+    :return: a pair of arrays (doc ids, frequencies)
+    """
+    values = decode_varints(buffer, length, offset)
+    return np.cumsum(values[:count]), values[count:]
+
+
+def encode_positions(id_nums: np.ndarray, positions: list):
+    """
+    Encodes the positions of a term: the gaps between its sorted doc ids, the number of positions in each
+    doc, then each doc's positions as the gaps between them (the first one as is)
+    :param id_nums: the doc ids, in ascending order
+    :param positions: the sorted positions of the term in each of those docs
+    :return: the encoded bytes
+    """
+    id_nums = np.asarray(id_nums, dtype=np.uint64)
+    gaps = np.diff(id_nums, prepend=np.uint64(0))
+    counts = np.array([len(doc_positions) for doc_positions in positions], dtype=np.uint64)
+    position_gaps = [np.diff(np.asarray(doc_positions, dtype=np.uint64), prepend=np.uint64(0))
+                     for doc_positions in positions]
+    return encode_varints(np.concatenate([gaps, counts] + position_gaps))
+
+
+def decode_positions(buffer, length: int, count: int, offset: int = 0):
+    """
+    Decodes the positions of a term written by encode_positions
+    :param buffer: the buffer holding the encoded positions
+    :param length: the number of encoded bytes
+    :param count: the number of docs
+    :param offset: where the encoded positions start in the buffer
+    :return: a triple of arrays (doc ids, offsets, positions): the positions in the k-th doc are
+    positions[offsets[k]:offsets[k+1]]
+    """
+    values = decode_varints(buffer, length, offset)
+    counts = values[count:2 * count]
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    totals = np.cumsum(values[2 * count:])
+    # undoes the gaps doc by doc: subtracts everything summed up before the doc's first position
+    before = np.concatenate((np.zeros(1, dtype=np.uint64), totals))[offsets[:-1]]
+    return np.cumsum(values[:count]), offsets, totals - np.repeat(before, counts.astype(np.int64))
@@ -2,6 +2,22 @@
 Provides functionality for reading from/writing to the 3 index files used by
 indexer and querier in search
 """
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+from bisect import bisect_left
+from collections.abc import Mapping
+from itertools import chain
+
+import numpy as np
+from codec import encode_postings, decode_postings, encode_postings_lists, encode_positions, decode_positions, \
+    encode_varints, decode_varints, varint_lengths, DATA_BITS, DATA_MASK, MORE_FLAG
+from fuzzy import grams
+
 
 def write_title_file(title: str, dictionary: dict):
     """
@@ -18,20 +34,25 @@ def write_title_file(title: str, dictionary: dict):
             title_fh.write(str(id_num) + "::" + title + "\n")
 
 
-def write_docs_file(docs: str, ids_to_pageranks: dict):
+def write_docs_file(docs: str, ids_to_pageranks: dict, ids_to_max_counts: dict = None):
     """
     Writes the dictionary of ids the value of
     that page's rank from the Pagerank algorithm to be read in querying
+    If given, the number of times the most frequent word of each page appears is written after its rank
     output looks like:
-    id1 pagerank1
-    id2 pagerank2
+    id1 pagerank1 [maxcount1]
+    id2 pagerank2 [maxcount2]
     :param docs: filepath to docs file 
     :param ids_to_pageranks: dictionary of ids --> pageranks
+    :param ids_to_max_counts: dictionary of ids --> count of the most frequent word (optional)
     :return: n/a
     """
     with open(docs, "w") as docs_fh:
         for id_num, rank in ids_to_pageranks.items():
-            docs_fh.write(str(id_num) + " " + str(rank) + "\n")
+            if ids_to_max_counts is None:
+                docs_fh.write(str(id_num) + " " + str(rank) + "\n")
+            else:
+                docs_fh.write(str(id_num) + " " + str(rank) + " " + str(ids_to_max_counts.get(id_num, 0)) + "\n")
 
 
 def write_words_file(words: str, words_to_doc_relevance: dict):
@@ -68,11 +89,13 @@ def read_title_file(titles: str, ids_to_titles: dict):
             ids_to_titles[int(split[0])] = split[1]
 
 
-def read_docs_file(docs: str, ids_to_pageranks: dict):
+def read_docs_file(docs: str, ids_to_pageranks: dict, ids_to_max_counts: dict = None):
     """
     reads in the pageranks written in docs to into ids_to_pageranks dictionary
     :param docs: filepath to docs file 
     :param ids_to_pageranks: dictionary of ids to pageranks 
+    :param ids_to_max_counts: dictionary the count of each page's most frequent word is read into,
+    when the docs file has one (optional)
     :return: n/a
     """
     with open(docs, "r") as docs_fh:
@@ -83,6 +106,8 @@ def read_docs_file(docs: str, ids_to_pageranks: dict):
             split = line.split(" ")
             if len(split) > 1:
                 ids_to_pageranks[int(split[0])] = float(split[1])
+            if len(split) > 2 and ids_to_max_counts is not None:
+                ids_to_max_counts[int(split[0])] = float(split[2])
 
 
 def read_words_file(words: str, words_to_doc_relevance: dict):
@@ -105,4 +130,1198 @@ def read_words_file(words: str, words_to_doc_relevance: dict):
                 relevance = float(split[i+1])
                 if word not in words_to_doc_relevance:
                     words_to_doc_relevance[word] = {}
-                words_to_doc_relevance[word][page_id] = relevance
\ No newline at end of file
+                words_to_doc_relevance[word][page_id] = relevance
+
+def links_path(docs: str):
+    """
+    Gives the filepath of the links file that belongs to a docs file
+    :param docs: filepath to the docs file
+    :return: filepath to its links file
+    """
+    return docs + ".links"
+
+
+def write_links_file(links: str, ids_to_link_titles: dict):
+    """
+    Writes the titles of the pages each page links to, so that links can be resolved again when pages are
+    added or removed without re-parsing the corpus
+    output looks like (one JSON array per line, since titles may contain any character):
+    [id1, ["title1_1", "title1_2", ...]]
+    [id2, ["title2_1", ...]]
+    :param links: filepath to the links file
+    :param ids_to_link_titles: dictionary of ids --> list of the titles that page links to
+    :return: n/a
+    """
+    with open(links, "w") as links_fh:
+        for id_num, titles in ids_to_link_titles.items():
+            links_fh.write(json.dumps([id_num, titles]) + "\n")
+
+
+def read_links_file(links: str, ids_to_link_titles: dict):
+    """
+    reads the link titles written in links into the ids_to_link_titles dictionary
+    :param links: filepath to the links file
+    :param ids_to_link_titles: dictionary of ids to the list of titles that page links to
+    :return: n/a
+    """
+    with open(links, "r") as links_fh:
+        for line in links_fh:
+            line = line.strip()
+            if line == "":
+                continue
+            id_num, titles = json.loads(line)
+            ids_to_link_titles[id_num] = titles
+
+
+# first bytes of a link graph file
+GRAPH_MAGIC = b"SRCHGRF1"
+# layout of the link graph file header: magic, number of pages, number of links
+GRAPH_HEADER = struct.Struct("<8sQQ")
+
+
+def graph_path(docs: str):
+    """
+    Gives the filepath of the link graph file that belongs to a docs file
+    :param docs: filepath to the docs file
+    :return: filepath to its link graph file
+    """
+    return docs + ".graph"
+
+
+def write_graph_file(graph: str, doc_ids: list, indptr: np.ndarray, indices: np.ndarray):
+    """
+    Writes the resolved link graph PageRank runs on, so that page ranks can be recomputed without
+    re-parsing the corpus: the ID of every page, the number of pages each one links to and the position
+    (in the list of IDs) of every page linked to, one page after the other
+    graph file looks like:
+    header | id_1 ... id_n | out_degree_1 ... out_degree_n | target_1 ... target_m
+    :param graph: filepath to the link graph file
+    :param doc_ids: the IDs of every page
+    :param indptr: where the links of each page start in indices, followed by the number of links
+    :param indices: the position of the page each link points to
+    :return: n/a
+    """
+    with open(graph, "wb") as graph_fh:
+        graph_fh.write(GRAPH_HEADER.pack(GRAPH_MAGIC, len(doc_ids), len(indices)))
+        graph_fh.write(np.asarray(doc_ids, dtype="<i8").tobytes())
+        graph_fh.write(np.diff(indptr).astype("<u4").tobytes())
+        graph_fh.write(np.asarray(indices, dtype="<u4").tobytes())
+
+
+def read_graph_file(graph: str):
+    """
+    Reads a link graph file written by write_graph_file
+    :param graph: filepath to the link graph file
+    :return: a triple of the list of page IDs and the (indptr, indices) arrays of their links
+    """
+    with open(graph, "rb") as graph_fh:
+        data = graph_fh.read()
+    magic, pages, links = GRAPH_HEADER.unpack_from(data)
+    if magic != GRAPH_MAGIC:
+        raise ValueError(graph + " is not a link graph file")
+    offset = GRAPH_HEADER.size
+    doc_ids = np.frombuffer(data, dtype="<i8", count=pages, offset=offset).tolist()
+    offset += 8 * pages
+    out_degrees = np.frombuffer(data, dtype="<u4", count=pages, offset=offset)
+    indptr = np.zeros(pages + 1, dtype=np.int64)
+    np.cumsum(out_degrees, out=indptr[1:])
+    indices = np.frombuffer(data, dtype="<u4", count=links, offset=offset + 4 * pages).astype(np.int64)
+    return doc_ids, indptr, indices
+
+
+def shard_path(path: str, shard: int):
+    """
+    Gives the filepath of a shard's copy of an index file, numbering it before the extension
+    (titles.txt becomes titles.shard0.txt)
+    :param path: filepath to the index file of the whole corpus
+    :param shard: the number of the shard
+    :return: filepath to the shard's file
+    """
+    root, extension = os.path.splitext(path)
+    return root + ".shard" + str(shard) + extension
+
+
+def idf_path(words: str):
+    """
+    Gives the filepath of the idf file that belongs to the text words file of a shard
+    :param words: filepath to the text words file
+    :return: filepath to its idf file
+    """
+    return words + ".idf"
+
+
+def write_idf_file(idf: str, words_to_doc_counts: dict, total_pages: int):
+    """
+    Writes the corpus-wide statistics the idf of a shard's words is computed from, so that a text
+    words file holding only the pages of a shard gives the same idf as the whole corpus
+    output looks like:
+    total_pages
+    word1 doc_count1
+    word2 doc_count2
+    :param idf: filepath to the idf file
+    :param words_to_doc_counts: dictionary of words --> number of pages of the corpus they appear in
+    :param total_pages: the number of pages in the corpus
+    :return: n/a
+    """
+    with open(idf, "w") as idf_fh:
+        idf_fh.write(str(total_pages) + "\n")
+        for word, doc_count in words_to_doc_counts.items():
+            idf_fh.write(word + " " + str(doc_count) + "\n")
+
+
+def read_idf_file(idf: str, words_to_doc_counts: dict):
+    """
+    Reads an idf file written by write_idf_file
+    :param idf: filepath to the idf file
+    :param words_to_doc_counts: the dictionary the number of pages of the corpus each word appears in is put in
+    :return: the number of pages in the corpus
+    """
+    with open(idf, "r") as idf_fh:
+        total_pages = int(idf_fh.readline())
+        for line in idf_fh:
+            word, _, doc_count = line.strip().partition(" ")
+            if word != "":
+                words_to_doc_counts[word] = int(doc_count)
+    return total_pages
+
+
+# name of the manifest file that points to the published version of an index
+MANIFEST = "CURRENT"
+# name of the directory each version of a published index is written to
+VERSION_DIRECTORY = "v{:06d}"
+
+
+def manifest_path(directory: str):
+    """
+    Gives the filepath of the manifest of a publish directory
+    :param directory: the publish directory
+    :return: filepath to its manifest
+    """
+    return os.path.join(directory, MANIFEST)
+
+
+def versions(directory: str):
+    """
+    Lists the versions of an index written to a publish directory, published or not
+    :param directory: the publish directory
+    :return: the sorted list of version numbers
+    """
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith("v") and name[1:].isdigit() and os.path.isdir(os.path.join(directory, name)):
+            found.append(int(name[1:]))
+    return sorted(found)
+
+
+def new_version_directory(directory: str):
+    """
+    Creates the directory the next version of an index is written to, numbered after every version
+    already in the publish directory (including those of builds that never got published)
+    :param directory: the publish directory, created if it does not exist
+    :return: a pair of the new version number and the path to its directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    version = max(versions(directory), default=0) + 1
+    version_directory = os.path.join(directory, VERSION_DIRECTORY.format(version))
+    os.mkdir(version_directory)
+    return version, version_directory
+
+
+def write_manifest(directory: str, version: int, titles: str, docs: str, words: str):
+    """
+    Publishes a version of an index by pointing the manifest to its files
+    The manifest is written to a temporary file that is then renamed over the old one, so a querier reading it
+    sees either the old version or the new one, and only ever sees files that are completely written
+    output looks like:
+    {"version": 3, "titles": "v000003/titles.txt", "docs": "v000003/docs.txt", "words": "v000003/words"}
+    :param directory: the publish directory
+    :param version: the version number
+    :param titles: filepath to the version's titles file
+    :param docs: filepath to the version's docs file
+    :param words: filepath to the version's words file
+    :return: n/a
+    """
+    manifest = {"version": version}
+    for name, path in (("titles", titles), ("docs", docs), ("words", words)):
+        manifest[name] = os.path.relpath(path, directory)
+    temporary = manifest_path(directory) + ".tmp"
+    with open(temporary, "w") as manifest_fh:
+        json.dump(manifest, manifest_fh)
+        manifest_fh.flush()
+        os.fsync(manifest_fh.fileno())
+    os.replace(temporary, manifest_path(directory))
+
+
+def read_manifest(directory: str):
+    """
+    Reads the manifest of a publish directory written by write_manifest
+    :param directory: the publish directory
+    :return: a tuple of the published version number and the filepaths to its titles, docs and words files,
+    or None if no version was published yet
+    """
+    try:
+        with open(manifest_path(directory), "r") as manifest_fh:
+            manifest = json.load(manifest_fh)
+    except FileNotFoundError:
+        return None
+    paths = tuple(os.path.join(directory, manifest[name]) for name in ("titles", "docs", "words"))
+    return (manifest["version"],) + paths
+
+
+def remove_old_versions(directory: str, keep: int):
+    """
+    Deletes the oldest versions of a publish directory, keeping the published version and the versions
+    just before it, which queriers that have not picked up the published version yet may still be reading
+    :param directory: the publish directory
+    :param keep: the number of versions kept, counting the published one
+    :return: n/a
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return
+    for version in versions(directory):
+        if version <= manifest[0] - keep:
+            shutil.rmtree(os.path.join(directory, VERSION_DIRECTORY.format(version)))
+
+
+# first bytes of a binary words file, used to tell it apart from the text format
+BINARY_WORDS_MAGIC = b"SRCHWRD4"
+# layout of the binary words file header: magic, number of terms, number of pages in the corpus
+BINARY_WORDS_HEADER = struct.Struct("<8sQQ")
+# layout of the header of the other files that start with a term dictionary: magic, number of terms
+TERM_DICTIONARY_HEADER = struct.Struct("<8sQ")
+# number of consecutive terms of the binary words file stored together: only the first term of a block is
+# stored whole, the others as the suffix they do not share with the term before them
+TERMS_PER_BLOCK = 16
+# layout of one entry of the block index of a binary words file: where the block starts in each of the three
+# streams (term lengths, term suffixes and counts, all within 4 GiB) and where the postings of its first term
+# start in the postings file
+BINARY_BLOCK_ENTRY = np.dtype([("lengths_offset", "<u4"), ("suffixes_offset", "<u4"), ("counts_offset", "<u4"),
+                               ("postings_offset", "<u8")])
+# number of terms whose postings are encoded at once when writing a binary words file
+POSTINGS_CHUNK_TERMS = 4096
+
+
+def postings_path(words: str):
+    """
+    Gives the filepath of the postings file that belongs to a binary words file
+    :param words: filepath to the binary words file
+    :return: filepath to its postings file
+    """
+    return words + ".postings"
+
+
+def write_binary_words_file(words: str, words_to_doc_relevance: dict, total_pages: int, doc_counts: dict = None):
+    """
+    Writes the dictionary of words to ids to number of appearances in the binary format read by
+    BinaryWordsIndex: the words file holds the terms sorted and front coded in blocks of TERMS_PER_BLOCK, and the
+    postings file (words + ".postings") holds, for each term, its doc ids sorted and stored as gaps followed by its
+    frequencies, compressed as variable-byte integers (see codec.py)
+    For every term, the lengths stream holds the length of the prefix it shares with the term before it (0 for
+    the first term of a block) and of the rest of it, the suffixes stream that rest, and the counts stream the
+    number of pages it appears in, how many more pages of the corpus it appears in (for a shard) and the length of
+    its postings, all as variable-byte integers; the block index tells where each block starts in every stream
+    words file looks like:
+    header | block_1 ... block_m block_m+1 | lengths | suffixes | counts
+    :param words: the file that the term dictionary will get written to
+    :param words_to_doc_relevance: the dictionary that provides words -> ids -> term relevance, or any
+    mapping whose items() already come sorted by word (such as the SpilledWords of a block build)
+    :param total_pages: the number of pages in the corpus
+    :param doc_counts: maps each word to the number of pages of the corpus it appears in, when the words
+    are only those of a shard of the corpus (optional)
+    :return: n/a
+    """
+    if isinstance(words_to_doc_relevance, dict):
+        # sorting str keys by code point gives the same order as sorting their UTF-8 bytes
+        items = sorted(words_to_doc_relevance.items())
+    else:
+        items = words_to_doc_relevance.items()
+    lengths, suffixes, counts, postings_lengths = [], [], [], []
+    chunk_ids, chunk_frequencies, chunk_counts = [], [], []
+    previous = b""
+    with open(postings_path(words), "wb") as postings_fh:
+        for word, ids_to_relevance in items:
+            term = word.encode("utf-8")
+            shared = 0 if len(suffixes) % TERMS_PER_BLOCK == 0 else len(os.path.commonprefix((previous, term)))
+            lengths += (shared, len(term) - shared)
+            suffixes.append(term[shared:])
+            previous = term
+            id_nums = sorted(ids_to_relevance)
+            chunk_ids += id_nums
+            chunk_frequencies += [ids_to_relevance[id_num] for id_num in id_nums]
+            chunk_counts.append(len(id_nums))
+            counts += (len(id_nums), (doc_counts[word] if doc_counts is not None else len(id_nums)) - len(id_nums))
+            if len(chunk_counts) == POSTINGS_CHUNK_TERMS:
+                encoded, term_lengths = encode_postings_lists(chunk_ids, chunk_frequencies, chunk_counts)
+                postings_fh.write(encoded)
+                postings_lengths.append(term_lengths)
+                chunk_ids, chunk_frequencies, chunk_counts = [], [], []
+        if chunk_counts:
+            encoded, term_lengths = encode_postings_lists(chunk_ids, chunk_frequencies, chunk_counts)
+            postings_fh.write(encoded)
+            postings_lengths.append(term_lengths)
+    term_count = len(suffixes)
+    postings_lengths = np.concatenate(postings_lengths) if postings_lengths else np.zeros(0, dtype=np.int64)
+    # the length of its postings is the last of the three counts of a term
+    counts = np.array(counts, dtype=np.uint64).reshape(term_count, 2)
+    counts = np.column_stack((counts, postings_lengths.astype(np.uint64))).ravel()
+    lengths = np.array(lengths, dtype=np.uint64)
+    suffixes = b"".join(suffixes)
+    # where every block, and the end of the last one, starts in each stream
+    firsts = np.arange(0, term_count + TERMS_PER_BLOCK, TERMS_PER_BLOCK).clip(max=term_count)
+    blocks = np.zeros(len(firsts), dtype=BINARY_BLOCK_ENTRY)
+    for field, stream_lengths, per_term in [("lengths_offset", varint_lengths(lengths), 2),
+                                            ("suffixes_offset", lengths[1::2].astype(np.int64), 1),
+                                            ("counts_offset", varint_lengths(counts), 3),
+                                            ("postings_offset", postings_lengths, 1)]:
+        offsets = np.zeros(len(stream_lengths) + 1, dtype=np.int64)
+        np.cumsum(stream_lengths, out=offsets[1:])
+        blocks[field] = offsets[firsts * per_term]
+    with open(words, "wb") as words_fh:
+        words_fh.write(BINARY_WORDS_HEADER.pack(BINARY_WORDS_MAGIC, term_count, total_pages))
+        words_fh.write(blocks.tobytes())
+        words_fh.write(encode_varints(lengths))
+        words_fh.write(suffixes)
+        words_fh.write(encode_varints(counts))
+
+
+# first bytes of a positions file
+POSITIONS_MAGIC = b"SRCHPOS1"
+# layout of one term entry of a positions file: offset and length of the term in the term block, offset (from
+# the start of the file) and length of its compressed positions and the number of documents it appears in
+POSITIONS_TERM_ENTRY = np.dtype([("term_offset", "<u8"), ("term_length", "<u4"),
+                                 ("positions_offset", "<u8"), ("positions_length", "<u4"),
+                                 ("doc_count", "<u4")])
+
+
+def positions_path(words: str):
+    """
+    Gives the filepath of the positions file that belongs to a words file (of either format)
+    :param words: filepath to the words file
+    :return: filepath to its positions file
+    """
+    return words + ".positions"
+
+
+def write_positions_file(positions: str, words_to_positions: dict):
+    """
+    Writes the dictionary of words to ids to positions, read by PositionsIndex: a term dictionary sorted
+    by term followed by each term's doc ids, number of positions per doc and positions, compressed with
+    gaps and variable-byte integers (see codec.py)
+    positions file looks like:
+    header | entry_1 ... entry_n | term_1 term_2 ... term_n | positions_1 positions_2 ... positions_n
+    :param positions: the file that the positions will get written to
+    :param words_to_positions: the dictionary that provides words -> ids -> positions of the word in the page
+    :return: n/a
+    """
+    terms = []
+    blocks = []
+    entries = []
+    term_offset = 0
+    for word, ids_to_positions in sorted(words_to_positions.items()):
+        term = word.encode("utf-8")
+        id_nums = sorted(ids_to_positions)
+        block = encode_positions(id_nums, [np.unique(ids_to_positions[id_num]) for id_num in id_nums])
+        terms.append(term)
+        blocks.append(block)
+        entries.append([term_offset, len(term), 0, len(block), len(id_nums)])
+        term_offset += len(term)
+    positions_offset = TERM_DICTIONARY_HEADER.size + len(entries) * POSITIONS_TERM_ENTRY.itemsize + term_offset
+    for entry, block in zip(entries, blocks):
+        entry[2] = positions_offset
+        positions_offset += len(block)
+    with open(positions, "wb") as positions_fh:
+        positions_fh.write(TERM_DICTIONARY_HEADER.pack(POSITIONS_MAGIC, len(terms)))
+        positions_fh.write(np.array([tuple(entry) for entry in entries], dtype=POSITIONS_TERM_ENTRY).tobytes())
+        positions_fh.write(b"".join(terms))
+        positions_fh.write(b"".join(blocks))
+
+
+# first bytes of a tiers file
+TIERS_MAGIC = b"SRCHTIR1"
+# layout of the tiers file header: magic, number of terms, fraction of the pages in the first tier
+TIERS_HEADER = struct.Struct("<8sQd")
+# layout of one term entry of a tiers file: offset and length of the term in the term block, offset (from the
+# start of the file) and length of its compressed first tier postings, the number of postings in the first
+# tier and in all, and the largest page-rank-scaled weight of the term in a page outside the first tier
+TIERS_TERM_ENTRY = np.dtype([("term_offset", "<u8"), ("term_length", "<u4"),
+                             ("tier_offset", "<u8"), ("tier_length", "<u4"),
+                             ("tier_count", "<u4"), ("doc_count", "<u4"), ("rest_bound", "<f8")])
+
+
+def tiers_path(words: str):
+    """
+    Gives the filepath of the tiers file that belongs to a words file (of either format)
+    :param words: filepath to the words file
+    :return: filepath to its tiers file
+    """
+    return words + ".tiers"
+
+
+def write_tiers_file(tiers: str, words_to_doc_relevance: dict, ids_to_pageranks: dict, ids_to_max_counts: dict,
+                     total_pages: int, fraction: float, doc_counts: dict = None):
+    """
+    Writes the first PageRank tier of every word, read by TiersIndex: the first tier holds the pages whose
+    rank is among the top fraction of all pages, and a word's first tier postings are its postings in those
+    pages. Alongside them goes a bound on (count / max count) * idf * page rank over the word's other
+    postings, so that the querier can prove when the first tiers alone give the best PageRank results
+    tiers file looks like:
+    header | entry_1 ... entry_n | term_1 term_2 ... term_n | tier_1 tier_2 ... tier_n
+    :param tiers: the file that the tiers will get written to
+    :param words_to_doc_relevance: the dictionary that provides words -> ids -> term relevance, or any
+    mapping whose items() already come sorted by word
+    :param ids_to_pageranks: dictionary of ids --> pageranks
+    :param ids_to_max_counts: dictionary of ids --> count of the most frequent word
+    :param total_pages: the number of pages in the corpus
+    :param fraction: the fraction of the pages, by PageRank, that make up the first tier
+    :param doc_counts: maps each word to the number of pages of the corpus it appears in, when the words
+    are only those of a shard of the corpus (optional)
+    :return: n/a
+    """
+    if isinstance(words_to_doc_relevance, dict):
+        items = sorted(words_to_doc_relevance.items())
+    else:
+        items = words_to_doc_relevance.items()
+    size = max(ids_to_pageranks, default=-1) + 1
+    ranks = np.zeros(size)
+    max_counts = np.ones(size)
+    for id_num, rank in ids_to_pageranks.items():
+        ranks[id_num] = rank
+        max_counts[id_num] = ids_to_max_counts.get(id_num, 1)
+    # ties in rank are broken by page id, so that exactly the requested number of pages make the first tier
+    ordered = sorted(ids_to_pageranks, key=lambda id_num: (-ids_to_pageranks[id_num], id_num))
+    in_first_tier = np.zeros(size, dtype=bool)
+    in_first_tier[ordered[:math.ceil(fraction * len(ordered))]] = True
+
+    terms = []
+    blocks = []
+    entries = []
+    term_offset = 0
+    for word, ids_to_relevance in items:
+        term = word.encode("utf-8")
+        id_nums = np.array(sorted(ids_to_relevance), dtype=np.int64)
+        frequencies = np.array([ids_to_relevance[id_num] for id_num in id_nums.tolist()], dtype=np.int64)
+        first = in_first_tier[id_nums]
+        rest = id_nums[~first]
+        idf = math.log(total_pages/(doc_counts[word] if doc_counts is not None else len(id_nums)))
+        # the same operations, in the same order, as the querier's weighting, so the bound is exact
+        rest_bound = float((frequencies[~first].astype(np.float64) / max_counts[rest] * idf * ranks[rest]).max()) \
+            if len(rest) else 0.0
+        block = encode_postings(id_nums[first], frequencies[first])
+        terms.append(term)
+        blocks.append(block)
+        entries.append([term_offset, len(term), 0, len(block), int(first.sum()), len(id_nums), rest_bound])
+        term_offset += len(term)
+    tier_offset = TIERS_HEADER.size + len(entries) * TIERS_TERM_ENTRY.itemsize + term_offset
+    for entry, block in zip(entries, blocks):
+        entry[2] = tier_offset
+        tier_offset += len(block)
+    with open(tiers, "wb") as tiers_fh:
+        tiers_fh.write(TIERS_HEADER.pack(TIERS_MAGIC, len(terms), fraction))
+        tiers_fh.write(np.array([tuple(entry) for entry in entries], dtype=TIERS_TERM_ENTRY).tobytes())
+        tiers_fh.write(b"".join(terms))
+        tiers_fh.write(b"".join(blocks))
+
+
+# first bytes of a trigrams file
+TRIGRAMS_MAGIC = b"SRCHTRG1"
+# layout of the trigrams file header: magic, number of terms, number of trigrams, offset of the trigram table
+TRIGRAMS_HEADER = struct.Struct("<8sQQQ")
+# layout of one term entry of a trigrams file: offset and length of the term in the term block and the number
+# of pages of the corpus it appears in
+TRIGRAMS_TERM_ENTRY = np.dtype([("term_offset", "<u8"), ("term_length", "<u4"), ("doc_count", "<u4")])
+# layout of a trigram in the trigram table, as UTF-8 bytes padded with zero bytes (three characters take at most 12)
+TRIGRAM_TYPE = np.dtype("S12")
+
+
+def trigrams_path(words: str):
+    """
+    Gives the filepath of the trigrams file that belongs to a words file (of either format)
+    :param words: filepath to the words file
+    :return: filepath to its trigrams file
+    """
+    return words + ".trigrams"
+
+
+def write_trigrams_file(trigrams: str, words_to_doc_counts: dict):
+    """
+    Writes the character trigram index of the vocabulary, read by TrigramIndex: a term dictionary sorted by term
+    holding the number of pages each term appears in, then the sorted table of the trigrams of every term (see
+    fuzzy.grams) and, for each trigram, the positions in the term dictionary of the terms that contain it, stored
+    as gaps compressed as variable-byte integers (see codec.py)
+    trigrams file looks like:
+    header | entry_1 ... entry_n | term_1 ... term_n | trigram_1 ... trigram_m | offset_1 ... offset_m+1 |
+    terms_1 ... terms_m
+    :param trigrams: the file that the trigram index will get written to
+    :param words_to_doc_counts: dictionary of words --> number of pages of the corpus they appear in
+    :return: n/a
+    """
+    words = sorted(words_to_doc_counts)
+    grams_to_terms = {}
+    for position, word in enumerate(words):
+        for gram in grams(word):
+            grams_to_terms.setdefault(gram.encode("utf-8"), []).append(position)
+    terms = [word.encode("utf-8") for word in words]
+    entries = np.zeros(len(terms), dtype=TRIGRAMS_TERM_ENTRY)
+    entries["term_length"] = [len(term) for term in terms]
+    entries["term_offset"] = np.cumsum(entries["term_length"], dtype=np.uint64) - entries["term_length"]
+    entries["doc_count"] = [words_to_doc_counts[word] for word in words]
+    table = sorted(grams_to_terms)
+    # the lists of every trigram are encoded at once, each one's gaps starting from its first term
+    counts = np.array([len(grams_to_terms[gram]) for gram in table], dtype=np.int64)
+    positions = np.fromiter(chain.from_iterable(grams_to_terms[gram] for gram in table), dtype=np.uint64,
+                            count=int(counts.sum()))
+    starts = np.cumsum(counts) - counts
+    gaps = np.diff(positions, prepend=np.uint64(0))
+    gaps[starts] = positions[starts]
+    offsets = np.zeros(len(table) + 1, dtype="<u8")
+    if len(table):
+        np.cumsum(np.add.reduceat(varint_lengths(gaps), starts), out=offsets[1:])
+    grams_offset = TRIGRAMS_HEADER.size + entries.nbytes + sum(len(term) for term in terms)
+    with open(trigrams, "wb") as trigrams_fh:
+        trigrams_fh.write(TRIGRAMS_HEADER.pack(TRIGRAMS_MAGIC, len(terms), len(table), grams_offset))
+        trigrams_fh.write(entries.tobytes())
+        trigrams_fh.write(b"".join(terms))
+        trigrams_fh.write(np.array(table, dtype=TRIGRAM_TYPE).tobytes())
+        trigrams_fh.write(offsets.tobytes())
+        trigrams_fh.write(encode_varints(gaps))
+
+
+def is_binary_words_file(words: str):
+    """
+    Checks whether a words file was written in the binary format
+    :param words: filepath to the words file
+    :return: a boolean representing whether or not the file is a binary words file
+    """
+    with open(words, "rb") as words_fh:
+        return words_fh.read(len(BINARY_WORDS_MAGIC)) == BINARY_WORDS_MAGIC
+
+
+class SortedTermDictionary:
+    """
+    The memory-mapped term dictionary at the start of a binary index file, sorted by term:
+    header | entry_1 ... entry_n | term_1 term_2 ... term_n
+    where every entry holds the offset and length of its term in the term block
+    """
+
+    def open_dictionary(self, path: str, magic: bytes, entry_type: np.dtype,
+                        header: struct.Struct = TERM_DICTIONARY_HEADER):
+        """
+        Maps the file holding the term dictionary and checks its magic
+        :param path: filepath to the file
+        :param magic: the magic the file must start with
+        :param entry_type: the layout of one entry
+        :param header: the layout of the header, which starts with the magic and the number of terms
+        :return: the fields of the header
+        """
+        with open(path, "rb") as dictionary_fh:
+            self.dictionary_map = mmap.mmap(dictionary_fh.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = header.unpack_from(self.dictionary_map, 0)
+        found_magic, self.term_count = fields[:2]
+        if found_magic != magic:
+            raise ValueError(path + " is not a " + magic.decode("ascii") + " file")
+        self.entries = np.frombuffer(self.dictionary_map, dtype=entry_type, count=self.term_count,
+                                     offset=header.size)
+        # where the term block starts in the file
+        self.terms_start = header.size + self.term_count * entry_type.itemsize
+        return fields
+
+    def term_at(self, i: int):
+        """
+        Reads the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: the term as UTF-8 bytes
+        """
+        start = self.terms_start + int(self.entries[i]["term_offset"])
+        return self.dictionary_map[start:start + int(self.entries[i]["term_length"])]
+
+    def lower_bound(self, term: bytes):
+        """
+        Binary searches the term dictionary for the first term that is not before a given term
+        :param term: the term, as UTF-8 bytes
+        :return: the position of that term in the dictionary (the number of terms if there is none)
+        """
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            if self.term_at(mid) < term:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, word: str):
+        """
+        Binary searches the term dictionary for a word
+        :param word: the word to look up
+        :return: the position of the word in the dictionary, or -1 if it is not in the index
+        """
+        term = word.encode("utf-8")
+        low = self.lower_bound(term)
+        if low < self.term_count and self.term_at(low) == term:
+            return low
+        return -1
+
+    def prefix_range(self, prefix: str):
+        """
+        Finds the terms that start with a prefix, which are next to each other in the sorted term dictionary
+        :param prefix: the prefix
+        :return: a pair of positions (low, high): the terms at positions low to high - 1 start with the prefix
+        """
+        term = prefix.encode("utf-8")
+        # no UTF-8 byte is 0xff, so every term starting with the prefix sorts before the prefix followed by it
+        return self.lower_bound(term), self.lower_bound(term + b"\xff")
+
+
+class BinaryWordsIndex(SortedTermDictionary, Mapping):
+    """
+    A read-only, memory-mapped view of a binary words file that behaves like the
+    words -> ids -> frequency dictionary filled by read_words_file
+    Opening it only maps the files; a term is found by binary search over the first terms of the blocks, then
+    within the one block it may be in, and only the pages holding that block and the term's compressed postings
+    are read and decoded
+    """
+
+    def __init__(self, words: str):
+        with open(words, "rb") as words_fh:
+            self.dictionary_map = mmap.mmap(words_fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.term_count, self.total_pages = BINARY_WORDS_HEADER.unpack_from(self.dictionary_map, 0)
+        if magic != BINARY_WORDS_MAGIC:
+            raise ValueError(words + " is not a " + BINARY_WORDS_MAGIC.decode("ascii") + " file")
+        block_count = -(-self.term_count // TERMS_PER_BLOCK)
+        # where each block starts in the streams, followed by where the last one ends
+        self.blocks = np.frombuffer(self.dictionary_map, dtype=BINARY_BLOCK_ENTRY, count=block_count + 1,
+                                    offset=BINARY_WORDS_HEADER.size)
+        # where each stream starts in the file
+        self.lengths_start = BINARY_WORDS_HEADER.size + self.blocks.nbytes
+        self.suffixes_start = self.lengths_start + int(self.blocks[-1]["lengths_offset"])
+        self.counts_start = self.suffixes_start + int(self.blocks[-1]["suffixes_offset"])
+        # the last block decoded, as (block number, terms, counts, postings offsets): a term is usually
+        # looked up and then has its postings read
+        self.last_block = None
+        # the first terms of the blocks read so far: every binary search goes through the same few blocks first
+        self.first_terms = {}
+        with open(postings_path(words), "rb") as postings_fh:
+            # an empty postings file (no terms) cannot be memory-mapped
+            if os.fstat(postings_fh.fileno()).st_size > 0:
+                self.postings_map = mmap.mmap(postings_fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.postings_map = b""
+
+    def read_blocks(self, first: int, last: int):
+        """
+        Decodes a range of blocks at once, which are next to each other in every stream
+        :param first: the number of the first block
+        :param last: the number of the block after the last one
+        :return: the terms of the blocks as UTF-8 bytes, an array of the number of pages of the shard and of
+        the corpus each one appears in, and an array of where the postings of each one start in the postings
+        file, followed by where those of the last one end
+        """
+        low, high = self.blocks[first], self.blocks[last]
+        lengths_offset, suffixes_offset, counts_offset = (int(low[field]) for field in
+                                                          ("lengths_offset", "suffixes_offset", "counts_offset"))
+        lengths = decode_varints(self.dictionary_map, int(high["lengths_offset"]) - lengths_offset,
+                                 self.lengths_start + lengths_offset).tolist()
+        suffixes = self.dictionary_map[self.suffixes_start + suffixes_offset:
+                                       self.suffixes_start + int(high["suffixes_offset"])]
+        terms = []
+        term = b""
+        position = 0
+        for shared, length in zip(lengths[::2], lengths[1::2]):
+            term = term[:shared] + suffixes[position:position + length]
+            terms.append(term)
+            position += length
+        counts = decode_varints(self.dictionary_map, int(high["counts_offset"]) - counts_offset,
+                                self.counts_start + counts_offset).astype(np.int64).reshape(len(terms), 3)
+        postings_offsets = np.empty(len(terms) + 1, dtype=np.int64)
+        postings_offsets[0] = int(low["postings_offset"])
+        np.cumsum(counts[:, 2], out=postings_offsets[1:])
+        postings_offsets[1:] += postings_offsets[0]
+        counts[:, 1] += counts[:, 0]
+        return terms, counts[:, :2], postings_offsets
+
+    def block(self, i: int):
+        """
+        Decodes the block holding the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: the position of the first term of the block and what read_blocks gives for it
+        """
+        number = i // TERMS_PER_BLOCK
+        if self.last_block is None or self.last_block[0] != number:
+            self.last_block = (number, *self.read_blocks(number, number + 1))
+        return number * TERMS_PER_BLOCK, self.last_block[1:]
+
+    def first_term(self, number: int):
+        """
+        Reads the first term of a block, which is stored whole
+        :param number: the number of the block
+        :return: the term as UTF-8 bytes
+        """
+        if number in self.first_terms:
+            return self.first_terms[number]
+        entry = self.blocks[number]
+        # skips the length of the shared prefix, which is 0, and reads the length of the term
+        position = self.lengths_start + int(entry["lengths_offset"]) + 1
+        length, shift = 0, 0
+        while True:
+            byte = self.dictionary_map[position]
+            length |= (byte & DATA_MASK) << shift
+            if byte < MORE_FLAG:
+                break
+            position += 1
+            shift += DATA_BITS
+        start = self.suffixes_start + int(entry["suffixes_offset"])
+        self.first_terms[number] = self.dictionary_map[start:start + length]
+        return self.first_terms[number]
+
+    def term_at(self, i: int):
+        """
+        Reads the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: the term as UTF-8 bytes
+        """
+        first, (terms, _, _) = self.block(i)
+        return terms[i - first]
+
+    def lower_bound(self, term: bytes):
+        """
+        Binary searches the first terms of the blocks for the last block that starts before a given term, then
+        that block for the first term that is not before it
+        :param term: the term, as UTF-8 bytes
+        :return: the position of that term in the dictionary (the number of terms if there is none)
+        """
+        low, high = 0, len(self.blocks) - 1
+        while low < high:
+            mid = (low + high) // 2
+            if self.first_term(mid) < term:
+                low = mid + 1
+            else:
+                high = mid
+        if low == 0:
+            return 0
+        first, (terms, _, _) = self.block((low - 1) * TERMS_PER_BLOCK)
+        return first + bisect_left(terms, term)
+
+    def postings_at(self, i: int):
+        """
+        Decodes the postings of the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: a pair of arrays (doc ids, frequencies) sorted by doc id
+        """
+        first, (_, counts, postings_offsets) = self.block(i)
+        start, end = postings_offsets[i - first:i - first + 2].tolist()
+        return decode_postings(self.postings_map, end - start, int(counts[i - first, 0]), start)
+
+    def postings(self, word: str):
+        """
+        Decodes the postings of a word
+        :param word: the word to look up
+        :return: a pair of arrays (doc ids, frequencies) sorted by doc id, or None if the word is not in the index
+        """
+        i = self.find(word)
+        if i == -1:
+            return None
+        return self.postings_at(i)
+
+    def idf(self, word: str):
+        """
+        Computes the inverse document frequency of a word from the number of pages of the corpus it appears in
+        :param word: the word to look up
+        :return: the idf of the word, or None if the word is not in the index
+        """
+        i = self.find(word)
+        if i == -1:
+            return None
+        first, (_, counts, _) = self.block(i)
+        return math.log(self.total_pages / int(counts[i - first, 1]))
+
+    def sorted_term(self, i: int):
+        """
+        Gets the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: the term
+        """
+        return self.term_at(i).decode("utf-8")
+
+    def sorted_range(self, low: int, high: int):
+        """
+        Decodes the blocks holding a range of terms of the sorted term dictionary
+        :param low: position of the first term
+        :param high: position after the last term
+        :return: the position of the first term of the first block and what read_blocks gives for the blocks
+        """
+        first = low // TERMS_PER_BLOCK
+        return first * TERMS_PER_BLOCK, self.read_blocks(first, -(-high // TERMS_PER_BLOCK))
+
+    def sorted_terms_between(self, low: int, high: int):
+        """
+        Reads a range of terms of the sorted term dictionary at once
+        :param low: position of the first term
+        :param high: position after the last term
+        :return: the list of the terms
+        """
+        if low >= high:
+            return []
+        first, (terms, _, _) = self.sorted_range(low, high)
+        return [term.decode("utf-8") for term in terms[low - first:high - first]]
+
+    def sorted_idfs(self, low: int, high: int):
+        """
+        Gets the idf of a range of terms of the sorted term dictionary at once
+        :param low: position of the first term
+        :param high: position after the last term
+        :return: an array of the idf of each term
+        """
+        if low >= high:
+            return np.zeros(0)
+        first, (_, counts, _) = self.sorted_range(low, high)
+        return np.array([math.log(self.total_pages / count) for count in counts[low - first:high - first, 1].tolist()])
+
+    def sorted_postings(self, i: int):
+        """
+        Decodes the postings of the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: a pair of arrays (doc ids, frequencies) sorted by doc id
+        """
+        return self.postings_at(i)
+
+    def __getitem__(self, word: str):
+        found = self.postings(word)
+        if found is None:
+            raise KeyError(word)
+        id_nums, frequencies = found
+        return dict(zip(id_nums.tolist(), frequencies.tolist()))
+
+    def items(self):
+        """
+        Reads every term's postings in term order, decoding the whole dictionary and postings file at once
+        :return: a generator of (word, ids_to_frequency) pairs
+        """
+        if self.term_count == 0:
+            return
+        terms, counts, postings_offsets = self.read_blocks(0, len(self.blocks) - 1)
+        values = decode_varints(self.postings_map, int(postings_offsets[-1]))
+        doc_counts = counts[:, 0]
+        starts = np.cumsum(doc_counts) - doc_counts
+        # every term's gaps are followed by as many frequencies
+        gap_positions = np.arange(int(doc_counts.sum())) + np.repeat(starts, doc_counts)
+        gaps = values[gap_positions]
+        totals = np.cumsum(gaps)
+        # undoes the gaps term by term: subtracts everything summed up before the term's first doc id
+        id_nums = (totals - np.repeat(totals[starts] - gaps[starts], doc_counts)).tolist()
+        frequencies = values[gap_positions + np.repeat(doc_counts, doc_counts)].tolist()
+        for term, start, end in zip(terms, starts.tolist(), (starts + doc_counts).tolist()):
+            yield term.decode("utf-8"), dict(zip(id_nums[start:end], frequencies[start:end]))
+
+    def __contains__(self, word):
+        return isinstance(word, str) and self.find(word) != -1
+
+    def __iter__(self):
+        if self.term_count:
+            for term in self.read_blocks(0, len(self.blocks) - 1)[0]:
+                yield term.decode("utf-8")
+
+    def __len__(self):
+        return self.term_count
+
+    def close(self):
+        """
+        Unmaps the words and postings files
+        :return: n/a
+        """
+        self.blocks = None
+        self.last_block = None
+        self.first_terms = {}
+        self.dictionary_map.close()
+        if isinstance(self.postings_map, mmap.mmap):
+            self.postings_map.close()
+
+
+class ArrayWordsIndex(Mapping):
+    """
+    A compact in-memory copy of a text words file that behaves like the words -> ids -> frequency
+    dictionary filled by read_words_file
+    Every term is interned and numbered, and the postings of all terms are packed into two flat arrays
+    (doc ids and frequencies, 4 bytes each, sorted by doc id within a term) instead of a dictionary per
+    term, which costs hundreds of bytes per posting
+    """
+
+    def __init__(self, words: str = None, total_pages: int = 0, doc_counts: dict = None):
+        """
+        :param words: filepath to a text words file, as written by write_words_file (an empty index if None)
+        :param total_pages: the number of pages in the corpus, which idf is computed from
+        :param doc_counts: maps each word to the number of pages of the corpus it appears in, when the words
+        file only holds a shard of the corpus (by default, the length of its postings)
+        """
+        self.total_pages = total_pages
+        # maps each term to its term id
+        self.term_ids = {}
+        # the terms, by term id
+        self.terms = []
+        # the postings of term t are doc_ids[offsets[t]:offsets[t+1]] (and the same slice of frequencies)
+        offsets = [0]
+        id_chunks = []
+        frequency_chunks = []
+        if words is not None:
+            with open(words, "r") as words_fh:
+                for line in words_fh:
+                    word, _, postings = line.strip().partition(" ")
+                    if word == "":
+                        continue
+                    values = np.fromstring(postings, dtype=np.int64, sep=" ")
+                    id_nums, frequencies = values[0::2], values[1::2]
+                    order = np.argsort(id_nums, kind="stable")
+                    self.term_ids[sys.intern(word)] = len(self.terms)
+                    self.terms.append(word)
+                    id_chunks.append(id_nums[order])
+                    frequency_chunks.append(frequencies[order])
+                    offsets.append(offsets[-1] + len(id_nums))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.concatenate(id_chunks).astype(np.uint32) if id_chunks else np.zeros(0, dtype=np.uint32)
+        self.frequencies = np.concatenate(frequency_chunks).astype(np.uint32) if frequency_chunks \
+            else np.zeros(0, dtype=np.uint32)
+        # the number of pages each term appears in, by term id, which idf is computed from
+        if doc_counts is not None:
+            self.doc_counts = np.array([doc_counts[word] for word in self.terms], dtype=np.int64)
+        else:
+            self.doc_counts = np.diff(self.offsets)
+        # the terms in sorted order, their term ids and their idf, built the first time a prefix is looked up
+        self.sorted_terms = None
+        self.sorted_ids = None
+        self.sorted_idf_array = None
+
+    def postings(self, word: str):
+        """
+        Gets the postings of a word without copying them
+        :param word: the word to look up
+        :return: a pair of arrays (doc ids, frequencies) sorted by doc id, or None if the word is not in the index
+        """
+        term_id = self.term_ids.get(word)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.frequencies[start:end]
+
+    def idf(self, word: str):
+        """
+        Computes the inverse document frequency of a word
+        :param word: the word to look up
+        :return: the idf, or None if the word is not in the index
+        """
+        term_id = self.term_ids.get(word)
+        if term_id is None:
+            return None
+        return math.log(self.total_pages/int(self.doc_counts[term_id]))
+
+    def prefix_range(self, prefix: str):
+        """
+        Finds the terms that start with a prefix, which are next to each other once the terms are sorted
+        :param prefix: the prefix
+        :return: a pair of positions (low, high): the sorted terms at positions low to high - 1 start with the prefix
+        """
+        if self.sorted_terms is None:
+            self.sorted_ids = sorted(range(len(self.terms)), key=self.terms.__getitem__)
+            self.sorted_terms = [self.terms[term_id] for term_id in self.sorted_ids]
+            # computed the same way as idf, so that a term weighs the same whether or not it was expanded
+            self.sorted_idf_array = np.array([math.log(self.total_pages/doc_count)
+                                              for doc_count in self.doc_counts[self.sorted_ids].tolist()])
+        # no character sorts after U+10FFFF, so every term starting with the prefix sorts before the prefix
+        # followed by it
+        return bisect_left(self.sorted_terms, prefix), bisect_left(self.sorted_terms, prefix + "\U0010ffff")
+
+    def sorted_term(self, i: int):
+        """
+        Gets the i-th term in sorted order (prefix_range sorts the terms)
+        :param i: position of the term in sorted order
+        :return: the term
+        """
+        return self.sorted_terms[i]
+
+    def sorted_terms_between(self, low: int, high: int):
+        """
+        Gets a range of terms in sorted order (prefix_range sorts the terms)
+        :param low: position of the first term
+        :param high: position after the last term
+        :return: the list of the terms
+        """
+        return self.sorted_terms[low:high]
+
+    def sorted_idfs(self, low: int, high: int):
+        """
+        Gets the idf of a range of terms in sorted order at once (prefix_range sorts the terms)
+        :param low: position of the first term
+        :param high: position after the last term
+        :return: an array of the idf of each term
+        """
+        return self.sorted_idf_array[low:high]
+
+    def sorted_postings(self, i: int):
+        """
+        Gets the postings of the i-th term in sorted order (prefix_range sorts the terms) without copying them
+        :param i: position of the term in sorted order
+        :return: a pair of arrays (doc ids, frequencies) sorted by doc id
+        """
+        term_id = self.sorted_ids[i]
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.frequencies[start:end]
+
+    def __getitem__(self, word: str):
+        found = self.postings(word)
+        if found is None:
+            raise KeyError(word)
+        id_nums, frequencies = found
+        return dict(zip(id_nums.tolist(), frequencies.tolist()))
+
+    def __contains__(self, word):
+        return word in self.term_ids
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class PositionsIndex(SortedTermDictionary):
+    """
+    A read-only, memory-mapped view of a positions file; a term's positions are only decoded when asked for
+    """
+
+    def __init__(self, positions: str):
+        self.open_dictionary(positions, POSITIONS_MAGIC, POSITIONS_TERM_ENTRY)
+
+    def positions_at(self, i: int):
+        """
+        Decodes the positions of the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: a triple of arrays (doc ids, offsets, positions), see decode_positions
+        """
+        entry = self.entries[i]
+        return decode_positions(self.dictionary_map, int(entry["positions_length"]), int(entry["doc_count"]),
+                                int(entry["positions_offset"]))
+
+    def positions(self, word: str):
+        """
+        Decodes the positions of a word
+        :param word: the word to look up
+        :return: a triple of arrays (doc ids, offsets, positions) with the doc ids sorted, so that the
+        positions in the k-th doc are positions[offsets[k]:offsets[k+1]], or None if the word is not in the index
+        """
+        i = self.find(word)
+        if i == -1:
+            return None
+        return self.positions_at(i)
+
+    def items(self):
+        """
+        Reads every term's positions in term order
+        :return: a generator of (word, ids_to_positions) pairs
+        """
+        for i in range(self.term_count):
+            id_nums, offsets, positions = self.positions_at(i)
+            yield self.term_at(i).decode("utf-8"), {id_num: positions[offsets[k]:offsets[k + 1]].tolist()
+                                                    for k, id_num in enumerate(id_nums.tolist())}
+
+    def close(self):
+        """
+        Unmaps the positions file
+        :return: n/a
+        """
+        self.entries = None
+        self.dictionary_map.close()
+
+
+class TiersIndex(SortedTermDictionary):
+    """
+    A read-only, memory-mapped view of a tiers file; a term's first tier is only decoded when asked for
+    """
+
+    def __init__(self, tiers: str):
+        _, _, self.fraction = self.open_dictionary(tiers, TIERS_MAGIC, TIERS_TERM_ENTRY, TIERS_HEADER)
+
+    def tier_at(self, i: int):
+        """
+        Decodes the first tier of the i-th term of the sorted term dictionary
+        :param i: position of the term in the dictionary
+        :return: a triple of the arrays (doc ids, frequencies) of the first tier postings, sorted by doc id,
+        and the bound on the page-rank-scaled weight of the term in any other page (None if there is none)
+        """
+        entry = self.entries[i]
+        id_nums, frequencies = decode_postings(self.dictionary_map, int(entry["tier_length"]),
+                                               int(entry["tier_count"]), int(entry["tier_offset"]))
+        rest_bound = float(entry["rest_bound"]) if entry["doc_count"] > entry["tier_count"] else None
+        return id_nums, frequencies, rest_bound
+
+    def tier(self, word: str):
+        """
+        Decodes the first tier of a word
+        :param word: the word to look up
+        :return: a triple of the first tier (doc ids, frequencies) and the bound on the rest, see tier_at,
+        or None if the word is not in the index
+        """
+        i = self.find(word)
+        if i == -1:
+            return None
+        return self.tier_at(i)
+
+    def close(self):
+        """
+        Unmaps the tiers file
+        :return: n/a
+        """
+        self.entries = None
+        self.dictionary_map.close()
+
+
+class TrigramIndex(SortedTermDictionary):
+    """
+    A read-only, memory-mapped view of a trigrams file: the vocabulary of the corpus, with the number of pages
+    each term appears in, and the terms that contain each character trigram, decoded when asked for
+    """
+
+    def __init__(self, trigrams: str):
+        _, _, gram_count, grams_offset = self.open_dictionary(trigrams, TRIGRAMS_MAGIC, TRIGRAMS_TERM_ENTRY,
+                                                              TRIGRAMS_HEADER)
+        self.grams = np.frombuffer(self.dictionary_map, dtype=TRIGRAM_TYPE, count=gram_count, offset=grams_offset)
+        # where the terms containing each trigram start in the list block, followed by where the block ends
+        self.gram_offsets = np.frombuffer(self.dictionary_map, dtype="<u8", count=gram_count + 1,
+                                          offset=grams_offset + self.grams.nbytes)
+        # where the list block starts in the file
+        self.lists_start = grams_offset + self.grams.nbytes + self.gram_offsets.nbytes
+
+    def terms_with(self, gram: str):
+        """
+        Decodes the terms that contain a trigram
+        :param gram: the trigram
+        :return: an array of the positions of those terms in the term dictionary, in ascending order
+        """
+        encoded = gram.encode("utf-8")
+        i = int(np.searchsorted(self.grams, encoded))
+        if i == len(self.grams) or self.grams[i] != encoded:
+            return np.zeros(0, dtype=np.uint64)
+        start, end = int(self.gram_offsets[i]), int(self.gram_offsets[i + 1])
+        return np.cumsum(decode_varints(self.dictionary_map, end - start, self.lists_start + start))
+
+    def terms_at(self, positions: np.ndarray):
+        """
+        Reads many terms of the term dictionary at once
+        :param positions: the positions of the terms in the dictionary
+        :return: a pair of the terms, one per row of a matrix of UTF-8 bytes padded with zero bytes, and their lengths
+        """
+        lengths = self.entries["term_length"][positions].astype(np.int64)
+        starts = self.terms_start + self.entries["term_offset"][positions].astype(np.int64)
+        columns = np.arange(int(lengths.max()) if len(lengths) else 0)
+        block = np.frombuffer(self.dictionary_map, dtype=np.uint8)
+        terms = block[np.minimum(starts[:, None] + columns, len(block) - 1)]
+        terms[columns >= lengths[:, None]] = 0
+        return terms, lengths
+
+    def close(self):
+        """
+        Unmaps the trigrams file
+        :return: n/a
+        """
+        self.entries = None
+        self.grams = None
+        self.gram_offsets = None
+        self.dictionary_map.close()
@@ -0,0 +1,81 @@
+"""
+Provides the typo-tolerant matching of query words the querier falls back on for words that are not in the index
+Every index term is broken into its character trigrams, padded at both ends so that its first and last letters
+count as much as the others: "celtic" gives $$c $ce cel elt lti tic ic$ c$$
+Typos are counted as edits: a letter inserted, deleted or substituted, or two neighbouring letters swapped (the
+optimal string alignment distance). A word within k edits of a term shares all but at most 4k of its distinct
+trigrams with it (an edit only changes the trigrams that overlap it, and a swap overlaps four), so the candidate
+corrections of a word are shortlisted from the terms that share enough of its trigrams, found in the trigram index
+written by the indexer, and only the shortlist is checked with the edit distance, computed for all of them at once
+"""
+import numpy as np
+
+# length of the character n-grams terms are broken into
+GRAM_LENGTH = 3
+# largest number of trigrams of a word a single edit changes (a swap of two letters)
+GRAMS_PER_EDIT = GRAM_LENGTH + 1
+# character the words are padded with, which no index term contains
+PADDING = "$"
+
+
+def grams(word: str):
+    """
+    Breaks a word into its distinct character trigrams, padded at both ends
+    :param word: the word
+    :return: the sorted list of its distinct trigrams
+    """
+    padded = PADDING * (GRAM_LENGTH - 1) + word + PADDING * (GRAM_LENGTH - 1)
+    return sorted({padded[i:i + GRAM_LENGTH] for i in range(len(padded) - GRAM_LENGTH + 1)})
+
+
+def max_distance(word: str):
+    """
+    Gives how many edits a correction of a word may be away from it: none for words of one or two letters,
+    whose corrections would be almost any short word, one up to five letters and two beyond
+    :param word: the word
+    :return: the largest edit distance of a correction
+    """
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+def min_shared_grams(word: str, distance: int):
+    """
+    Gives how many of its distinct trigrams a term within an edit distance of a word at least shares with it
+    :param word: the word
+    :param distance: the edit distance
+    :return: the least number of shared trigrams (at least 1, so that the shortlist only holds terms that
+    share something with the word)
+    """
+    return max(1, len(grams(word)) - GRAMS_PER_EDIT * distance)
+
+
+def edit_distances(word: str, terms: np.ndarray, lengths: np.ndarray):
+    """
+    Computes the edit distances between a word and many terms at once (insertions, deletions, substitutions and
+    swaps of neighbouring letters, each letter being edited once at most), filling the dynamic programming table
+    one row (one letter of the word) at a time for every term
+    Within a row, an insertion depends on the cell to its left, so the cells are the running minimum of the
+    substitutions and deletions, each plus the number of insertions after it
+    :param word: the word, of ASCII characters
+    :param terms: the terms, one per row as bytes padded with zero bytes
+    :param lengths: the length of each term
+    :return: an array of the edit distance between the word and each term
+    """
+    count, width = terms.shape
+    # one term per column, so that the running minimum goes down contiguous rows of every term at once
+    terms = np.ascontiguousarray(terms.T)
+    columns = np.arange(1, width + 1, dtype=np.int16)[:, None]
+    before, previous = None, np.repeat(np.arange(width + 1, dtype=np.int16)[:, None], count, axis=1)
+    encoded = word.encode("utf-8")
+    for i, letter in enumerate(encoded, 1):
+        steps = np.minimum(previous[:-1] + (terms != letter), previous[1:] + 1)
+        if i > 1:
+            swapped = (terms[:-1] == letter) & (terms[1:] == encoded[i - 2])
+            steps[1:] = np.where(swapped, np.minimum(steps[1:], before[:-2] + 1), steps[1:])
+        current = np.empty_like(previous)
+        current[0] = i
+        current[1:] = np.minimum(np.minimum.accumulate(steps - columns, axis=0), i) + columns
+        before, previous = previous, current
+    return previous[lengths, np.arange(count)]
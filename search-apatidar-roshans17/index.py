@@ -1,25 +1,69 @@
 import argparse
-import string
-import math
+import json
+import os
 import sys
-from tokenize import Ignore
 import xml.etree.ElementTree as et
-import re
 
+from collections import deque
+from contextlib import nullcontext
+from itertools import chain
 from math import sqrt
-from xml.dom.minidom import Element
-from attr import NOTHING
-from nltk.corpus import stopwords
-from pytest import File
-STOP_WORDS = set(stopwords.words('english'))
-from nltk.stem import PorterStemmer
-nltk_test = PorterStemmer()
-from file_io import write_title_file, write_docs_file, write_words_file
+from analysis import ANALYZER, PAGE_TOKEN_REGEX, LINK_WORD_REGEX
+from file_io import write_title_file, write_docs_file, write_words_file, write_binary_words_file, \
+    write_links_file, links_path, read_title_file, read_docs_file, read_words_file, read_links_file, \
+    is_binary_words_file, BinaryWordsIndex, write_positions_file, positions_path, PositionsIndex, \
+    write_tiers_file, tiers_path, TiersIndex, shard_path, idf_path, write_idf_file, write_graph_file, graph_path, \
+    new_version_directory, write_manifest, read_manifest, remove_old_versions, write_trigrams_file, trigrams_path
+from minhash import NearDuplicates, signature, THRESHOLD
+from pagerank import LinkGraph, compress_links
+from spimi import SpilledWords, block_size_for
+from profiling import Profiler
+
+# number of pages handed to a worker process at a time
+WORKER_CHUNK_SIZE = 64
+
+
+def index_pages(pages: list, positions: bool = False, dedupe: float = None):
+    """
+    Indexes a chunk of pages in a worker process into a partial index
+    Links are left unresolved, since titles are only known globally to the parent process, and so are
+    near-duplicates, since a page is compared with every page before it
+    :param pages: a list of (doc ID, title, text) tuples
+    :param positions: indicator to record the position of every word
+    :param dedupe: the similarity from which pages are near-duplicates, to compute the signature of every page
+    :return: the partial words dictionary, link titles, maximum word counts, positions and signatures of the pages
+    """
+    partial = Index(None, streaming=True, positions=positions)
+    partial.dedupe = dedupe
+    for doc_id, title, text in pages:
+        partial.index_page(doc_id, title, text)
+    return partial.words_dict, partial.link_titles, partial.max_word_dict, partial.positions_dict, partial.signatures
+
 
 class Index:
-    def __init__(self, xml: str):
-        self.tree = et.parse(xml)
-        self.root = self.tree.getroot()
+    def __init__(self, xml: str, streaming: bool = False, workers: int = 1, block_size: int = None,
+                 temp_dir: str = None, profiler: Profiler = None, positions: bool = False, dedupe: float = None):
+        """
+        Builds the index of a wiki XML file; if no file is given, the index starts out empty
+        :param xml: path to the XML file to index
+        :param streaming: indicator to parse the XML one page at a time instead of loading the whole tree
+        :param workers: number of worker processes that tokenize, stop and stem pages
+        :param block_size: if given, the number of postings held in memory before they are written to a
+        sorted run on disk; words_dict is then a SpilledWords that merges the runs when it is read
+        :param temp_dir: directory the runs are written to (a temporary directory by default)
+        :param profiler: if given, times each phase of the build and the indexing of each page and link
+        :param positions: indicator to also record the position of every word in its page, for phrase queries
+        :param dedupe: if given, the Jaccard similarity of their shingles from which a page is a near-duplicate of
+        a page read before it; near-duplicates are collapsed into that page instead of being indexed (see minhash.py)
+        """
+        if positions and block_size:
+            raise ValueError("positions cannot be recorded by a block build")
+        # path to the XML file being indexed
+        self.xml = xml
+        # indicator to parse the XML incrementally, one page at a time
+        self.streaming = streaming
+        # number of processes pages are spread across
+        self.workers = workers
         # titles_dict 
         self.title_dict = {}
         # words_dict
@@ -36,10 +80,83 @@ class Index:
         self.max_word_dict = {}
         # tracks the number of pages
         self.pageTracker = 0
+        # maps each document ID to the titles of the pages it links to (kept so the links can be resolved
+        # again when the set of titles changes); resolved into links_dict once all titles are known
+        self.link_titles = {}
+        # number of iterations the last PageRank run took
+        self.page_rank_iterations = 0
+        # the link graph of the last PageRank run, written to the link graph file
+        self.link_graph = None
+        # number of postings held in memory before they are flushed to a run
+        self.block_size = block_size
+        # number of postings in the in-memory words dictionary
+        self.posting_count = 0
+        # the runs that full blocks were flushed to
+        self.spilled_words = SpilledWords(temp_dir) if block_size else None
+        # records the time spent in each phase when profiling
+        self.profiler = profiler
+        # stops and stems a word through the shared analyzer's cache, timed as a stage of its own when profiling
+        self.term = ANALYZER.term if profiler is None else profiler.timed("term", ANALYZER.term)
+        # the distance between successive rank vectors after each iteration of the last PageRank run
+        self.page_rank_residuals = []
+        # indicator to record the position of every word
+        self.record_positions = positions
+        # maps each word to a map of document IDs and the positions of that word in the document
+        self.positions_dict = {}
+        # the Jaccard similarity from which a page is a near-duplicate of a page read before it
+        self.dedupe = dedupe
+        # the signatures of the pages read so far that are not near-duplicates
+        self.near_duplicates = NearDuplicates(dedupe) if dedupe is not None else None
+        # maps the document ID of each page collapsed as a near-duplicate to the ID of the page it duplicates
+        self.duplicate_of = {}
+        # number of postings that near-duplicates would have added to the words dictionary
+        self.duplicate_postings = 0
+        # maps the document ID of each page parsed by a worker process to its signature, until it is merged
+        self.signatures = {}
 
-        self.title_parse()
-        self.word_parse()
-        self.page_rank()
+        if profiler is not None:
+            profiler.instrument(self, ["index_page", "populate_links_dict"] +
+                                (["deduplicate", "collapse"] if dedupe is not None else []))
+        if xml is None:
+            return
+        if self.workers > 1:
+            with self.phase("parallel_parse"):
+                self.parallel_parse()
+            with self.phase("resolve_links"):
+                self.resolve_links()
+        elif self.streaming:
+            with self.phase("stream_parse"):
+                self.stream_parse()
+            with self.phase("resolve_links"):
+                self.resolve_links()
+        else:
+            with self.phase("xml_parse"):
+                self.tree = et.parse(xml)
+                self.root = self.tree.getroot()
+            with self.phase("title_parse"):
+                self.title_parse()
+            with self.phase("word_parse"):
+                self.word_parse()
+        if self.duplicate_of:
+            with self.phase("redirect_links"):
+                self.redirect_links()
+        if self.spilled_words is not None:
+            with self.phase("flush_block"):
+                self.spilled_words.flush(self.words_dict)
+            self.words_dict = self.spilled_words
+        with self.phase("page_rank"):
+            self.page_rank()
+
+    def phase(self, name: str):
+        """
+        Times a phase of the build when profiling
+        :param self
+        :param name: the name of the phase
+        :return: a context manager that times the code it wraps, or does nothing when not profiling
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name)
 
     def title_parse(self):
         """
@@ -50,9 +167,18 @@ class Index:
         :return: n/a
         """
         for child in self.root: 
-            self.title_dict[int(child.find('id').text.strip())] = child.find('title').text.strip()
-            self.internal_titles_dict[child.find('title').text.strip().lower()] = int(child.find('id').text.strip())
-            self.pageTracker +=1
+            self.add_title(child)
+
+    def add_title(self, child: et.Element):
+        """
+        Records the ID and title of a single page
+        :param self
+        :param child: an element (page from the XML file)
+        :return: n/a
+        """
+        self.title_dict[int(child.find('id').text.strip())] = child.find('title').text.strip()
+        self.internal_titles_dict[child.find('title').text.strip().lower()] = int(child.find('id').text.strip())
+        self.pageTracker +=1
 
     def word_parse(self):
         """ 
@@ -62,86 +188,278 @@ class Index:
         :return: n/a
         """
         for child in self.root:
-            curr_word_list = self.tokenize(child)
-            titleList = self.tokenize_title(child)
-            curr_word_list = curr_word_list + titleList
-            doc_id = int(child.find('id').text.strip())
-            curr_word_list = self.stop_stem(curr_word_list)
-            self.link(doc_id, curr_word_list)
-
-    def tokenize(self, child: Element):
-        """
-        Utilizes regex to tokenize the text
-        :param self: an element (child from the XML file)
-        :return: tokenized text
-        """
-        n_regex = '''\[\[[^\[]+?\]\]|[a-zA-Z0-9]+'[a-zA-Z0-9]+|[a-zA-Z0-9]+'''
-        cool_tokens = re.findall(n_regex, child.find('text').text.strip())
-        return cool_tokens
-    
-    def tokenize_title(self, child: Element):
+            self.parse_page(child)
+
+    def parse_page(self, child: et.Element):
         """
-        Utilizes regex to tokenize the title
-        :param self: an element (child from the XML file)
-        :return: tokenized text 
+        Reads the ID, title and text of a page element and indexes them
+        :param self
+        :param child: an element (page from the XML file)
+        :return: n/a
         """
-        n_regex = '''\[\[[^\[]+?\]\]|[a-zA-Z0-9]+'[a-zA-Z0-9]+|[a-zA-Z0-9]+'''
-        cool_tokens = re.findall(n_regex, child.find('title').text.strip())
-        return cool_tokens
+        doc_id = int(child.find('id').text.strip())
+        self.index_page(doc_id, child.find('title').text.strip(), child.find('text').text.strip())
 
-    def stop_stem(self, curr_word_list: list):
+    def index_page(self, doc_id: int, title: str, text: str):
         """
-        Removes stop and stem words from the text
-        :param self: list of words that need to be cleaned of stop and stem words
-        :return: an updated list of strings without stop and stem words
+        Indexes the text and then the title of a page in a single pass: one precompiled pattern finds every
+        word and link, each word is stopped and stemmed by the shared analyzer, and a link's target is recorded
+        while the words of its text (the part after the pipe, if any) are indexed in its place
+        The page's words are counted locally and added to the words dictionary once the page is done, unless
+        the page is a near-duplicate of a page read before it
+        Any text that is not a link is only stored in the words dictionary
+        :param self
+        :param doc_id: the ID of the document
+        :param title: the title of the page
+        :param text: the text of the page
+        :return: n/a
         """
-        updated_word_list = []
-        for word in curr_word_list:
-                lower_case_words = word.lower()
-                if lower_case_words not in STOP_WORDS:
-                    removed_stem_word = nltk_test.stem(lower_case_words)
-                    updated_word_list.append(removed_stem_word)
-        return updated_word_list
-     
-    def link(self, doc_id: int, word_list: list):
+        self.links_dict[doc_id] = set()
+        self.link_titles[doc_id] = []
+        term = self.term
+        counts = {}
+        positions = {} if self.record_positions else None
+        # the terms of the page in order, which its shingles are made of
+        terms = [] if self.dedupe is not None else None
+        # position of the next word of the page, counting only the words that are indexed
+        position = 0
+        for link, word in chain(PAGE_TOKEN_REGEX.findall(text), PAGE_TOKEN_REGEX.findall(title)):
+            if word:
+                found = (term(word),)
+            else:
+                # links are analyzed lowercased, the titles they point to included
+                link = link.lower()
+                link_to_add, pipe, link_text = link.partition('|')
+                # accounting for potential pipes in links: the text is what comes before a second pipe
+                link_text = link_text.partition('|')[0] if pipe else link
+                self.populate_links_dict(doc_id, link_to_add)
+                found = [term(link_word) for link_word in LINK_WORD_REGEX.findall(link_text)]
+            for word_to_add in found:
+                if word_to_add is None:
+                    continue
+                counts[word_to_add] = counts.get(word_to_add, 0) + 1
+                if terms is not None:
+                    terms.append(word_to_add)
+                if positions is not None:
+                    positions.setdefault(word_to_add, []).append(position)
+                    position += 1
+        if terms is not None and self.deduplicate(doc_id, terms):
+            self.duplicate_postings += len(counts)
+            return
+        self.add_counts(doc_id, counts, positions)
+        self.check_block()
+
+    def deduplicate(self, doc_id: int, terms: list):
         """
-        Parses through the links within each document and populates them into both the words 
-        dictionary and the links dictionary
-        Any text that is not a link will also be stored in the words dictionary
+        Computes the MinHash signature of a page and collapses the page if it is a near-duplicate
+        A worker process only keeps the signature, since the page is compared with the pages before it once merged
         :param self
         :param doc_id: the ID of the document
-        :param word_list: the list of words to be parsed through
+        :param terms: the terms of the page, in order
+        :return: True if the page was collapsed into a page read before it, False otherwise
+        """
+        page_signature = signature(terms)
+        if page_signature is None:
+            return False
+        if self.near_duplicates is None:
+            self.signatures[doc_id] = page_signature
+            return False
+        return self.collapse(doc_id, page_signature)
+
+    def collapse(self, doc_id: int, page_signature):
+        """
+        Collapses a page into the page read before it that it is a near-duplicate of, if there is one: the page
+        is dropped from the titles and links, and its title is pointed at that page so that links to it are
+        resolved to that page; otherwise the page is kept for the pages after it to be compared with
+        :param self
+        :param doc_id: the ID of the document
+        :param page_signature: the MinHash signature of the page
+        :return: True if the page was collapsed, False otherwise
+        """
+        canonical = self.near_duplicates.find(page_signature)
+        if canonical is None:
+            self.near_duplicates.add(doc_id, page_signature)
+            return False
+        self.duplicate_of[doc_id] = canonical
+        title = self.title_dict.pop(doc_id).lower()
+        if self.internal_titles_dict.get(title) == doc_id:
+            self.internal_titles_dict[title] = canonical
+        self.pageTracker -= 1
+        self.links_dict.pop(doc_id, None)
+        self.link_titles.pop(doc_id, None)
+        return True
+
+    def redirect_links(self):
+        """
+        Points the links resolved to pages that were collapsed afterwards at the pages they were collapsed into
+        :param self
         :return: n/a
         """
-        self.links_dict[doc_id] = set()
-        n_regex = '''[a-z]+[a-z]'''
-        link_regex = '''\[\[[^\[]+?\]\]'''
-        for word in word_list:
-            link = re.match(link_regex, word)
-            if link: 
-                # accounting for potential pipes in links
-                if '|' in link[0]: 
-                    split_word_list = word.split('|')
-                    link_to_add = split_word_list[0].replace('[[', "")
-                    word_to_add = split_word_list[1].replace(']]', "")
-                    word_to_add = re.findall(n_regex, word_to_add)
-                    word_to_add = self.stop_stem(word_to_add)
-                    self.populate_links_dict(doc_id, link_to_add)
-                    for word in word_to_add:
-                        self.populate_words_dict(doc_id, word)
-                else:
-                    link = word.replace(']]',"")
-                    link_to_add = link.replace('[[', "")
-                    self.populate_links_dict(doc_id, link_to_add)
-                    word_to_add = re.findall(n_regex, word)
-                    word_to_add = self.stop_stem(word_to_add)
-                    for word in word_to_add:
-                        self.populate_words_dict(doc_id, word)
-            # if it is not a link, we will populate to words dictionary but not links dictionary
+        for doc_id, links in self.links_dict.items():
+            if not links.isdisjoint(self.duplicate_of):
+                self.links_dict[doc_id] = {self.duplicate_of.get(link, link) for link in links}
+
+    def dedupe_stats(self):
+        """
+        Reports how much collapsing near-duplicates shrank the index
+        :param self
+        :return: a dictionary of the number of pages read, pages collapsed, pages they were collapsed into and
+        postings left out
+        """
+        return {"pages": len(self.title_dict) + len(self.duplicate_of), "duplicates": len(self.duplicate_of),
+                "canonical_pages": len(set(self.duplicate_of.values())), "postings_skipped": self.duplicate_postings}
+
+    def add_counts(self, doc_id: int, counts: dict, positions: dict = None):
+        """
+        Adds the word counts of a page to the words dictionary
+        :param self
+        :param doc_id: the ID of the document
+        :param counts: maps each word of the page to the number of times it appears, in order of first appearance
+        :param positions: maps each word of the page to its positions in the page (optional)
+        :return: n/a
+        """
+        words_dict = self.words_dict
+        most = self.max_word_dict.get(doc_id, 0)
+        for word_to_add, count in counts.items():
+            ids_to_counts = words_dict.get(word_to_add)
+            if ids_to_counts is None:
+                words_dict[word_to_add] = ids_to_counts = {}
+            if doc_id in ids_to_counts:
+                count += ids_to_counts[doc_id]
             else:
-                self.populate_words_dict(doc_id, word)
-    
-    def is_in_corpus(self, link_to_add : string):
+                self.posting_count += 1
+            ids_to_counts[doc_id] = count
+            # keeps track of the count of the most frequent word so the querier does not have to
+            if count > most:
+                most = count
+                self.max_word_dict[doc_id] = most
+        for word_to_add, found in (positions or {}).items():
+            self.positions_dict.setdefault(word_to_add, {}).setdefault(doc_id, []).extend(found)
+
+    def check_block(self):
+        """
+        Flushes the in-memory words dictionary to a sorted run once it holds a full block of postings
+        :param self
+        :return: n/a
+        """
+        if self.spilled_words is not None and self.posting_count >= self.block_size:
+            self.spilled_words.flush(self.words_dict)
+            self.words_dict = {}
+            self.posting_count = 0
+
+    def stream_parse(self):
+        """
+        Parses the XML file incrementally so that only one page is held in memory at a time
+        Each page is titled and tokenized as soon as its closing tag is read and is then freed; since
+        a link may point at a page that has not been read yet, links are only recorded here and are
+        resolved to IDs by resolve_links once every title is known
+        :param self
+        :return: n/a
+        """
+        for doc_id, title, text in self.read_pages():
+            self.index_page(doc_id, title, text)
+
+    def read_pages(self):
+        """
+        Reads the XML file incrementally, recording the title of each page as it goes
+        :param self
+        :return: a generator of (doc ID, title, text) tuples, one per page
+        """
+        context = et.iterparse(self.xml, events=('start', 'end'))
+        _, root = next(context)
+        for event, child in context:
+            if event == 'end' and child.tag == 'page':
+                self.add_title(child)
+                yield int(child.find('id').text.strip()), child.find('title').text.strip(), child.find('text').text.strip()
+                # drops the finished page (and anything before it) from the partially built tree
+                root.clear()
+
+    def parallel_parse(self):
+        """
+        Spreads the tokenizing, stopping and stemming of pages across a pool of worker processes
+        Pages are streamed to the workers in chunks of consecutive pages, at most two chunks per worker in
+        flight, and the partial indexes are merged back in page order so that the result is identical to
+        parsing in a single process; links are resolved by resolve_links once every title is known
+        :param self
+        :return: n/a
+        """
+        # only the parallel parse needs worker processes, so a single-process run does not import them
+        import multiprocessing
+        with multiprocessing.Pool(self.workers) as pool:
+            in_flight = deque()
+            chunk = []
+            for page in self.read_pages():
+                chunk.append(page)
+                if len(chunk) == WORKER_CHUNK_SIZE:
+                    in_flight.append(pool.apply_async(index_pages, (chunk, self.record_positions, self.dedupe)))
+                    chunk = []
+                    if len(in_flight) >= 2 * self.workers:
+                        self.merge(*in_flight.popleft().get())
+            if chunk:
+                in_flight.append(pool.apply_async(index_pages, (chunk, self.record_positions, self.dedupe)))
+            while in_flight:
+                self.merge(*in_flight.popleft().get())
+
+    def merge(self, words_dict: dict, link_titles: dict, max_word_dict: dict, positions_dict: dict = None,
+              signatures: dict = None):
+        """
+        Merges the partial index of a chunk of pages into this index
+        The pages of the chunk are checked for near-duplicates first, in page order, and those collapsed are
+        left out of the merge
+        :param self
+        :param words_dict: the partial words dictionary of the chunk
+        :param link_titles: the link titles referenced by each page of the chunk
+        :param max_word_dict: the maximum word count of each page of the chunk
+        :param positions_dict: the positions of the words of each page of the chunk (optional)
+        :param signatures: the MinHash signature of each page of the chunk, when deduplicating (optional)
+        :return: n/a
+        """
+        duplicates = {doc_id for doc_id, page_signature in (signatures or {}).items()
+                      if self.collapse(doc_id, page_signature)}
+        if duplicates:
+            for ids_to_counts in words_dict.values():
+                for doc_id in duplicates.intersection(ids_to_counts):
+                    del ids_to_counts[doc_id]
+                    self.duplicate_postings += 1
+            words_dict = {word: ids_to_counts for word, ids_to_counts in words_dict.items() if ids_to_counts}
+            for ids_to_positions in (positions_dict or {}).values():
+                for doc_id in duplicates.intersection(ids_to_positions):
+                    del ids_to_positions[doc_id]
+            positions_dict = {word: ids_to_positions for word, ids_to_positions in (positions_dict or {}).items()
+                              if ids_to_positions}
+            link_titles = {doc_id: links for doc_id, links in link_titles.items() if doc_id not in duplicates}
+            max_word_dict = {doc_id: most for doc_id, most in max_word_dict.items() if doc_id not in duplicates}
+        for word, ids_to_counts in words_dict.items():
+            if word in self.words_dict:
+                for doc_id, count in ids_to_counts.items():
+                    if doc_id not in self.words_dict[word]:
+                        self.posting_count += 1
+                    self.words_dict[word][doc_id] = self.words_dict[word].get(doc_id, 0) + count
+            else:
+                self.words_dict[word] = ids_to_counts
+                self.posting_count += len(ids_to_counts)
+        for doc_id, links in link_titles.items():
+            self.links_dict[doc_id] = set()
+            self.link_titles[doc_id] = links
+        for doc_id, most in max_word_dict.items():
+            self.max_word_dict[doc_id] = max(most, self.max_word_dict.get(doc_id, 0))
+        for word, ids_to_positions in (positions_dict or {}).items():
+            merged = self.positions_dict.setdefault(word, {})
+            for doc_id, positions in ids_to_positions.items():
+                merged.setdefault(doc_id, []).extend(positions)
+        self.check_block()
+
+    def resolve_links(self):
+        """
+        Resolves the link titles recorded during a streaming parse into the links dictionary
+        :param self
+        :return: n/a
+        """
+        for doc_id, links in self.link_titles.items():
+            for link_to_add in links:
+                self.resolve_link(doc_id, link_to_add)
+
+    def is_in_corpus(self, link_to_add : str):
         """
         Checks whether a link to be added is in the corpus
         :param self
@@ -150,25 +468,27 @@ class Index:
         """
         return link_to_add in self.internal_titles_dict
 
-    def populate_words_dict(self, doc_id: int, word_to_add: string):
+    def populate_links_dict(self, doc_id : int, link_to_add : str):
         """
-        Populates the words dictionary
+        Records the title of a link and populates the links dictionary, deferring the link until all titles
+        are known when streaming
         :param self
         :param doc_id: the ID of the document
-        :param word_to_add: the word to be added
+        :param link_to_add: the title of the page being linked to
+        :return: n/a
+        """
+        self.link_titles[doc_id].append(link_to_add)
+        if not self.streaming:
+            self.resolve_link(doc_id, link_to_add)
+
+    def resolve_link(self, doc_id : int, link_to_add : str):
+        """
+        Adds the ID of the linked page to the links dictionary if the page is in the corpus
+        :param self
+        :param doc_id: the ID of the document
+        :param link_to_add: the title of the page being linked to
         :return: n/a
         """
-        if (word_to_add in self.words_dict):
-            try:
-                self.words_dict[word_to_add][doc_id] = self.words_dict[word_to_add][doc_id] + 1
-            # if the word exists but the document ID is not in the inner dictionary, catch the KeyError that 
-            # it throws and make its value 1
-            except KeyError:
-                self.words_dict[word_to_add][doc_id] = 1
-        else: 
-            self.words_dict[word_to_add] = {doc_id : 1}
-    
-    def populate_links_dict(self, doc_id : int, link_to_add : string):
         try:
             self.links_dict[doc_id].add(self.internal_titles_dict[link_to_add])
         except KeyError:
@@ -206,31 +526,342 @@ class Index:
             weights_value = .15/self.pageTracker
         return weights_value
 
-    def page_rank(self):
+    def page_rank(self, initial_ranks: dict = None):
         """
         Implements the PageRank algorithm
+        The links dictionary is compressed into a sparse link graph so that each iteration is a single
+        vectorized pass over the links instead of a pass over every pair of pages; the weights are the
+        same as calculate_weights
         :param self
+        :param initial_ranks: page ranks to warm start from, such as those of an earlier version of the
+        corpus (optional); pages without one start at 1/N and the vector is rescaled to sum to 1
         :return: mapping of document IDs to their page ranks
         """
-        for doc_id in self.title_dict:
-            self.storage_dict_pr[doc_id] = 0
-            self.curr_dict_pr[doc_id] = (1/self.pageTracker)
-        while self.sum_of_dicts() > 0.001:
-            self.storage_dict_pr = self.curr_dict_pr.copy()
-            for j in self.curr_dict_pr:
-                self.curr_dict_pr[j] = 0
-                for k in self.curr_dict_pr:
-                    self.curr_dict_pr[j] = self.curr_dict_pr[j] + self.calculate_weights(k, j) * self.storage_dict_pr[k]
+        graph = LinkGraph(self.title_dict, *compress_links(list(self.title_dict), self.links_dict))
+        initial = None
+        if initial_ranks is not None and graph.size > 0:
+            initial = graph.warm_start(initial_ranks)
+        ranks = graph.page_rank(initial)
+        self.link_graph = graph
+        self.page_rank_iterations = graph.iterations
+        self.page_rank_residuals = graph.residuals
+        if self.profiler is not None:
+            self.profiler.metrics["page_rank"] = {"pages": graph.size, "links": len(graph.indices),
+                                                  "iterations": graph.iterations, "residuals": graph.residuals}
+        self.storage_dict_pr = graph.to_dict(graph.previous_ranks)
+        self.curr_dict_pr = graph.to_dict(ranks)
         return self.curr_dict_pr
 
+    def load(self, titles: str, docs: str, words: str):
+        """
+        Reads an index written by this file (titles, docs, words and links files, and the positions file
+        if there is one) back into this index so that it can be updated without re-parsing the corpus
+        :param self
+        :param titles: filepath to the titles file
+        :param docs: filepath to the docs file
+        :param words: filepath to the words file, in either format
+        :return: n/a
+        """
+        read_title_file(titles, self.title_dict)
+        for doc_id, title in self.title_dict.items():
+            self.internal_titles_dict[title.lower()] = doc_id
+        self.pageTracker = len(self.title_dict)
+        max_counts = {}
+        read_docs_file(docs, self.curr_dict_pr, max_counts)
+        self.max_word_dict = {doc_id: int(most) for doc_id, most in max_counts.items() if most > 0}
+        read_links_file(links_path(docs), self.link_titles)
+        if is_binary_words_file(words):
+            binary_words = BinaryWordsIndex(words)
+            self.words_dict = dict(binary_words.items())
+            binary_words.close()
+        else:
+            read_words_file(words, self.words_dict)
+            for ids_to_counts in self.words_dict.values():
+                for doc_id, count in ids_to_counts.items():
+                    ids_to_counts[doc_id] = int(count)
+        self.posting_count = sum(len(ids_to_counts) for ids_to_counts in self.words_dict.values())
+        if os.path.exists(positions_path(words)):
+            self.record_positions = True
+            positions_index = PositionsIndex(positions_path(words))
+            self.positions_dict = dict(positions_index.items())
+            positions_index.close()
+
+    def update(self, delta: str):
+        """
+        Applies a delta XML file of added, changed and removed pages to a loaded index
+        A page whose ID is new is added, a page whose ID is already indexed replaces the old page, and a page
+        marked <page deleted="true"> (only its <id> is needed) is removed. Only the delta's pages are
+        tokenized: the old postings of changed and removed pages are dropped in one sweep over the words
+        dictionary, every page's stored link titles are resolved again against the new set of titles, and
+        PageRank is warm started from the previous ranks
+        :param self
+        :param delta: path to the delta XML file
+        :return: n/a
+        """
+        pages = []
+        context = et.iterparse(delta, events=('start', 'end'))
+        _, root = next(context)
+        for event, child in context:
+            if event == 'end' and child.tag == 'page':
+                doc_id = int(child.find('id').text.strip())
+                if child.get('deleted') == 'true':
+                    pages.append((doc_id, None, None))
+                else:
+                    pages.append((doc_id, child.find('title').text.strip(), child.find('text').text.strip()))
+                root.clear()
+
+        self.remove_pages({doc_id for doc_id, _, _ in pages})
+        for doc_id, title, text in pages:
+            if title is not None:
+                self.title_dict[doc_id] = title
+                self.index_page(doc_id, title, text)
+        self.internal_titles_dict = {title.lower(): doc_id for doc_id, title in self.title_dict.items()}
+        self.pageTracker = len(self.title_dict)
+
+        self.links_dict = {doc_id: set() for doc_id in self.title_dict}
+        self.resolve_links()
+        self.page_rank(self.curr_dict_pr)
+
+    def remove_pages(self, doc_ids: set):
+        """
+        Removes pages, along with all of their postings and links, from the index
+        :param self
+        :param doc_ids: the IDs of the pages to remove (IDs that are not indexed are ignored)
+        :return: n/a
+        """
+        for word in list(self.words_dict):
+            ids_to_counts = self.words_dict[word]
+            for doc_id in [doc_id for doc_id in doc_ids if doc_id in ids_to_counts]:
+                del ids_to_counts[doc_id]
+                self.posting_count -= 1
+            if not ids_to_counts:
+                del self.words_dict[word]
+        for word in list(self.positions_dict):
+            ids_to_positions = self.positions_dict[word]
+            for doc_id in [doc_id for doc_id in doc_ids if doc_id in ids_to_positions]:
+                del ids_to_positions[doc_id]
+            if not ids_to_positions:
+                del self.positions_dict[word]
+        for doc_id in doc_ids:
+            self.title_dict.pop(doc_id, None)
+            self.link_titles.pop(doc_id, None)
+            self.links_dict.pop(doc_id, None)
+            self.max_word_dict.pop(doc_id, None)
+
+    def doc_counts(self):
+        """
+        Counts the pages each word appears in, the corpus-wide statistics the idf of a shard is computed from
+        :param self
+        :return: a dictionary of words --> number of pages they appear in
+        """
+        return {word: len(ids_to_counts) for word, ids_to_counts in self.words_dict.items()}
+
+    def shard(self, shards: int, shard: int):
+        """
+        Splits off the pages of one shard of the index: the pages whose ID leaves the shard number as
+        remainder when divided by the number of shards, along with their postings, links, positions and
+        (corpus-wide) page ranks
+        :param self
+        :param shards: the number of shards the index is split into
+        :param shard: the number of the shard
+        :return: an Index holding only the pages of the shard
+        """
+        part = Index(None, positions=self.record_positions)
+        part.profiler = self.profiler
+        part.title_dict = {doc_id: title for doc_id, title in self.title_dict.items() if doc_id % shards == shard}
+        part.curr_dict_pr = {doc_id: rank for doc_id, rank in self.curr_dict_pr.items() if doc_id % shards == shard}
+        part.max_word_dict = {doc_id: most for doc_id, most in self.max_word_dict.items() if doc_id % shards == shard}
+        part.link_titles = {doc_id: links for doc_id, links in self.link_titles.items() if doc_id % shards == shard}
+        # a block build's words are merged from its runs once per shard rather than all held in memory at once
+        for word, ids_to_counts in self.words_dict.items():
+            counts = {doc_id: count for doc_id, count in ids_to_counts.items() if doc_id % shards == shard}
+            if counts:
+                part.words_dict[word] = counts
+        for word, ids_to_positions in self.positions_dict.items():
+            positions = {doc_id: found for doc_id, found in ids_to_positions.items() if doc_id % shards == shard}
+            if positions:
+                part.positions_dict[word] = positions
+        return part
+
+
+def write_index(ID: Index, titles: str, docs: str, words: str, text: bool = False, tiers: float = None,
+                total_pages: int = None, doc_counts: dict = None):
+    """
+    Writes the files of an index: titles, docs, links, words and trigrams files, along with the link graph file
+    when PageRank was run on the index, the positions file when positions were recorded and the tiers file when
+    asked for, removing those left by an earlier build
+    :param ID: the index to write
+    :param titles: filepath the titles file is written to
+    :param docs: filepath the docs file is written to
+    :param words: filepath the words file is written to
+    :param text: indicator to write the words file in the text format instead of the binary format
+    :param tiers: the fraction of the pages, by PageRank, that make up the first tier (no tiers file if None)
+    :param total_pages: the number of pages in the corpus, when the index only holds a shard of it
+    :param doc_counts: the number of pages of the corpus each word appears in, when the index only holds a shard of it
+    :return: n/a
+    """
+    if total_pages is None:
+        total_pages = len(ID.title_dict)
+    with ID.phase("write_title_file"):
+        write_title_file(titles, ID.title_dict)
+    with ID.phase("write_docs_file"):
+        write_docs_file(docs, ID.curr_dict_pr, ID.max_word_dict)
+    with ID.phase("write_links_file"):
+        write_links_file(links_path(docs), ID.link_titles)
+    if ID.link_graph is not None:
+        with ID.phase("write_graph_file"):
+            write_graph_file(graph_path(docs), ID.link_graph.doc_ids, ID.link_graph.indptr, ID.link_graph.indices)
+    elif os.path.exists(graph_path(docs)):
+        # a shard's pages do not make up a link graph of their own
+        os.remove(graph_path(docs))
+    with ID.phase("write_words_file"):
+        if text:
+            write_words_file(words, ID.words_dict)
+        else:
+            write_binary_words_file(words, ID.words_dict, total_pages, doc_counts)
+    if text and doc_counts is not None:
+        with ID.phase("write_idf_file"):
+            write_idf_file(idf_path(words), {word: doc_counts[word] for word in ID.words_dict}, total_pages)
+    elif os.path.exists(idf_path(words)):
+        os.remove(idf_path(words))
+    with ID.phase("write_trigrams_file"):
+        # a shard gets the vocabulary of the whole corpus, so that every shard corrects a misspelled word the same way
+        write_trigrams_file(trigrams_path(words), doc_counts if doc_counts is not None else ID.doc_counts())
+    if ID.record_positions:
+        with ID.phase("write_positions_file"):
+            write_positions_file(positions_path(words), ID.positions_dict)
+    elif os.path.exists(positions_path(words)):
+        # positions left by an earlier build would no longer match the words file
+        os.remove(positions_path(words))
+    if tiers is not None:
+        with ID.phase("write_tiers_file"):
+            write_tiers_file(tiers_path(words), ID.words_dict, ID.curr_dict_pr, ID.max_word_dict, total_pages,
+                             tiers, doc_counts)
+    elif os.path.exists(tiers_path(words)):
+        # tiers left by an earlier build would no longer match the words file or the page ranks
+        os.remove(tiers_path(words))
+
 # writes in the arguments when the file is run
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Indexes a wiki XML file into title, docs and words files')
+    parser.add_argument('xml', help='the wiki XML file to index (the delta XML file with --update)')
+    parser.add_argument('titles', help='filepath the titles file is written to')
+    parser.add_argument('docs', help='filepath the docs file is written to')
+    parser.add_argument('words', help='filepath the words file is written to')
+    parser.add_argument('--streaming', action='store_true',
+                        help='parse the XML one page at a time instead of loading the whole tree')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes that pages are tokenized, stopped and stemmed in')
+    parser.add_argument('--memory-budget', type=int,
+                        help='build the words index in blocks of about this many megabytes of postings')
+    parser.add_argument('--block-size', type=int,
+                        help='build the words index in blocks of this many postings (overrides --memory-budget)')
+    parser.add_argument('--temp-dir', help='directory the sorted runs of a block build are written to')
+    parser.add_argument('--text', action='store_true',
+                        help='export the words file in the text format instead of the binary format')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='print the hit rate of the stemming cache to stderr when done')
+    parser.add_argument('--positions', action='store_true',
+                        help='also write the position of every word to <words>.positions, for phrase queries')
+    parser.add_argument('--tiers', type=float, metavar='FRACTION',
+                        help='also write the postings of the top FRACTION of pages by PageRank to <words>.tiers, '
+                        'so that PageRank queries can be answered without reading whole postings lists')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help='split the pages into N shards, each written to its own titles, docs and words files '
+                        '(numbered before the extension: titles.shard0.txt, ...) with corpus-wide idf and page ranks')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the wall time and peak memory of each phase, the time spent indexing pages '
+                        '(index_page), stopping and stemming their words (term) and handling links '
+                        '(populate_links_dict), and the PageRank residuals as JSON')
+    parser.add_argument('--profile-output', help='file the profile report is written to (stderr by default)')
+    parser.add_argument('--cprofile', metavar='FILE', help='also capture a cProfile of the run into FILE (implies --profile)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also trace Python allocations for exact per-phase peaks (slow; implies --profile)')
+    parser.add_argument('--update', action='store_true',
+                        help='apply the added, changed and removed pages of a delta XML file to the existing index '
+                        'files in place, instead of indexing from scratch')
+    parser.add_argument('--publish', metavar='DIR',
+                        help='write the index files (named after the files given) to a new version directory of DIR '
+                        'and publish it once complete, for queriers started with --published DIR to pick up; with '
+                        '--update, the published version is the one updated')
+    parser.add_argument('--keep-versions', type=int, default=2,
+                        help='number of versions kept in the publish directory, counting the published one')
+    parser.add_argument('--dedupe', type=float, nargs='?', const=THRESHOLD, metavar='SIMILARITY',
+                        help='collapse each page whose shingles are at least SIMILARITY (Jaccard, %(const)s by '
+                        'default) alike to those of a page before it into that page, redirecting its links there, '
+                        'and print how many pages and postings were left out to stderr')
+    args = parser.parse_args()
+    if args.tiers is not None and not 0 < args.tiers <= 1:
+        parser.error('--tiers must be a fraction between 0 (excluded) and 1')
+    if args.shards is not None and (args.shards < 1 or args.update):
+        parser.error('--shards must be at least 1 and cannot be combined with --update')
+    if args.publish is not None and (args.shards is not None or args.keep_versions < 1):
+        parser.error('--publish cannot be combined with --shards and must keep at least 1 version')
+    if args.dedupe is not None and (not 0 < args.dedupe <= 1 or args.update):
+        parser.error('--dedupe must be a similarity between 0 (excluded) and 1 and cannot be combined with --update')
+    # the index files read by an update
+    sources = (args.titles, args.docs, args.words)
+    if args.publish is not None and args.update:
+        sources = read_manifest(args.publish)
+        if sources is None:
+            parser.error('no index was published to ' + args.publish + ' yet')
+        sources = sources[1:]
+    block_size = args.block_size
+    if block_size is None and args.memory_budget is not None:
+        block_size = block_size_for(args.memory_budget * 1024 * 1024)
+    profiler = None
+    if args.profile or args.cprofile or args.tracemalloc:
+        profiler = Profiler(trace_memory=args.tracemalloc, cprofile=args.cprofile)
     try:
-        ID = Index(sys.argv[1])
-        write_title_file(sys.argv[2], ID.title_dict)
-        write_docs_file(sys.argv[3], ID.curr_dict_pr)
-        write_words_file(sys.argv[4], ID.words_dict)
-    except IndexError:
-        raise IndexError('Missing file and or too many files! Please try again.')
+        if args.update:
+            # keeps the format of the words file being updated
+            args.text = not is_binary_words_file(sources[2])
+            # and its tiers, with the same fraction of pages
+            if args.tiers is None and os.path.exists(tiers_path(sources[2])):
+                tiers_index = TiersIndex(tiers_path(sources[2]))
+                args.tiers = tiers_index.fraction
+                tiers_index.close()
+            ID = Index(None, streaming=True, profiler=profiler)
+            with ID.phase("load"):
+                ID.load(*sources)
+            with ID.phase("update"):
+                ID.update(args.xml)
+        else:
+            ID = Index(args.xml, streaming=args.streaming, workers=args.workers, block_size=block_size,
+                       temp_dir=args.temp_dir, profiler=profiler, positions=args.positions, dedupe=args.dedupe)
+        if args.publish is not None:
+            # written to a directory of its own, so queriers keep reading the published version until it is replaced
+            version, version_directory = new_version_directory(args.publish)
+            titles, docs, words = (os.path.join(version_directory, os.path.basename(path))
+                                   for path in (args.titles, args.docs, args.words))
+            write_index(ID, titles, docs, words, args.text, args.tiers)
+            write_manifest(args.publish, version, titles, docs, words)
+            remove_old_versions(args.publish, args.keep_versions)
+        elif args.shards is None:
+            write_index(ID, args.titles, args.docs, args.words, args.text, args.tiers)
+        else:
+            # every shard keeps the corpus-wide page ranks and idf statistics, so its scores are those of the whole index
+            with ID.phase("doc_counts"):
+                doc_counts = ID.doc_counts()
+            # the link graph is the whole corpus's, so that its page ranks can be recomputed
+            with ID.phase("write_graph_file"):
+                write_graph_file(graph_path(args.docs), ID.link_graph.doc_ids, ID.link_graph.indptr,
+                                 ID.link_graph.indices)
+            for shard in range(args.shards):
+                with ID.phase("shard"):
+                    part = ID.shard(args.shards, shard)
+                write_index(part, shard_path(args.titles, shard), shard_path(args.docs, shard),
+                            shard_path(args.words, shard), args.text, args.tiers, len(ID.title_dict), doc_counts)
+        if ID.spilled_words is not None:
+            ID.spilled_words.close()
+        if args.cache_stats:
+            print(json.dumps(ANALYZER.cache_stats()), file=sys.stderr)
+        if args.dedupe is not None:
+            print(json.dumps(ID.dedupe_stats()), file=sys.stderr)
+        if profiler is not None:
+            profiler.metrics["analyzer"] = ANALYZER.cache_stats()
+            if args.dedupe is not None:
+                profiler.metrics["dedupe"] = ID.dedupe_stats()
+            profiler.finish(args.profile_output)
     except FileNotFoundError:
         raise FileNotFoundError('File Not Found! Please try again.')
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Provides conjunctive evaluation of sorted postings: intersecting the doc ids of several terms by galloping
+search, so that the longer lists are skipped through rather than read, and matching phrases by position
+Also merges the postings of several terms into one, for the terms a wildcard query term expands to
+"""
+from bisect import bisect_left
+
+import numpy as np
+
+
+def gallop(values: list, target: int, start: int = 0):
+    """
+    Finds the first value that is at least target, searching forward from start with steps that double
+    in size and then by binary search within the last step, so that finding a value k places ahead
+    costs O(log k) comparisons whatever the length of the list
+    :param values: the sorted values
+    :param target: the value to find
+    :param start: the position to search from
+    :return: the position of the first value at or after start that is at least target (len(values) if none)
+    """
+    if start >= len(values) or values[start] >= target:
+        return start
+    low = start
+    step = 1
+    while low + step < len(values) and values[low + step] < target:
+        low += step
+        step *= 2
+    return bisect_left(values, target, low + 1, min(low + step, len(values)))
+
+
+def intersect(postings: list):
+    """
+    Intersects sorted lists of doc ids
+    The shortest list proposes candidates and every other list gallops to them; whenever a list skips past
+    the candidate, the doc it lands on becomes the next candidate, so no list is read posting by posting
+    :param postings: the sorted doc id lists
+    :return: a triple of the doc ids found in every list, the position of each of those docs in every list
+    (positions[i][j] is the position of the j-th doc in list i) and the number of postings compared
+    """
+    if not postings or any(len(doc_ids) == 0 for doc_ids in postings):
+        return [], [[] for _ in postings], 0
+    order = sorted(range(len(postings)), key=lambda i: len(postings[i]))
+    cursors = [0] * len(postings)
+    matches = []
+    positions = [[] for _ in postings]
+    compared = 0
+    target = postings[order[0]][0]
+    while True:
+        for i in order:
+            cursors[i] = gallop(postings[i], target, cursors[i])
+            compared += 1
+            if cursors[i] == len(postings[i]):
+                return matches, positions, compared
+            if postings[i][cursors[i]] != target:
+                target = postings[i][cursors[i]]
+                break
+        else:
+            matches.append(target)
+            for i, cursor in enumerate(cursors):
+                positions[i].append(cursor)
+            shortest = order[0]
+            cursors[shortest] += 1
+            if cursors[shortest] == len(postings[shortest]):
+                return matches, positions, compared
+            target = postings[shortest][cursors[shortest]]
+
+
+def phrase_match(positions: list):
+    """
+    Checks whether words appear next to each other, in order, somewhere in a document
+    :param positions: the sorted positions of each word of the phrase in the document, in phrase order
+    :return: whether the phrase appears in the document
+    """
+    starts = np.asarray(positions[0], dtype=np.int64)
+    for offset, word_positions in enumerate(positions[1:], 1):
+        starts = np.intersect1d(starts, np.asarray(word_positions, dtype=np.int64) - offset, assume_unique=True)
+        if len(starts) == 0:
+            return False
+    return True
+
+
+def union(postings: list):
+    """
+    Merges scored postings lists into one, adding up the weights of a doc that is in more than one list
+    All the lists are merged at once by a stable sort of their concatenation, so the weights of a doc are
+    added up in list order
+    :param postings: the pairs of arrays (doc ids, weights) to merge, each sorted by doc id
+    :return: a pair of arrays (doc ids, summed weights) sorted by doc id
+    """
+    if len(postings) == 1:
+        return postings[0]
+    id_nums = np.concatenate([doc_ids for doc_ids, _ in postings])
+    weights = np.concatenate([doc_weights for _, doc_weights in postings])
+    if len(id_nums) == 0:
+        return id_nums, weights
+    order = np.argsort(id_nums, kind="stable")
+    id_nums, weights = id_nums[order], weights[order]
+    starts = np.flatnonzero(np.concatenate(([True], id_nums[1:] != id_nums[:-1])))
+    return id_nums[starts], np.add.reduceat(weights, starts)
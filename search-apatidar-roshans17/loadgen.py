@@ -0,0 +1,71 @@
+"""
+Generates load against the query server and reports throughput and latency as JSON
+Each of --concurrency connections sends queries from the query file, round robin, one at a time,
+until --requests queries have been answered in total
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from profiling import percentile
+
+
+async def run_connection(host: str, port: int, queries: list, counter: list, total: int, latencies: list):
+    """
+    Sends queries over one connection until the shared request counter reaches the total
+    :param host: the server's address
+    :param port: the server's port
+    :param queries: the queries to send, round robin
+    :param counter: a one element list holding the number of requests started by all connections
+    :param total: the number of requests to send in total
+    :param latencies: the list every request's latency (in milliseconds) is appended to
+    :return: n/a
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    while counter[0] < total:
+        user_input = queries[counter[0] % len(queries)]
+        counter[0] += 1
+        start = time.perf_counter()
+        writer.write((json.dumps({"query": user_input}) + "\n").encode("utf-8"))
+        await writer.drain()
+        await reader.readline()
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def generate_load(host: str, port: int, queries: list, concurrency: int, total: int):
+    """
+    Runs the load test
+    :param host: the server's address
+    :param port: the server's port
+    :param queries: the queries to send
+    :param concurrency: the number of connections sending queries at the same time
+    :param total: the number of requests to send in total
+    :return: a dictionary of throughput and latency statistics
+    """
+    counter = [0]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_connection(host, port, queries, counter, total, latencies)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": len(latencies), "concurrency": concurrency, "seconds": elapsed,
+            "qps": len(latencies) / elapsed if elapsed else 0,
+            "p50_ms": percentile(latencies, .50), "p99_ms": percentile(latencies, .99),
+            "max_ms": latencies[-1] if latencies else 0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measures the throughput and latency of a running query server')
+    parser.add_argument('queries', help='file of queries, one per line')
+    parser.add_argument('--host', default='127.0.0.1', help='the server\'s address')
+    parser.add_argument('--port', type=int, required=True, help='the server\'s port')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of simultaneous connections')
+    parser.add_argument('--requests', type=int, default=1000, help='total number of queries to send')
+    args = parser.parse_args()
+    with open(args.queries, "r") as queries_fh:
+        queries = [line.rstrip("\n") for line in queries_fh if line.strip()]
+    print(json.dumps(asyncio.run(generate_load(args.host, args.port, queries, args.concurrency, args.requests))))
@@ -0,0 +1,146 @@
+"""
+Provides the near-duplicate detection the indexer can collapse copies of pages with (index.py --dedupe)
+A page is seen as the set of its shingles, the runs of SHINGLE_LENGTH consecutive terms (stopped and stemmed words),
+and two pages are near-duplicates when the Jaccard similarity of their shingle sets (shared over distinct shingles)
+reaches a threshold. Each page is summed up by a MinHash signature: the smallest value each of SIGNATURE_LENGTH
+hash functions takes over its shingles, any one of which two pages share with a probability equal to their
+similarity. Signatures are cut into BANDS bands, and only pages that share a whole band (found through a hash table
+per band) are compared, so a page is checked against a handful of candidates rather than every page seen before
+"""
+import numpy as np
+
+# number of consecutive terms in a shingle
+SHINGLE_LENGTH = 3
+# number of hash functions, that is of values in a signature
+SIGNATURE_LENGTH = 128
+# number of bands signatures are cut into: with 8 values per band, pages that are 80% similar share a band 95% of
+# the time, and pages that are 50% similar only 6% of the time
+BANDS = 16
+# default Jaccard similarity from which two pages are near-duplicates
+THRESHOLD = 0.8
+# odd multiplier the bytes of a term and the terms of a shingle are combined with
+MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# seeds the hash functions, so that every run (and every worker process) computes the same signatures
+SEED = 2022
+
+
+def hash_functions(seed: int = SEED):
+    """
+    Draws the hash functions of the signatures: shingle --> the top 32 bits of (a * shingle + b) mod 2^64, with a odd
+    :param seed: the seed they are drawn with
+    :return: a pair of arrays (a, b) of SIGNATURE_LENGTH values each
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = (rng.integers(0, 2**63, SIGNATURE_LENGTH, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+    offsets = rng.integers(0, 2**63, SIGNATURE_LENGTH, dtype=np.uint64) << np.uint64(1)
+    return multipliers, offsets
+
+
+# the hash functions every signature is computed with
+HASH_MULTIPLIERS, HASH_OFFSETS = hash_functions()
+
+
+def term_hashes(terms: list):
+    """
+    Hashes terms into 64-bit integers, all at once
+    :param terms: the terms, of ASCII characters
+    :return: an array of the hash of each term
+    """
+    encoded = np.array(terms, dtype=bytes)
+    width = encoded.dtype.itemsize
+    letters = encoded.view(np.uint8).reshape(len(terms), width).astype(np.uint64)
+    # the padding of shorter terms is zero bytes, which add nothing, so a term hashes alike whatever the width
+    powers = np.cumprod(np.full(width, MULTIPLIER, dtype=np.uint64))
+    with np.errstate(over="ignore"):
+        hashes = letters @ powers
+        # spreads the bits of the sum across the whole word
+        hashes ^= hashes >> np.uint64(29)
+        hashes *= MULTIPLIER
+        hashes ^= hashes >> np.uint64(32)
+    return hashes
+
+
+def signature(terms: list):
+    """
+    Computes the MinHash signature of a page
+    :param terms: the terms of the page, in order
+    :return: an array of SIGNATURE_LENGTH 32-bit values, or None if the page has no terms
+    """
+    if not terms:
+        return None
+    hashes = term_hashes(terms)
+    # a page shorter than a shingle is a single shingle of all its terms
+    length = min(SHINGLE_LENGTH, len(hashes))
+    with np.errstate(over="ignore"):
+        shingles = hashes[:len(hashes) - length + 1].copy()
+        for i in range(1, length):
+            shingles = shingles * MULTIPLIER + hashes[i:len(hashes) - length + 1 + i]
+        values = np.multiply.outer(HASH_MULTIPLIERS, shingles)
+        values += HASH_OFFSETS[:, None]
+    # the top bits of the smallest value are the smallest top bits
+    return (values.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+
+def similarity(first: np.ndarray, second: np.ndarray):
+    """
+    Estimates the Jaccard similarity of two pages from their signatures
+    :param first: the signature of the first page
+    :param second: the signature of the second page
+    :return: the fraction of the values the signatures share
+    """
+    return np.count_nonzero(first == second) / len(first)
+
+
+class NearDuplicates:
+    def __init__(self, threshold: float = THRESHOLD):
+        """
+        Finds the near-duplicates of pages among the pages it was given before
+        :param threshold: the Jaccard similarity from which two pages are near-duplicates
+        """
+        # the Jaccard similarity from which two pages are near-duplicates
+        self.threshold = threshold
+        # for each band, maps the values of that band to the pages whose signature has them
+        self.buckets = [{} for _ in range(BANDS)]
+        # maps the document ID of each page added to its signature
+        self.signatures = {}
+
+    def bands(self, page_signature: np.ndarray):
+        """
+        Cuts a signature into its bands
+        :param self
+        :param page_signature: the signature
+        :return: a generator of (bucket table, key) pairs, one per band
+        """
+        rows = SIGNATURE_LENGTH // BANDS
+        for band, buckets in enumerate(self.buckets):
+            yield buckets, page_signature[band * rows:(band + 1) * rows].tobytes()
+
+    def find(self, page_signature: np.ndarray):
+        """
+        Finds the page most similar to a signature among the pages added, if it is a near-duplicate
+        :param self
+        :param page_signature: the signature of the page
+        :return: the document ID of the most similar page (the lowest ID among equally similar pages), or None if
+        no page added is similar enough
+        """
+        candidates = set()
+        for buckets, key in self.bands(page_signature):
+            candidates.update(buckets.get(key, ()))
+        best = None
+        for doc_id in sorted(candidates):
+            estimate = similarity(page_signature, self.signatures[doc_id])
+            if estimate >= self.threshold and (best is None or estimate > best[0]):
+                best = (estimate, doc_id)
+        return None if best is None else best[1]
+
+    def add(self, doc_id: int, page_signature: np.ndarray):
+        """
+        Adds a page that later pages are compared with
+        :param self
+        :param doc_id: the ID of the page
+        :param page_signature: its signature
+        :return: n/a
+        """
+        self.signatures[doc_id] = page_signature
+        for buckets, key in self.bands(page_signature):
+            buckets.setdefault(key, []).append(doc_id)
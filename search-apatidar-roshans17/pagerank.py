@@ -0,0 +1,300 @@
+"""
+Provides a sparse, vectorized implementation of the PageRank algorithm used by the indexer
+Run on its own, it recomputes the page ranks of a built index from the link graph file the indexer writes next
+to the docs file, without re-parsing the corpus, so that the damping, the convergence threshold and the
+iteration method can be tuned and compared in seconds
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from file_io import graph_path, read_graph_file, read_docs_file, write_docs_file
+
+# probability of following a link rather than teleporting to a random page
+DAMPING = .85
+# distance between two successive rank vectors below which PageRank has converged
+THRESHOLD = 0.001
+# the ways a rank vector can be updated in each iteration
+METHODS = ("jacobi", "gauss-seidel")
+# the extrapolations that can be applied to the iterates every so often, and how many iterates each one needs
+EXTRAPOLATIONS = {"aitken": 3, "quadratic": 4}
+# default number of iterations between two extrapolations
+EXTRAPOLATE_EVERY = 10
+
+
+def compress_links(doc_ids: list, links_dict: dict):
+    """
+    Compresses a links dictionary into CSR arrays: the outlinks of the page at position k are
+    indices[indptr[k]:indptr[k+1]]
+    Pages with no outlinks, or whose only outlink is to themselves, are given none, which marks them as dangling
+    :param doc_ids: the IDs of every page, in the order ranks are reported
+    :param links_dict: maps each document ID to the set of IDs it links to
+    :return: a pair of arrays (indptr, indices)
+    """
+    positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    indptr = [0]
+    indices = []
+    for doc_id in doc_ids:
+        links = links_dict.get(doc_id, set())
+        if not (links == set() or (len(links) == 1 and doc_id in links)):
+            indices.extend(positions[link] for link in links)
+        indptr.append(len(indices))
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64)
+
+
+class LinkGraph:
+    def __init__(self, doc_ids: list, indptr: np.ndarray, indices: np.ndarray, damping: float = DAMPING):
+        """
+        Holds the link graph in CSR arrays: the outlinks of the page at position k are
+        indices[indptr[k]:indptr[k+1]], and every one of them carries the weight damping/len(links)
+        Pages with no outlinks are dangling and are treated as linking to every page except for themselves
+        :param doc_ids: the IDs of every page, in the order ranks are reported
+        :param indptr: where the outlinks of each page start in indices, followed by the number of links
+        :param indices: the position of the page each link points to
+        :param damping: probability of following a link rather than teleporting to a random page
+        """
+        # the document ID of the page at each position
+        self.doc_ids = list(doc_ids)
+        self.size = len(self.doc_ids)
+        self.damping = damping
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+        out_degrees = np.diff(self.indptr)
+        self.dangling = out_degrees == 0
+        # the source position of every edge, expanded from indptr
+        self.sources = np.repeat(np.arange(self.size), out_degrees)
+        # the link weight of every edge, excluding the teleport term
+        self.edge_weights = damping / out_degrees[self.sources]
+        # the inlinks of every page as Python lists (source positions, weights), built the first time a
+        # Gauss-Seidel sweep needs them
+        self.inlinks = None
+
+        # number of iterations the last call to page_rank took
+        self.iterations = 0
+        # the distance between successive rank vectors after each iteration of the last call to page_rank
+        self.residuals = []
+        # the rank vector of the iteration before the one page_rank returned
+        self.previous_ranks = np.zeros(self.size)
+
+    def step(self, ranks: np.ndarray):
+        """
+        Runs a single (Jacobi) PageRank iteration
+        The teleport term ((1-damping)/N from every page) and the dangling mass (damping/(N-1) from every
+        dangling page to every other page) are spread analytically, so only real links go through the mat-vec
+        :param self
+        :param ranks: the rank vector of the previous iteration
+        :return: the rank vector of the next iteration
+        """
+        teleport = (1 - self.damping) / self.size * ranks.sum()
+        updated = teleport + np.bincount(self.indices, weights=self.edge_weights * ranks[self.sources],
+                                         minlength=self.size)
+        if self.size > 1:
+            dangling_ranks = np.where(self.dangling, ranks, 0)
+            updated += self.damping / (self.size - 1) * (dangling_ranks.sum() - dangling_ranks)
+        return updated
+
+    def gauss_seidel_step(self, ranks: np.ndarray):
+        """
+        Runs a single Gauss-Seidel PageRank iteration: pages are updated one after the other, each one using
+        the ranks already updated in this sweep, which usually converges in fewer iterations than step
+        The totals the teleport term and the dangling mass are spread from are kept up to date as pages change
+        The sweep is rescaled to the total of the ranks it started from, like a Jacobi iteration
+        :param self
+        :param ranks: the rank vector of the previous iteration
+        :return: the rank vector of the next iteration
+        """
+        if self.inlinks is None:
+            order = np.argsort(self.indices, kind="stable")
+            sources, weights = self.sources[order].tolist(), self.edge_weights[order].tolist()
+            bounds = np.searchsorted(self.indices[order], np.arange(self.size + 1)).tolist()
+            self.inlinks = [(sources[bounds[k]:bounds[k + 1]], weights[bounds[k]:bounds[k + 1]])
+                            for k in range(self.size)]
+        updated = ranks.tolist()
+        dangling = self.dangling.tolist()
+        total = sum(updated)
+        dangling_total = sum(rank for rank, is_dangling in zip(updated, dangling) if is_dangling)
+        teleport = (1 - self.damping) / self.size
+        spread = self.damping / (self.size - 1) if self.size > 1 else 0
+        for k, (sources, weights) in enumerate(self.inlinks):
+            old = updated[k]
+            new = teleport * total + sum(weight * updated[source] for source, weight in zip(sources, weights))
+            if dangling[k]:
+                new += spread * (dangling_total - old)
+                dangling_total += new - old
+            else:
+                new += spread * dangling_total
+            total += new - old
+            updated[k] = new
+        updated = np.array(updated)
+        return updated * (ranks.sum() / total) if total else updated
+
+    def extrapolate(self, iterates: deque, extrapolation: str):
+        """
+        Extrapolates the limit of the last few iterates, cancelling the slowest decaying error terms
+        Aitken extrapolation applies the delta-squared process to every page; quadratic extrapolation fits the
+        last four iterates with a quadratic in the iteration matrix (Kamvar et al., 2003)
+        Negative ranks are clipped and the result is rescaled to the total of the last iterate
+        :param self
+        :param iterates: the most recent rank vectors, oldest first
+        :param extrapolation: "aitken" or "quadratic"
+        :return: the extrapolated rank vector
+        """
+        current = iterates[-1]
+        if extrapolation == "aitken":
+            older, old = iterates[-3], iterates[-2]
+            second_differences = current - 2 * old + older
+            changing = np.abs(second_differences) > 1e-15
+            extrapolated = current.copy()
+            extrapolated[changing] -= (current - old)[changing]**2 / second_differences[changing]
+        else:
+            base = iterates[-4]
+            differences = np.column_stack([iterates[-3] - base, iterates[-2] - base])
+            gammas = np.linalg.lstsq(differences, base - current, rcond=None)[0]
+            gamma_1, gamma_2 = gammas
+            extrapolated = ((gamma_1 + gamma_2 + 1) * iterates[-3] + (gamma_2 + 1) * iterates[-2] + current)
+        extrapolated = np.maximum(extrapolated, 0)
+        if not np.isfinite(extrapolated).all() or extrapolated.sum() == 0:
+            return current
+        return extrapolated * (current.sum() / extrapolated.sum())
+
+    def page_rank(self, initial: np.ndarray = None, method: str = "jacobi", extrapolation: str = None,
+                  every: int = EXTRAPOLATE_EVERY, threshold: float = THRESHOLD):
+        """
+        Iterates from a uniform rank vector, or from a given one, until two successive vectors are within
+        threshold of each other (Euclidean distance)
+        Starting from the ranks of a slightly different graph (a warm start) usually takes far fewer iterations
+        :param self
+        :param initial: the rank vector to start from, in the order of doc_ids (optional)
+        :param method: "jacobi" to update every page from the previous iteration, "gauss-seidel" to update
+        pages in place
+        :param extrapolation: "aitken" or "quadratic" to extrapolate the iterates every few iterations (optional)
+        :param every: number of iterations between two extrapolations
+        :param threshold: distance between two successive rank vectors below which PageRank has converged
+        :return: an array of page ranks, in the order of doc_ids
+        """
+        step = self.gauss_seidel_step if method == "gauss-seidel" else self.step
+        self.iterations = 0
+        self.residuals = []
+        previous = np.zeros(self.size)
+        if initial is not None:
+            current = np.asarray(initial, dtype=np.float64)
+        else:
+            current = np.full(self.size, 1 / self.size) if self.size else np.zeros(0)
+        iterates = deque([current], maxlen=EXTRAPOLATIONS.get(extrapolation, 1))
+        residual = np.sqrt(((current - previous)**2).sum())
+        while residual > threshold:
+            previous = current
+            current = step(previous)
+            self.iterations += 1
+            residual = np.sqrt(((current - previous)**2).sum())
+            self.residuals.append(float(residual))
+            iterates.append(current)
+            if (extrapolation is not None and residual > threshold and self.iterations % every == 0
+                    and len(iterates) == iterates.maxlen):
+                current = self.extrapolate(iterates, extrapolation)
+                iterates.clear()
+                iterates.append(current)
+        self.previous_ranks = previous
+        return current
+
+    def warm_start(self, ids_to_ranks: dict):
+        """
+        Builds a rank vector to start from out of the page ranks of an earlier version of the graph
+        Pages without one start at 1/N and the vector is rescaled to sum to 1
+        :param self
+        :param ids_to_ranks: mapping of document IDs to their page ranks
+        :return: the rank vector, in the order of doc_ids
+        """
+        initial = np.array([ids_to_ranks.get(doc_id, 1/self.size) for doc_id in self.doc_ids])
+        return initial / initial.sum()
+
+    def to_dict(self, ranks: np.ndarray):
+        """
+        Maps each document ID to its entry in a rank vector
+        :param self
+        :param ranks: an array of page ranks, in the order of doc_ids
+        :return: mapping of document IDs to their page ranks
+        """
+        return dict(zip(self.doc_ids, ranks.tolist()))
+
+
+def recompute(docs: str, method: str = "jacobi", extrapolation: str = None, every: int = EXTRAPOLATE_EVERY,
+              damping: float = DAMPING, threshold: float = THRESHOLD, warm: bool = False, output: str = None):
+    """
+    Recomputes the page ranks of a built index from its link graph file
+    :param docs: filepath to the docs file of the index (the link graph file is next to it)
+    :param method: "jacobi" or "gauss-seidel"
+    :param extrapolation: "aitken" or "quadratic" (optional)
+    :param every: number of iterations between two extrapolations
+    :param damping: probability of following a link rather than teleporting to a random page
+    :param threshold: distance between two successive rank vectors below which PageRank has converged
+    :param warm: indicator to start from the page ranks in the docs file (if there is one) instead of a uniform vector
+    :param output: filepath a docs file with the new page ranks (and the old maximum word counts) is written to
+    :return: a dictionary of the settings, the number of iterations, the residuals, the load and PageRank
+    times and how far the new ranks are from those in the docs file (None without a docs file)
+    """
+    start = time.perf_counter()
+    doc_ids, indptr, indices = read_graph_file(graph_path(docs))
+    graph = LinkGraph(doc_ids, indptr, indices, damping)
+    ids_to_pageranks, ids_to_max_counts = {}, {}
+    # a sharded index only has the link graph file at the unsharded docs path
+    if os.path.exists(docs):
+        read_docs_file(docs, ids_to_pageranks, ids_to_max_counts)
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    initial = graph.warm_start(ids_to_pageranks) if warm and graph.size else None
+    ranks = graph.page_rank(initial, method, extrapolation, every, threshold)
+    elapsed = time.perf_counter() - start
+    if output:
+        write_docs_file(output, graph.to_dict(ranks), ids_to_max_counts)
+    difference = None
+    if ids_to_pageranks and graph.size:
+        difference = float(np.abs(ranks - [ids_to_pageranks.get(doc_id, 0) for doc_id in graph.doc_ids]).max())
+    return {"pages": graph.size, "links": len(graph.indices), "method": method, "extrapolation": extrapolation,
+            "damping": damping, "threshold": threshold, "warm_start": warm, "iterations": graph.iterations,
+            "residuals": graph.residuals, "load_s": load, "page_rank_s": elapsed,
+            "max_difference": difference}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recomputes the page ranks of a built index from its link graph '
+                                     'file, without re-parsing the corpus, and reports the iterations it took as JSON')
+    parser.add_argument('docs', help='the docs file of the index (the link graph file <docs>.graph is read)')
+    parser.add_argument('--method', choices=METHODS, default="jacobi",
+                        help='update every page from the previous iteration (jacobi) or in place (gauss-seidel)')
+    parser.add_argument('--extrapolate', choices=sorted(EXTRAPOLATIONS),
+                        help='extrapolate the iterates every --every iterations')
+    parser.add_argument('--every', type=int, default=EXTRAPOLATE_EVERY,
+                        help='number of iterations between two extrapolations')
+    parser.add_argument('--damping', type=float, default=DAMPING,
+                        help='probability of following a link rather than teleporting to a random page')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='distance between two successive rank vectors below which PageRank has converged')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='start from the page ranks in the docs file instead of a uniform vector')
+    parser.add_argument('--compare', action='store_true',
+                        help='run every method with and without each extrapolation and report them all')
+    parser.add_argument('--output', help='write a docs file with the new page ranks to this filepath '
+                        '(a tiers file built from the old ranks has to be rebuilt)')
+    args = parser.parse_args()
+    if not 0 <= args.damping < 1 or args.threshold <= 0 or args.every < 1:
+        parser.error('--damping must be in [0, 1), --threshold positive and --every at least 1')
+    if args.compare and args.output:
+        parser.error('--output cannot be combined with --compare')
+    try:
+        if args.compare:
+            results = [recompute(args.docs, method, extrapolation, args.every, args.damping, args.threshold,
+                                 args.warm_start)
+                       for method in METHODS for extrapolation in (None, *sorted(EXTRAPOLATIONS))]
+        else:
+            results = recompute(args.docs, args.method, args.extrapolate, args.every, args.damping, args.threshold,
+                                args.warm_start, args.output)
+    except FileNotFoundError:
+        sys.exit('No link graph found next to ' + args.docs + '; rebuild the index with index.py first')
+    print(json.dumps(results, indent=2))
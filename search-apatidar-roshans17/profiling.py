@@ -0,0 +1,204 @@
+"""
+Provides the instrumentation behind the --profile option of the indexer and the querier: wall time and
+peak memory per phase, call counts and time per instrumented stage, per-query records and free-form metrics,
+gathered into one JSON report, with optional cProfile and tracemalloc capture
+Nothing here runs unless a Profiler is created; the indexer and querier only check whether they were given one
+"""
+import json
+import sys
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where the peak resident set size is left out of the report
+    resource = None
+
+# number of most recent queries whose records are kept (a long-running server answers unboundedly many)
+MAX_QUERY_RECORDS = 10000
+# number of functions (cProfile) and allocating lines (tracemalloc) listed in the report
+REPORT_TOP = 25
+
+
+def percentile(sorted_values: list, fraction: float):
+    """
+    Picks a percentile out of sorted values (nearest rank)
+    :param sorted_values: the values, in ascending order
+    :param fraction: the percentile, between 0 and 1
+    :return: the value at that percentile
+    """
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    """
+    Gets the largest resident set size the process has had so far
+    :return: the peak resident set size in megabytes, or None where it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class Profiler:
+    def __init__(self, trace_memory: bool = False, cprofile: str = None):
+        """
+        :param trace_memory: indicator to trace Python allocations with tracemalloc, reporting the exact peak
+        of each phase and the lines that allocated the most (slows everything down considerably)
+        :param cprofile: filepath the cProfile statistics are dumped to (optional)
+        """
+        self.trace_memory = trace_memory
+        self.cprofile = cprofile
+        # maps each phase name to its wall time and peak memory
+        self.phases = {}
+        # maps each instrumented stage to its number of calls and total wall time
+        self.stages = {}
+        # records of the most recent queries
+        self.queries = deque(maxlen=MAX_QUERY_RECORDS)
+        # other measurements, by name
+        self.metrics = {}
+        # the running cProfile capture
+        self.profile = None
+        if trace_memory:
+            tracemalloc.start()
+        if cprofile:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times a phase of the work; a phase that runs more than once accumulates its time
+        :param self
+        :param name: the name of the phase
+        :return: a context manager that measures the code it wraps
+        """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            phase = self.phases.setdefault(name, {"calls": 0, "wall_s": 0})
+            phase["calls"] += 1
+            phase["wall_s"] += elapsed
+            phase["peak_rss_mb"] = peak_rss_mb()
+            if self.trace_memory:
+                phase["peak_traced_mb"] = max(phase.get("peak_traced_mb", 0), tracemalloc.get_traced_memory()[1] / 2**20)
+
+    def instrument(self, obj, names: list):
+        """
+        Replaces methods of an object (that object only) with wrappers that count their calls and time them
+        Times are inclusive: a stage that calls another instrumented stage also counts the time spent in it
+        :param self
+        :param obj: the object whose methods are instrumented
+        :param names: the names of the methods
+        :return: n/a
+        """
+        for name in names:
+            setattr(obj, name, self.timed(name, getattr(obj, name)))
+
+    def timed(self, name: str, function):
+        """
+        Wraps a function so that its calls are counted and timed as a stage
+        :param self
+        :param name: the name of the stage
+        :param function: the function to wrap
+        :return: the wrapped function
+        """
+        stage = self.stages.setdefault(name, {"calls": 0, "wall_s": 0})
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage["calls"] += 1
+                stage["wall_s"] += time.perf_counter() - start
+        return wrapper
+
+    def record_query(self, record: dict):
+        """
+        Keeps the record of a query (its stage times, postings scanned, ...)
+        :param self
+        :param record: the record of the query
+        :return: n/a
+        """
+        self.queries.append(record)
+
+    def query_summary(self):
+        """
+        Sums up the recorded queries
+        :param self
+        :return: a dictionary of the number of queries, cached answers, postings scanned and the
+        total and percentile latencies of each query stage
+        """
+        summary = {"queries": len(self.queries), "cached": sum(record["cached"] for record in self.queries),
+                   "postings": sum(record["postings"] for record in self.queries)}
+        stages = {}
+        for record in self.queries:
+            for stage, elapsed in record["stages_ms"].items():
+                stages.setdefault(stage, []).append(elapsed)
+        for stage, latencies in stages.items():
+            latencies.sort()
+            summary[stage + "_ms"] = {"total": sum(latencies),
+                                      "p50": percentile(latencies, .50), "p99": percentile(latencies, .99),
+                                      "max": latencies[-1]}
+        return summary
+
+    def report(self):
+        """
+        Gathers everything that was measured
+        :param self
+        :return: a JSON-serializable dictionary of the phases, stages, queries and metrics
+        """
+        report = {"phases": self.phases, "stages": self.stages, "metrics": self.metrics,
+                  "peak_rss_mb": peak_rss_mb()}
+        if self.queries:
+            report["query_summary"] = self.query_summary()
+            report["queries"] = list(self.queries)
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            report["top_allocations"] = [{"line": str(stat.traceback), "size_mb": stat.size / 2**20,
+                                          "count": stat.count}
+                                         for stat in snapshot.statistics("lineno")[:REPORT_TOP]]
+        if self.profile is not None:
+            import pstats
+            stats = pstats.Stats(self.profile)
+            report["cprofile"] = {"file": self.cprofile, "top": [
+                {"function": pstats.func_std_string(function), "calls": calls, "total_s": total, "cumulative_s": cumulative}
+                for function, (_, calls, total, cumulative, _) in
+                sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:REPORT_TOP]]}
+        return report
+
+    def finish(self, output: str = None):
+        """
+        Stops the captures and writes the report
+        :param self
+        :param output: filepath the JSON report is written to (stderr by default)
+        :return: the report
+        """
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.cprofile)
+        report = self.report()
+        if self.trace_memory:
+            tracemalloc.stop()
+        if output:
+            with open(output, "w") as output_fh:
+                json.dump(report, output_fh, indent=2)
+        else:
+            print(json.dumps(report), file=sys.stderr)
+        return report
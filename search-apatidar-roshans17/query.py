@@ -1,22 +1,210 @@
-import sys
+import argparse
+import atexit
+import json
 import math
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
 
-from nltk.stem import PorterStemmer
-from file_io import read_title_file, read_docs_file, read_words_file
+import numpy as np
+from analysis import ANALYZER, WILDCARD
+from file_io import read_title_file, read_docs_file, is_binary_words_file, BinaryWordsIndex, ArrayWordsIndex, \
+    positions_path, PositionsIndex, tiers_path, TiersIndex, shard_path, idf_path, read_idf_file, read_manifest, \
+    trigrams_path, TrigramIndex
+from topk import TermPostings, top_k, top_k_arrays, SLACK
+from intersect import intersect, phrase_match, union
+from fuzzy import grams, max_distance, min_shared_grams, edit_distances
+from cache import LRUCache
+from profiling import Profiler
+
+# default memory budgets of the query result and scored postings caches
+RESULT_CACHE_BYTES = 8 * 2**20
+POSTINGS_CACHE_BYTES = 64 * 2**20
+# rough number of bytes a cached (document ID, score) result or query term costs
+RESULT_ENTRY_BYTES = 100
+# rough number of bytes a cached postings list costs on top of its arrays
+POSTINGS_ENTRY_BYTES = 200
+# default number of index terms a wildcard query term is expanded to at most
+MAX_EXPANSIONS = 50
 
 class Query:
-    def __init__(self):
+    def __init__(self, result_cache_bytes: int = RESULT_CACHE_BYTES, postings_cache_bytes: int = POSTINGS_CACHE_BYTES):
+        """
+        :param result_cache_bytes: memory budget of the cache of final query results
+        :param postings_cache_bytes: memory budget of the cache of per-term scored postings
+        """
         # maps the document IDs to the document titles
         self.ids_to_titles = {}
         # maps the document IDs to the document Euclidean distances
         self.ids_to_max_euclidean = {}
         # maps the document IDs to the document page ranks
         self.ids_to_page_ranks = {}
-        # maps each word to a map of document IDs and document frequencies of that word
-        self.words_to_doc_relevance = {}
+        # maps each word to a map of document IDs and document frequencies of that word: a memory-mapped
+        # BinaryWordsIndex for a binary words file, or the packed arrays of an ArrayWordsIndex for a text one
+        self.words_to_doc_relevance = ArrayWordsIndex()
+
+        # the positions of every word, when the indexer recorded them, for matching phrases
+        self.positions_index = None
+        # the first PageRank tier of every word, when the indexer wrote one, for answering PageRank queries
+        # without reading whole postings lists
+        self.tiers_index = None
+        # the character trigrams of the corpus vocabulary, when the indexer wrote them, for correcting misspelled words
+        self.trigram_index = None
 
         # indicator to use PageRank
         self.use_page_rank = False
+        # indicator to only return documents that contain every word of a query (AND instead of OR)
+        self.conjunctive = False
+        # indicator to answer PageRank queries from the first tiers whenever they prove the results
+        self.use_tiers = True
+        # indicator to replace query words that are not in the index with their closest index term
+        self.use_fuzzy = True
+        # number of results a query returns
+        self.top_k = 10
+        # number of index terms a wildcard query term is expanded to at most (the most common ones are kept)
+        self.max_expansions = MAX_EXPANSIONS
+        # maps (word, use_page_rank) to an upper bound on the score that word adds to any document
+        self.upper_bounds = {}
+        # page ranks indexed by document ID, built the first time a PageRank bound is needed
+        self.page_rank_array = None
+        # max word counts indexed by document ID, built the first time binary postings are weighted
+        self.max_count_array = None
+        # maps (query terms, use_page_rank, top_k) to the final ranked results of the query
+        self.result_cache = LRUCache(result_cache_bytes)
+        # maps each word to its scored postings, the arrays of doc ids and tf-idf weights
+        self.postings_cache = LRUCache(postings_cache_bytes)
+        # records the stages of every query when profiling
+        self.profiler = None
+        # held while a query runs, so that a reloaded index is only swapped in between two queries
+        self.lock = threading.Lock()
+        # the querier a newly published index was loaded into, until it is swapped in
+        self.pending = None
+        # the published version of the index that is loaded (None when its files were given directly)
+        self.version = None
+
+    def load(self, titles: str, docs: str, words: str):
+        """
+        Reads the three index files into the querier, memory-mapping the words file when it is in the
+        binary format and packing its postings into arrays when it is in the text format
+        The count of each page's most frequent word is read from the docs file, where the indexer stores it
+        :param self
+        :param titles: filepath to the titles file
+        :param docs: filepath to the docs file
+        :param words: filepath to the words file
+        :return: n/a
+        """
+        read_title_file(titles, self.ids_to_titles)
+        read_docs_file(docs, self.ids_to_page_ranks, self.ids_to_max_euclidean)
+        if is_binary_words_file(words):
+            self.words_to_doc_relevance = BinaryWordsIndex(words)
+        elif os.path.exists(idf_path(words)):
+            # the text words file of a shard, whose idf comes from the whole corpus
+            doc_counts = {}
+            total_pages = read_idf_file(idf_path(words), doc_counts)
+            self.words_to_doc_relevance = ArrayWordsIndex(words, total_pages, doc_counts)
+        else:
+            self.words_to_doc_relevance = ArrayWordsIndex(words, len(self.ids_to_titles))
+        if os.path.exists(positions_path(words)):
+            self.positions_index = PositionsIndex(positions_path(words))
+        if os.path.exists(tiers_path(words)):
+            self.tiers_index = TiersIndex(tiers_path(words))
+        if os.path.exists(trigrams_path(words)):
+            self.trigram_index = TrigramIndex(trigrams_path(words))
+        # docs files written before the indexer stored each page's max count need a pass over every posting
+        if not self.ids_to_max_euclidean:
+            self.fill_euclidean()
+        self.clear_caches()
+
+    def swap(self, snapshot: "Query"):
+        """
+        Swaps in the index loaded by another querier (a newly published version, loaded on a separate thread)
+        between two queries, so that the query running on the current index finishes on it and no query sees both
+        The next query to start swaps it in if it gets there first, so that a querier that is never idle
+        still picks it up
+        The old index is handed to the snapshot and closed once it is swapped out, so its files are unmapped right
+        away instead of whenever it is garbage collected
+        :param self
+        :param snapshot: the querier the new index was loaded into, which is left with the old index, closed
+        :return: n/a
+        """
+        self.pending = snapshot
+        with self.lock:
+            self.install_pending()
+
+    @contextmanager
+    def current_index(self):
+        """
+        Holds the index for the length of a query, swapping in a newly loaded one first if there is one
+        :param self
+        :return: a context manager during which the index is not swapped
+        """
+        with self.lock:
+            self.install_pending()
+            yield
+
+    def install_pending(self):
+        """
+        Replaces the index with the one loaded into the pending querier, if there is one (the lock must be held)
+        :param self
+        :return: n/a
+        """
+        snapshot, self.pending = self.pending, None
+        if snapshot is not None:
+            self.ids_to_titles, snapshot.ids_to_titles = snapshot.ids_to_titles, self.ids_to_titles
+            self.ids_to_max_euclidean, snapshot.ids_to_max_euclidean = \
+                snapshot.ids_to_max_euclidean, self.ids_to_max_euclidean
+            self.ids_to_page_ranks, snapshot.ids_to_page_ranks = snapshot.ids_to_page_ranks, self.ids_to_page_ranks
+            self.words_to_doc_relevance, snapshot.words_to_doc_relevance = \
+                snapshot.words_to_doc_relevance, self.words_to_doc_relevance
+            self.positions_index, snapshot.positions_index = snapshot.positions_index, self.positions_index
+            self.tiers_index, snapshot.tiers_index = snapshot.tiers_index, self.tiers_index
+            self.trigram_index, snapshot.trigram_index = snapshot.trigram_index, self.trigram_index
+            self.version, snapshot.version = snapshot.version, self.version
+            # the cached postings may still point into the old files, so they go before those are unmapped
+            self.clear_caches()
+            snapshot.close_index()
+
+    def close_index(self):
+        """
+        Unmaps the memory-mapped files of the loaded index and forgets the index
+        :param self
+        :return: n/a
+        """
+        for opened in (self.words_to_doc_relevance, self.positions_index, self.tiers_index, self.trigram_index):
+            if hasattr(opened, "close"):
+                opened.close()
+        self.ids_to_titles, self.ids_to_max_euclidean, self.ids_to_page_ranks = {}, {}, {}
+        self.words_to_doc_relevance = None
+        self.positions_index = self.tiers_index = self.trigram_index = None
+        self.clear_caches()
+
+    def clear_caches(self):
+        """
+        Forgets everything computed from the loaded index (cached results, scored postings, bounds and
+        the arrays built from the docs file), so that nothing stale is served after the index is (re)loaded
+        The cache counters are kept
+        :param self
+        :return: n/a
+        """
+        self.result_cache.clear()
+        self.postings_cache.clear()
+        self.upper_bounds = {}
+        self.page_rank_array = None
+        self.max_count_array = None
+
+    def cache_stats(self):
+        """
+        Reports how well the stemming, query result and scored postings caches are doing
+        :param self
+        :return: a dictionary of the statistics of each cache
+        """
+        return {"analyzer": ANALYZER.cache_stats(), "results": self.result_cache.stats(),
+                "postings": self.postings_cache.stats()}
 
     def fill_euclidean(self):
         """
@@ -38,7 +226,7 @@ class Query:
         :param results: the list of results
         :return: n/a
         """
-        for i in range(min(len(results), 10)):
+        for i in range(min(len(results), self.top_k)):
             print(f"{i+1} {self.ids_to_titles[results[i][0]]}")
 
     def query(self, user_input: str):
@@ -48,17 +236,603 @@ class Query:
         :param user_input: the search query of the user
         :return: n/a
         """
-        sep_words = user_input.split(" ")
-        nltk_test = PorterStemmer()
-        stemmed_user_input = [nltk_test.stem(w) for w in sep_words]
-        results = self.relevance_doc_matcher(stemmed_user_input)
-        if self.use_page_rank:
-            results = {k: v * self.ids_to_page_ranks[k] for (k, v) in results.items()}
-        if len(results) == 0:
-            print("no results found")
+        with self.current_index():
+            results = self.rank_query(user_input)
+            if len(results) == 0:
+                print("no results found")
+            else:
+                self.print_results(results)
+
+    def rank(self, user_input: str):
+        """
+        Ranks the documents for a search query, on the latest loaded index (see rank_query)
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of (document ID, score) pairs, best first
+        """
+        with self.current_index():
+            return self.rank_query(user_input)
+
+    def rank_query(self, user_input: str):
+        """
+        Analyzes a search query the way the indexer analyzes pages (lowercased, stop words removed, stemmed)
+        and ranks the documents for it
+        Quoted phrases, or every word when the querier is conjunctive, must appear in a document for it to match
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of (document ID, score) pairs, best first
+        """
+        return self.analyzed_rank(user_input)[0]
+
+    def analyzed_rank(self, user_input: str):
+        """
+        Ranks the documents for a search query (see rank_query), also giving what the query was analyzed into,
+        so that a caller that needs its words does not correct and analyze it again
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of (document ID, score) pairs, best first, the list of words in the search query and the
+        words of each of its phrases
+        """
+        if self.profiler is not None:
+            return self.profiled_rank(user_input)
+        queried_words, phrases = self.analyze(user_input)
+        if phrases or self.conjunctive:
+            return self.search_conjunctive(queried_words, phrases), queried_words, phrases
+        return self.search(queried_words), queried_words, phrases
+
+    def analyze(self, user_input: str):
+        """
+        Analyzes a search query into its words and phrases, replacing each word that is not in the index with
+        its correction when there is one
+        :param self
+        :param user_input: the search query of the user
+        :return: a pair of the list of words in the search query and the words of each of its phrases
+        """
+        queried_words = ANALYZER.query_terms(user_input)
+        phrases = ANALYZER.query_phrases(user_input)
+        if not self.use_fuzzy or self.trigram_index is None:
+            return queried_words, phrases
+        corrections = {}
+        for word in queried_words + [word for phrase in phrases for word in phrase]:
+            if word not in corrections and WILDCARD not in word and self.trigram_index.find(word) == -1:
+                corrections[word] = self.correction(word)
+        if not corrections:
+            return queried_words, phrases
+        queried_words = [corrections.get(word) or word for word in queried_words]
+        phrases = tuple(tuple(corrections.get(word) or word for word in phrase) for phrase in phrases)
+        return queried_words, phrases
+
+    def correction(self, word: str):
+        """
+        Finds the index term a word that is not in the index was most likely meant to be: the closest term by
+        edit distance (see fuzzy.max_distance for how close it has to be), then the one that appears on the most
+        pages, then the first in sorted order
+        Only the terms that share enough character trigrams with the word to be that close are compared with it
+        The vocabulary and page counts are those of the whole corpus, so every shard corrects a word the same way
+        :param self
+        :param word: the word in the search query
+        :return: the correction, or None if no index term is close enough
+        """
+        key = ("correction", word)
+        found = self.postings_cache.get(key)
+        if found is not None:
+            return found or None
+        trigram_index = self.trigram_index
+        bound = max_distance(word)
+        correction = None
+        if bound > 0:
+            shortlist = [trigram_index.terms_with(gram) for gram in grams(word)]
+            candidates, shared = np.unique(np.concatenate(shortlist).astype(np.int64), return_counts=True)
+            lengths = trigram_index.entries["term_length"][candidates].astype(np.int64)
+            compared = np.zeros(len(candidates), dtype=bool)
+            distances = np.full(len(candidates), bound + 1)
+            # the closest terms are searched for first, among the fewer terms sharing enough trigrams to be that close
+            for distance in range(1, bound + 1):
+                # the analyzer only keeps ASCII letters, digits and apostrophes, so a term has as many bytes as letters
+                new = (shared >= min_shared_grams(word, distance)) & (np.abs(lengths - len(word)) <= distance) & \
+                    ~compared
+                distances[new] = edit_distances(word, *trigram_index.terms_at(candidates[new]))
+                compared |= new
+                found = np.flatnonzero(distances <= distance)
+                if len(found):
+                    # the term dictionary is sorted, so the first term in sorted order is the one at the lowest position
+                    doc_counts = trigram_index.entries["doc_count"][candidates[found]].astype(np.int64)
+                    best = found[np.lexsort((candidates[found], -doc_counts, distances[found]))[0]]
+                    correction = trigram_index.term_at(candidates[best]).decode("utf-8")
+                    break
+        # no correction is cached as an empty string, since None means that nothing is cached
+        self.postings_cache.put(key, correction or "", POSTINGS_ENTRY_BYTES)
+        return correction
+
+    def profiled_rank(self, user_input: str):
+        """
+        Ranks the documents for a search query exactly as analyzed_rank does, recording how long each stage took
+        (analyzing the query, the first PageRank tier, fetching and scoring the postings, the top-k evaluation)
+        and how many postings were scanned with the profiler
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of (document ID, score) pairs, best first, the list of words in the search query and the
+        words of each of its phrases
+        """
+        start = time.perf_counter()
+        queried_words, phrases = self.analyze(user_input)
+        analyzed = time.perf_counter()
+        key = self.result_key(queried_words, phrases)
+        results = self.result_cache.get(key)
+        record = {"query": user_input, "terms": len(queried_words), "cached": results is not None, "postings": 0}
+        stages = {"analyze": (analyzed - start) * 1000}
+        if results is None and (phrases or self.conjunctive):
+            results, record["postings"] = self.evaluate_conjunctive(queried_words, phrases)
+            self.cache_results(key, results)
+            stages["intersect"] = (time.perf_counter() - analyzed) * 1000
+        elif results is None and self.tiered():
+            results, record["postings"] = self.rank_first_tier(key, queried_words)
+            record["tier"] = 1 if results is not None else 2
+            stages["first_tier"] = (time.perf_counter() - analyzed) * 1000
+        if results is None and len(queried_words) == 1:
+            started = time.perf_counter()
+            postings = self.scored_postings(queried_words[0])
+            fetched = time.perf_counter()
+            record["postings"] += len(postings[0]) if postings is not None else 0
+            results = self.rank_word(key, postings)
+            stages["postings"] = (fetched - started) * 1000
+            stages["top_k"] = (time.perf_counter() - fetched) * 1000
+        elif results is None:
+            started = time.perf_counter()
+            terms = self.fetch_terms(queried_words)
+            fetched = time.perf_counter()
+            record["postings"] += sum(len(term.doc_ids) for term in terms)
+            results = self.rank_terms(key, terms)
+            stages["postings"] = (fetched - started) * 1000
+            stages["top_k"] = (time.perf_counter() - fetched) * 1000
+        stages["total"] = (time.perf_counter() - start) * 1000
+        record["stages_ms"] = stages
+        record["results"] = len(results)
+        self.profiler.record_query(record)
+        return list(results), queried_words, phrases
+
+    def query_results(self, user_input: str):
+        """
+        Handles a search query and returns its results as structured data instead of printing them
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of {"rank", "id", "title", "score"} dictionaries, best first
+        """
+        with self.current_index():
+            return [{"rank": i + 1, "id": doc_id, "title": self.ids_to_titles[doc_id], "score": score}
+                    for i, (doc_id, score) in enumerate(self.rank_query(user_input))]
+
+    def shard_results(self, request: dict):
+        """
+        Answers a query for a ShardedQuery coordinator, with the coordinator's settings
+        Along with its score, each result carries the position in the query of the first word the document
+        contains, which ties between equal scores are broken by, so that the coordinator can merge the results
+        of every shard into exactly those of the whole index (every document of a conjunctive or phrase query
+        contains every required word, so their ties are only broken by document ID)
+        :param self
+        :param request: the search query ("query") and the settings to run it with ("pagerank", "and", "top_k"
+        and optionally "max_expansions" and "fuzzy")
+        :return: a list of [document ID, score, first word, title] entries, best first
+        """
+        with self.current_index():
+            settings = self.use_page_rank, self.conjunctive, self.top_k, self.max_expansions, self.use_fuzzy
+            self.use_page_rank, self.conjunctive, self.top_k = request["pagerank"], request["and"], request["top_k"]
+            self.max_expansions = request.get("max_expansions") or self.max_expansions
+            if request.get("fuzzy") is not None:
+                self.use_fuzzy = request["fuzzy"]
+            try:
+                results, queried_words, phrases = self.analyzed_rank(request["query"])
+                if self.conjunctive or phrases:
+                    first_words = [0] * len(results)
+                else:
+                    first_words = self.first_words(queried_words, [doc_id for doc_id, _ in results])
+            finally:
+                self.use_page_rank, self.conjunctive, self.top_k, self.max_expansions, self.use_fuzzy = settings
+            return [[doc_id, score, first, self.ids_to_titles[doc_id]]
+                    for (doc_id, score), first in zip(results, first_words)]
+
+    def first_words(self, queried_words: list, doc_ids: list):
+        """
+        Finds the first word of a query that each of a list of documents contains
+        :param self
+        :param queried_words: the list of words in the search query
+        :param doc_ids: the document IDs
+        :return: a list of the position of that word in the query, for each document
+        """
+        id_nums = np.array(doc_ids, dtype=np.int64)
+        first = np.full(len(doc_ids), len(queried_words))
+        for i in range(len(queried_words) - 1, -1, -1):
+            postings = self.scored_postings(queried_words[i])
+            if postings is None or len(doc_ids) == 0:
+                continue
+            word_ids = postings[0]
+            found = np.minimum(np.searchsorted(word_ids, id_nums), len(word_ids) - 1)
+            first[word_ids[found] == id_nums] = i
+        return first.tolist()
+
+    def search(self, queried_words: list):
+        """
+        Ranks the documents for a list of stemmed query words, keeping only the best top_k
+        Gives the same ranking as sorting every document's relevance_doc_matcher score (multiplied by
+        its page rank when PageRank is used), but skips documents that cannot make the top_k
+        Results are cached under the analyzed query, so queries that only differ in case, stop words or
+        inflection share an entry
+        :param self
+        :param queried_words: the list of words in the search query
+        :return: a list of (document ID, score) pairs, best first
+        """
+        key = self.result_key(queried_words)
+        results = self.result_cache.get(key)
+        if results is None and self.tiered():
+            results, _ = self.rank_first_tier(key, queried_words)
+        if results is None and len(queried_words) == 1:
+            results = self.rank_word(key, self.scored_postings(queried_words[0]))
+        if results is None:
+            results = self.rank_terms(key, self.fetch_terms(queried_words))
+        return list(results)
+
+    def tiered(self):
+        """
+        Checks whether disjunctive queries are answered from the first PageRank tiers first
+        :param self
+        :return: whether PageRank is used and the indexer wrote tiers that are to be used
+        """
+        return self.use_page_rank and self.use_tiers and self.tiers_index is not None
+
+    def rank_first_tier(self, key: tuple, queried_words: list):
+        """
+        Ranks the pages of the first PageRank tier for a list of stemmed query words, and keeps (and caches)
+        the results only when they are provably those of the whole index: the k-th best score must beat the
+        sum of the query words' bounds on any page outside the first tier
+        Pages are in the first tier of every word or of none, so the pages found here are fully scored, and
+        ties are broken the same way as in rank_terms
+        :param self
+        :param key: the key the results are cached under
+        :param queried_words: the list of words in the search query
+        :return: a pair of the (document ID, score) pairs of the best top_k documents, best first, or None when
+        the whole postings lists are needed, and the number of postings that were scanned
+        """
+        terms = []
+        rest_bound = 0
+        complete = True
+        for word in queried_words:
+            tier = self.first_tier(word)
+            if tier is None:
+                continue
+            id_nums, weights, bound, word_rest_bound = tier
+            terms.append(TermPostings(id_nums.tolist(), weights.tolist(), range(len(id_nums)), bound))
+            if word_rest_bound is not None:
+                complete = False
+                rest_bound += word_rest_bound
+        scanned = sum(len(term.doc_ids) for term in terms)
+        results = top_k(terms, self.top_k, self.ids_to_page_ranks)
+        if not complete and (len(results) < self.top_k or
+                             (results and results[-1][1] <= rest_bound + SLACK * abs(rest_bound))):
+            return None, scanned
+        self.cache_results(key, results)
+        return results, scanned
+
+    def first_tier(self, input_word: str):
+        """
+        Gets the scored first tier postings of a word, from the postings cache when possible
+        :param self
+        :param input_word: the word in the search query
+        :return: a tuple of the arrays (doc ids, tf-idf weights) of the first tier, sorted by doc id, an upper
+        bound on their page-rank-scaled weights and the bound on the rest (None when the first tier holds
+        every posting), or None if the word is not in the index
+        """
+        key = ("tier", self.postings_key(input_word))
+        tier = self.postings_cache.get(key)
+        if tier is None and WILDCARD in input_word:
+            positions, _ = self.expand(input_word)
+            terms = [self.words_to_doc_relevance.sorted_term(i) for i in positions.tolist()]
+            tiers = [found for found in map(self.first_tier, terms) if found is not None]
+            if not tiers:
+                return None
+            id_nums, weights = union([(id_nums, weights) for id_nums, weights, _, _ in tiers])
+            # a page outside the first tier gets at most the sum of the bounds of the terms it may contain
+            rest_bounds = [rest_bound for _, _, _, rest_bound in tiers if rest_bound is not None]
+            bound = float((weights * self.page_ranks_of(id_nums)).max()) if len(id_nums) else 0.0
+            tier = (id_nums, weights, bound, sum(rest_bounds) if rest_bounds else None)
+            self.postings_cache.put(key, tier, id_nums.nbytes + weights.nbytes + POSTINGS_ENTRY_BYTES)
+        elif tier is None:
+            found = self.tiers_index.tier(input_word)
+            if found is None:
+                return None
+            id_nums, frequencies, rest_bound = found
+            id_nums, weights = self.weigh(self.words_to_doc_relevance.idf(input_word), id_nums, frequencies)
+            bound = float((weights * self.page_ranks_of(id_nums)).max()) if len(id_nums) else 0.0
+            tier = (id_nums, weights, bound, rest_bound)
+            self.postings_cache.put(key, tier, id_nums.nbytes + weights.nbytes + POSTINGS_ENTRY_BYTES)
+        return tier
+
+    def search_conjunctive(self, queried_words: list, phrases: tuple):
+        """
+        Ranks the documents that contain every phrase of a query (and every word, when the querier is
+        conjunctive) for a list of stemmed query words, keeping only the best top_k
+        :param self
+        :param queried_words: the list of words in the search query
+        :param phrases: the words of each phrase of the search query
+        :return: a list of (document ID, score) pairs, best first
+        """
+        key = self.result_key(queried_words, phrases)
+        results = self.result_cache.get(key)
+        if results is None:
+            results, _ = self.evaluate_conjunctive(queried_words, phrases)
+            self.cache_results(key, results)
+        return list(results)
+
+    def evaluate_conjunctive(self, queried_words: list, phrases: tuple):
+        """
+        Finds the documents containing every required word by intersecting their postings (galloping through
+        the longer ones), keeps those in which each phrase appears, and scores them the same way as
+        relevance_doc_matcher (multiplied by the page rank when PageRank is used)
+        Without a positions file, a phrase only requires its words to appear somewhere in the document
+        Ties are broken by document ID
+        :param self
+        :param queried_words: the list of words in the search query
+        :param phrases: the words of each phrase of the search query
+        :return: a pair of the (document ID, score) pairs of the best top_k documents, best first, and the
+        number of postings that were compared
+        """
+        unique_words = list(dict.fromkeys(queried_words))
+        postings = {word: self.scored_postings(word) for word in unique_words}
+        if self.conjunctive:
+            required = unique_words
         else:
-            sorted_results = sorted(results.items(), key=lambda x: x[1], reverse=True)
-            self.print_results(sorted_results)
+            required = list(dict.fromkeys(word for phrase in phrases for word in phrase))
+        if not required or any(postings[word] is None for word in required):
+            return [], 0
+        matches, matched_positions, compared = intersect([postings[word][0].tolist() for word in required])
+        if self.positions_index is not None:
+            keep = [j for j in range(len(matches))
+                    if all(self.phrase_in(phrase, required, matched_positions, j) for phrase in phrases)]
+            matches = [matches[j] for j in keep]
+            matched_positions = [[positions[j] for j in keep] for positions in matched_positions]
+
+        id_nums = np.array(matches, dtype=np.int64)
+        scores = np.zeros(len(matches))
+        for word in queried_words:
+            if postings[word] is None:
+                continue
+            word_ids, weights = postings[word]
+            if word in required:
+                scores += weights[np.array(matched_positions[required.index(word)], dtype=np.int64)]
+            elif len(matches) > 0:
+                # an optional word only adds to the score of the matching documents that contain it
+                found = np.minimum(np.searchsorted(word_ids, id_nums), len(word_ids) - 1)
+                scores += np.where(word_ids[found] == id_nums, weights[found], 0)
+                compared += len(matches)
+        if self.use_page_rank:
+            scores = scores * self.page_ranks_of(id_nums)
+        best = np.lexsort((id_nums, -scores))[:self.top_k]
+        return list(zip(id_nums[best].tolist(), scores[best].tolist())), compared
+
+    def phrase_in(self, phrase: tuple, required: list, matched_positions: list, j: int):
+        """
+        Checks whether a phrase appears in the j-th document found by the intersection of the required words
+        :param self
+        :param phrase: the words of the phrase
+        :param required: the required words, in the order they were intersected
+        :param matched_positions: the position of each found document in the postings of each required word
+        :param j: the document's position among the found documents
+        :return: whether the phrase appears in the document
+        """
+        if len(phrase) == 1:
+            return True
+        word_positions = []
+        for word in phrase:
+            found = self.term_positions(word)
+            if found is None:
+                return False
+            _, offsets, positions = found
+            k = matched_positions[required.index(word)][j]
+            word_positions.append(positions[offsets[k]:offsets[k + 1]])
+        return phrase_match(word_positions)
+
+    def term_positions(self, input_word: str):
+        """
+        Gets the positions of a word in every document it appears in, from the postings cache when possible
+        :param self
+        :param input_word: the word in the search query
+        :return: a triple of arrays (doc ids, offsets, positions), see PositionsIndex.positions, or None
+        """
+        key = ("positions", input_word)
+        found = self.postings_cache.get(key)
+        if found is None:
+            found = self.positions_index.positions(input_word)
+            if found is None:
+                return None
+            self.postings_cache.put(key, found, sum(array.nbytes for array in found) + POSTINGS_ENTRY_BYTES)
+        return found
+
+    def result_key(self, queried_words: list, phrases: tuple = ()):
+        """
+        Gets the key the results of a query are cached under
+        :param self
+        :param queried_words: the list of words in the search query
+        :param phrases: the words of each phrase of the search query
+        :return: the analyzed query along with the settings that change its results
+        """
+        return tuple(queried_words), phrases, self.conjunctive, self.use_page_rank, self.top_k, self.max_expansions
+
+    def cache_results(self, key: tuple, results: list):
+        """
+        Caches the results of a query
+        :param self
+        :param key: the key the results are cached under
+        :param results: the (document ID, score) pairs of the query
+        :return: n/a
+        """
+        self.result_cache.put(key, results, RESULT_ENTRY_BYTES * (len(results) + len(key[0]) + 1))
+
+    def fetch_terms(self, queried_words: list):
+        """
+        Gets the scored postings of every query word that is in the index
+        :param self
+        :param queried_words: the list of words in the search query
+        :return: a list of TermPostings, in query order
+        """
+        terms = [self.term_postings(word) for word in queried_words]
+        return [term for term in terms if term is not None]
+
+    def rank_terms(self, key: tuple, terms: list):
+        """
+        Finds the best top_k documents for the postings of a query and caches them
+        :param self
+        :param key: the key the results are cached under
+        :param terms: the TermPostings of the query words, in query order
+        :return: a list of (document ID, score) pairs, best first
+        """
+        multipliers = self.ids_to_page_ranks if self.use_page_rank else None
+        results = top_k(terms, self.top_k, multipliers)
+        self.cache_results(key, results)
+        return results
+
+    def rank_word(self, key: tuple, postings: tuple):
+        """
+        Finds the best top_k documents for a query of a single word (or wildcard term) and caches them
+        A single word's scores are its weights, so they are computed and sorted all at once instead of
+        walking the postings, which gives the same results as rank_terms
+        :param self
+        :param key: the key the results are cached under
+        :param postings: the scored postings of the word (see scored_postings), or None if it is not in the index
+        :return: a list of (document ID, score) pairs, best first
+        """
+        results = []
+        if postings is not None:
+            id_nums, weights = postings
+            results = top_k_arrays(id_nums, weights, self.top_k, self.page_ranks_of(id_nums) if self.use_page_rank
+                                   else None)
+        self.cache_results(key, results)
+        return results
+
+    def term_postings(self, input_word: str):
+        """
+        Gets the postings of a word sorted by doc id, along with an upper bound on the score the word
+        can add to a document (folding in the page rank when PageRank is used)
+        :param self
+        :param input_word: the word in the search query
+        :return: the TermPostings of the word, or None if the word is not in the index
+        """
+        postings = self.scored_postings(input_word)
+        if postings is None:
+            return None
+        id_nums, weights = postings
+        key = (self.postings_key(input_word), self.use_page_rank)
+        if key not in self.upper_bounds:
+            if self.use_page_rank:
+                self.upper_bounds[key] = float((weights * self.page_ranks_of(id_nums)).max())
+            else:
+                self.upper_bounds[key] = float(weights.max())
+        # both words indexes keep postings sorted by doc id, so a posting's rank is its position
+        return TermPostings(id_nums.tolist(), weights.tolist(), range(len(id_nums)), self.upper_bounds[key])
+
+    def scored_postings(self, input_word: str):
+        """
+        Gets the tf-idf weight of a word in every document it appears in, from the postings cache when possible
+        :param self
+        :param input_word: the word in the search query
+        :return: a pair of arrays (doc ids, tf-idf weights) sorted by doc id, or None if the word is not in the index
+        """
+        key = self.postings_key(input_word)
+        postings = self.postings_cache.get(key)
+        if postings is not None:
+            return postings
+        postings = self.term_weights(input_word)
+        if postings is None:
+            return None
+        id_nums, weights = postings
+        self.postings_cache.put(key, postings, id_nums.nbytes + weights.nbytes + POSTINGS_ENTRY_BYTES)
+        return postings
+
+    def postings_key(self, input_word: str):
+        """
+        Gets the key the scored postings of a query word are cached under
+        :param self
+        :param input_word: the word in the search query
+        :return: the word, along with the expansion cap when it is a wildcard term (which the postings depend on)
+        """
+        return (input_word, self.max_expansions) if WILDCARD in input_word else input_word
+
+    def expand(self, pattern: str):
+        """
+        Finds the index terms that match a wildcard term: the terms that start with the part of the pattern
+        before its first wildcard are next to each other in the sorted term dictionary, so they are found by a
+        range scan, and only they are matched against the rest of the pattern
+        When more than max_expansions terms match, the most common ones (lowest idf) are kept
+        :param self
+        :param pattern: the wildcard term, such as celt* or c*tic
+        :return: a pair of arrays: the positions of the matching terms in sorted order (see the words index's
+        sorted_term and sorted_postings) and their idf
+        """
+        words_index = self.words_to_doc_relevance
+        prefix, _, rest = pattern.partition(WILDCARD)
+        low, high = words_index.prefix_range(prefix)
+        positions = np.arange(low, high)
+        idfs = words_index.sorted_idfs(low, high)
+        if rest.strip(WILDCARD):
+            matcher = re.compile(".*".join(re.escape(part) for part in pattern.split(WILDCARD)) + r"\Z")
+            terms = words_index.sorted_terms_between(low, high)
+            matches = np.array([matcher.match(term) is not None for term in terms], dtype=bool)
+            positions, idfs = positions[matches], idfs[matches]
+        if len(positions) > self.max_expansions:
+            kept = np.sort(np.lexsort((positions, idfs))[:self.max_expansions])
+            positions, idfs = positions[kept], idfs[kept]
+        return positions, idfs
+
+    def term_weights(self, input_word: str):
+        """
+        Gets the postings of a word from the words index and weights all of them at once,
+        computing (count / max count) * idf exactly as tf_calculator and idf_calculator do
+        A wildcard term gets the postings of every term it expands to, merged, with the weights of a document
+        that contains several of them added up
+        :param self
+        :param input_word: the word in the search query
+        :return: a pair of arrays (doc ids, tf-idf weights) sorted by doc id, or None if the word is not in the index
+        """
+        words_index = self.words_to_doc_relevance
+        if WILDCARD in input_word:
+            positions, idfs = self.expand(input_word)
+            if len(positions) == 0:
+                return None
+            # the terms are read by position, so the term dictionary is not searched again for each of them
+            return union([self.weigh(idf, *words_index.sorted_postings(i))
+                          for i, idf in zip(positions.tolist(), idfs.tolist())])
+        postings = words_index.postings(input_word)
+        if postings is None:
+            return None
+        return self.weigh(words_index.idf(input_word), *postings)
+
+    def weigh(self, idf: float, id_nums: np.ndarray, frequencies: np.ndarray):
+        """
+        Weights postings of a word all at once, computing (count / max count) * idf
+        :param self
+        :param idf: the idf of the word
+        :param id_nums: the doc ids of the postings
+        :param frequencies: the count of the word in each of those docs
+        :return: a pair of arrays (doc ids, tf-idf weights)
+        """
+        id_nums = id_nums.astype(np.int64)
+        if self.max_count_array is None:
+            self.max_count_array = np.ones(max(self.ids_to_max_euclidean, default=-1) + 1)
+            for doc_id, most in self.ids_to_max_euclidean.items():
+                self.max_count_array[doc_id] = most
+        weights = frequencies.astype(np.float64) / self.max_count_array[id_nums] * idf
+        return id_nums, weights
+
+    def page_ranks_of(self, id_nums: np.ndarray):
+        """
+        Looks up the page ranks of an array of document IDs
+        :param self
+        :param id_nums: the document IDs
+        :return: an array of their page ranks
+        """
+        if self.page_rank_array is None:
+            self.page_rank_array = np.zeros(max(self.ids_to_page_ranks, default=-1) + 1)
+            for doc_id, rank in self.ids_to_page_ranks.items():
+                self.page_rank_array[doc_id] = rank
+        return self.page_rank_array[id_nums]
 
     def tf_calculator(self, doc_id: int, count: float):
         """
@@ -88,60 +862,360 @@ class Query:
         :param input_word: the word in the search query
         :return: a mapping of document IDs to their relevance scores
         """
-        products = {}
-        doc_frequency = self.words_to_doc_relevance.get(input_word)
-        if doc_frequency:
-            for id in doc_frequency:
-                product = self.tf_calculator(id, doc_frequency[id]) * self.idf_calculator(len(doc_frequency))
-                products[id] = product
-            return products
-        else:
+        postings = self.scored_postings(input_word)
+        if postings is None:
             return {}
+        id_nums, weights = postings
+        return dict(zip(id_nums.tolist(), weights.tolist()))
 
-    def add_relevance(self, scores: dict, old_scores: dict):
+    def relevance_doc_matcher(self, queried_words: list):
         """
-        Adds the relevance scores of each word
-        If the word already exists in the mapping, its score is added to the existing score
-        :param scores: the updated relevance scores of the word
-        :param old_scores: the old relevance scores of the word
-        :return: a mapping of document IDs to their updated relevance scores
+        Maps document IDs to their relevance scores
+        The weights of every query word are gathered from its scored postings and accumulated into a dense
+        array of scores indexed by document ID, in query order
+        :param self
+        :param queried_words: the list of words in the search query
+        :return: a mapping of document IDs to their relevance scores, in the order the documents are first matched
         """
-        for (id_num, score) in scores.items():
-            if id_num in old_scores:
-                old_scores[id_num] += score
-            else:
-                old_scores[id_num] = score
-        return old_scores
+        postings = [self.scored_postings(word) for word in queried_words]
+        postings = [found for found in postings if found is not None]
+        if not postings:
+            return {}
+        id_nums = np.concatenate([found_ids for found_ids, _ in postings])
+        scores = np.zeros(int(id_nums.max()) + 1)
+        for found_ids, weights in postings:
+            # the doc ids of a single word are distinct, so the scatter-add needs no np.add.at
+            scores[found_ids] += weights
+        matched, first_seen = np.unique(id_nums, return_index=True)
+        matched = matched[np.argsort(first_seen)]
+        return dict(zip(matched.tolist(), scores[matched].tolist()))
 
-    def relevance_doc_matcher(self, queried_words: list):
+def run_shard(connection, titles: str, docs: str, words: str, result_cache_bytes: int, postings_cache_bytes: int):
+    """
+    Runs in a shard worker process: loads the shard's index, then answers the coordinator's requests
+    (see Query.shard_results) until it sends None
+    :param connection: the worker's end of the pipe to the coordinator
+    :param titles: filepath to the shard's titles file
+    :param docs: filepath to the shard's docs file
+    :param words: filepath to the shard's words file
+    :param result_cache_bytes: memory budget of the shard's query result cache
+    :param postings_cache_bytes: memory budget of the shard's scored postings cache
+    :return: n/a
+    """
+    querier = Query(result_cache_bytes, postings_cache_bytes)
+    try:
+        querier.load(titles, docs, words)
+    except Exception as error:
+        connection.send(error)
+        return
+    connection.send(None)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        connection.send(querier.shard_results(request))
+
+
+class ProcessShard:
+    def __init__(self, titles: str, docs: str, words: str, result_cache_bytes: int = RESULT_CACHE_BYTES,
+                 postings_cache_bytes: int = POSTINGS_CACHE_BYTES):
+        """
+        A shard served by a worker process of the coordinator, over a pipe
+        The worker starts loading right away; ready waits for it to be done
+        :param titles: filepath to the shard's titles file
+        :param docs: filepath to the shard's docs file
+        :param words: filepath to the shard's words file
+        :param result_cache_bytes: memory budget of the shard's query result cache
+        :param postings_cache_bytes: memory budget of the shard's scored postings cache
         """
-        Maps document IDs to their relevance scores using helper functions
+        import multiprocessing
+        # the coordinator's end of the pipe to the worker
+        self.connection, worker_connection = multiprocessing.Pipe()
+        # the worker process
+        self.process = multiprocessing.Process(target=run_shard, daemon=True, args=(
+            worker_connection, titles, docs, words, result_cache_bytes, postings_cache_bytes))
+        self.process.start()
+        worker_connection.close()
+
+    def ready(self):
+        """
+        Waits for the worker to load its shard
         :param self
-        :param queried_words: the list of words in the search query
-        :return: a mapping of document IDs to their updated relevance scores
+        :return: n/a
         """
-        scores = {}
-        for word in queried_words:
-            word_score = self.get_relevance(word)
-            scores = self.add_relevance(word_score, scores)
-        return scores
+        error = self.connection.recv()
+        if error is not None:
+            raise error
+
+    def send(self, request: dict):
+        """
+        Sends a request to the worker without waiting for its answer
+        :param self
+        :param request: the search query and its settings, see Query.shard_results
+        :return: n/a
+        """
+        self.connection.send(request)
+
+    def receive(self):
+        """
+        Waits for the answer to the last request
+        :param self
+        :return: the shard's [document ID, score, first word, title] entries, best first
+        """
+        return self.connection.recv()
+
+    def close(self):
+        """
+        Stops the worker
+        :param self
+        :return: n/a
+        """
+        self.connection.send(None)
+        self.process.join()
+        self.connection.close()
+
+
+class SocketShard:
+    def __init__(self, host: str, port: int):
+        """
+        A shard served by a query server ([python3 query.py --serve PORT ...] on the shard's files)
+        :param host: the server's address
+        :param port: the server's port
+        """
+        # the connection to the server, and the stream its responses are read from
+        self.connection = socket.create_connection((host, port))
+        self.responses = self.connection.makefile("r", encoding="utf-8")
+
+    def ready(self):
+        """
+        Does nothing, since a server has loaded its shard before it accepts connections
+        :param self
+        :return: n/a
+        """
+
+    def send(self, request: dict):
+        """
+        Sends a request to the server without waiting for its answer
+        :param self
+        :param request: the search query and its settings, see Query.shard_results
+        :return: n/a
+        """
+        self.connection.sendall((json.dumps(dict(request, shard=True)) + "\n").encode("utf-8"))
+
+    def receive(self):
+        """
+        Waits for the answer to the last request
+        :param self
+        :return: the shard's [document ID, score, first word, title] entries, best first
+        """
+        response = json.loads(self.responses.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["results"]
+
+    def close(self):
+        """
+        Closes the connection to the server
+        :param self
+        :return: n/a
+        """
+        self.responses.close()
+        self.connection.close()
+
+
+class ShardedQuery:
+    def __init__(self, shards: list):
+        """
+        Answers queries over an index split into shards (see the indexer's --shards option) by sending each
+        query to every shard at once and merging their best top_k results; since every shard scores its pages
+        with the corpus-wide idf and page ranks, the results are those of the whole index
+        :param shards: the shards (ProcessShard or SocketShard), which are waited on until they are ready
+        """
+        # the shards, each answering for a part of the pages
+        self.shards = shards
+        # indicator to use PageRank
+        self.use_page_rank = False
+        # indicator to only return documents that contain every word of a query (AND instead of OR)
+        self.conjunctive = False
+        # number of results a query returns
+        self.top_k = 10
+        # number of index terms a wildcard query term is expanded to at most
+        self.max_expansions = MAX_EXPANSIONS
+        # indicator to replace query words that are not in the index with their closest index term
+        self.use_fuzzy = True
+        for shard in shards:
+            shard.ready()
+
+    def rank_entries(self, user_input: str):
+        """
+        Sends a search query to every shard and merges their results, breaking ties between equal scores
+        by the first query word the documents contain and then by document ID, as the whole index does
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of [document ID, score, first word, title] entries, best first
+        """
+        request = {"query": user_input, "pagerank": self.use_page_rank, "and": self.conjunctive, "top_k": self.top_k,
+                   "max_expansions": self.max_expansions, "fuzzy": self.use_fuzzy}
+        for shard in self.shards:
+            shard.send(request)
+        entries = [entry for shard in self.shards for entry in shard.receive()]
+        entries.sort(key=lambda entry: (-entry[1], entry[2], entry[0]))
+        return entries[:self.top_k]
+
+    def rank(self, user_input: str):
+        """
+        Ranks the documents of every shard for a search query
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of (document ID, score) pairs, best first
+        """
+        return [(doc_id, score) for doc_id, score, _, _ in self.rank_entries(user_input)]
+
+    def query_results(self, user_input: str):
+        """
+        Handles a search query and returns its results as structured data instead of printing them
+        :param self
+        :param user_input: the search query of the user
+        :return: a list of {"rank", "id", "title", "score"} dictionaries, best first
+        """
+        return [{"rank": i + 1, "id": doc_id, "title": title, "score": score}
+                for i, (doc_id, score, _, title) in enumerate(self.rank_entries(user_input))]
+
+    def query(self, user_input: str):
+        """
+        Handles a search query and prints out the results
+        :param self
+        :param user_input: the search query of the user
+        :return: n/a
+        """
+        results = self.rank_entries(user_input)
+        if len(results) == 0:
+            print("no results found")
+        for i, (_, _, _, title) in enumerate(results):
+            print(f"{i+1} {title}")
+
+    def close(self):
+        """
+        Stops or disconnects from every shard
+        :param self
+        :return: n/a
+        """
+        for shard in self.shards:
+            shard.close()
+
 
 query = Query()
 
 # parses the arguments when the file is run and runs a query REPL of the specified indices
 if __name__ == "__main__":
-    if len(sys.argv) - 1 == 4 and sys.argv[1] == '--pagerank':
-        query.use_page_rank = True
-        read_title_file(sys.argv[2], query.ids_to_titles)
-        read_docs_file(sys.argv[3], query.ids_to_page_ranks)
-        read_words_file(sys.argv[4], query.words_to_doc_relevance)
-    if len(sys.argv) - 1 == 3:
-        query.use_page_rank = False
-        read_title_file(sys.argv[1], query.ids_to_titles)
-        read_docs_file(sys.argv[2], query.ids_to_page_ranks)
-        read_words_file(sys.argv[3], query.words_to_doc_relevance)
-    
-    query.fill_euclidean()
+    parser = argparse.ArgumentParser(description='Runs a search REPL over the title, docs and words files')
+    parser.add_argument('--pagerank', action='store_true', help='multiply relevance scores by page ranks')
+    parser.add_argument('--and', dest='conjunctive', action='store_true',
+                        help='only return pages that contain every word of a query (quoted phrases are always required)')
+    parser.add_argument('--no-tiers', dest='tiers', action='store_false',
+                        help='always rank PageRank queries from the whole postings lists, ignoring <words>.tiers')
+    parser.add_argument('--no-fuzzy', dest='fuzzy', action='store_false',
+                        help='do not replace query words that are not in the index with their closest index term '
+                        '(the correction needs the <words>.trigrams file written by the indexer)')
+    parser.add_argument('--top-k', type=int, default=10, help='number of results shown for each query')
+    parser.add_argument('--max-expansions', type=int, default=MAX_EXPANSIONS,
+                        help='number of index terms a wildcard query term (celt*, c*tic) is expanded to at most, '
+                        'keeping the most common ones')
+    parser.add_argument('--batch', action='store_true',
+                        help='answer one query per line of stdin with one line of JSON results each')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='serve queries over TCP on this port (one JSON object per line) instead of the REPL')
+    parser.add_argument('--host', default='127.0.0.1', help='address the server listens on')
+    parser.add_argument('--result-cache-mb', type=float, default=RESULT_CACHE_BYTES / 2**20,
+                        help='memory budget of the query result cache in MB (0 disables it)')
+    parser.add_argument('--postings-cache-mb', type=float, default=POSTINGS_CACHE_BYTES / 2**20,
+                        help='memory budget of the scored postings cache in MB (0 disables it)')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='print the hit rates of the stemming, result and postings caches to stderr on exit')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the load time and peak memory, and the stage times and postings scanned '
+                        'of every query as JSON on exit')
+    parser.add_argument('--profile-output', help='file the profile report is written to (stderr by default)')
+    parser.add_argument('--cprofile', metavar='FILE', help='also capture a cProfile of the run into FILE (implies --profile)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also trace Python allocations for exact peaks (slow; implies --profile)')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help='search an index split into N shards by the indexer (the files given are those it was '
+                        'given), each loaded and searched by its own worker process')
+    parser.add_argument('--shard-servers', metavar='HOST:PORT,...',
+                        help='search the shards served by these query servers (started with --serve on each shard\'s '
+                        'files) instead of loading any files')
+    parser.add_argument('--published', metavar='DIR',
+                        help='search the version of the index published to DIR by index.py --publish instead of the '
+                        'files given, loading each newly published version in the background and swapping it in '
+                        'between queries')
+    parser.add_argument('--reload-interval', type=float, default=1.0,
+                        help='number of seconds between two checks for a newly published version (with --published)')
+    parser.add_argument('titles', nargs='?', help='filepath to the titles file')
+    parser.add_argument('docs', nargs='?', help='filepath to the docs file')
+    parser.add_argument('words', nargs='?', help='filepath to the words file')
+    args = parser.parse_args()
+    if args.shard_servers is None and args.published is None and args.words is None:
+        parser.error('the titles, docs and words files are required')
+    if args.published is not None and (args.shards is not None or args.shard_servers is not None):
+        parser.error('--published cannot be combined with shards')
+    if args.published is not None and read_manifest(args.published) is None:
+        parser.error('no index was published to ' + args.published + ' yet')
+    if args.reload_interval <= 0:
+        parser.error('--reload-interval must be positive')
+    if args.max_expansions < 1:
+        parser.error('--max-expansions must be at least 1')
+    if (args.shards is not None or args.shard_servers is not None) and \
+            (args.profile or args.cprofile or args.tracemalloc or args.cache_stats):
+        parser.error('profiling and cache statistics are only available without shards')
+    if args.shard_servers is not None:
+        addresses = [address.rsplit(':', 1) for address in args.shard_servers.split(',')]
+        query = ShardedQuery([SocketShard(host, int(port)) for host, port in addresses])
+        atexit.register(query.close)
+    elif args.shards is not None:
+        query = ShardedQuery([ProcessShard(shard_path(args.titles, shard), shard_path(args.docs, shard),
+                                           shard_path(args.words, shard), int(args.result_cache_mb * 2**20),
+                                           int(args.postings_cache_mb * 2**20)) for shard in range(args.shards)])
+        atexit.register(query.close)
+    query.use_page_rank = args.pagerank
+    query.top_k = args.top_k
+    query.conjunctive = args.conjunctive
+    query.max_expansions = args.max_expansions
+    query.use_fuzzy = args.fuzzy
+    if not isinstance(query, ShardedQuery):
+        query.use_tiers = args.tiers
+        query.result_cache.max_bytes = int(args.result_cache_mb * 2**20)
+        query.postings_cache.max_bytes = int(args.postings_cache_mb * 2**20)
+        reloader = None
+        if args.published is not None:
+            from reloader import IndexReloader
+            reloader = IndexReloader(query, args.published, args.reload_interval)
+        if args.profile or args.cprofile or args.tracemalloc:
+            query.profiler = Profiler(trace_memory=args.tracemalloc, cprofile=args.cprofile)
+            with query.profiler.phase("load"):
+                if reloader is None:
+                    query.load(args.titles, args.docs, args.words)
+                else:
+                    reloader.reload()
+            atexit.register(lambda: query.profiler.finish(args.profile_output))
+        elif reloader is None:
+            query.load(args.titles, args.docs, args.words)
+        else:
+            reloader.reload()
+        if reloader is not None:
+            reloader.start()
+        if args.cache_stats:
+            atexit.register(lambda: print(json.dumps(query.cache_stats()), file=sys.stderr))
+
+    if args.batch:
+        import server
+        server.run_batch(query, sys.stdin, sys.stdout)
+        sys.exit(0)
+    if args.serve is not None:
+        import asyncio
+        import server
+        asyncio.run(server.serve(query, args.host, args.serve))
+        sys.exit(0)
 
     while (True):
         print("search>", end="")
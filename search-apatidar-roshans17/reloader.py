@@ -0,0 +1,88 @@
+"""
+Keeps a running Query on the latest version of an index published by the indexer (index.py --publish):
+a background thread polls the manifest of the publish directory and, when it points to a new version,
+loads that version into a separate querier and swaps it into the running one between two queries
+Queries keep being answered from the old version while the new one loads
+"""
+import sys
+import threading
+
+from file_io import read_manifest
+
+# default number of seconds between two reads of the manifest
+RELOAD_INTERVAL = 1.0
+
+
+class IndexReloader:
+    def __init__(self, querier: "Query", directory: str, interval: float = RELOAD_INTERVAL):
+        """
+        :param querier: the querier kept on the latest published version
+        :param directory: the publish directory the indexer writes versions to
+        :param interval: number of seconds between two reads of the manifest
+        """
+        # the querier kept on the latest published version
+        self.querier = querier
+        # the publish directory the indexer writes versions to
+        self.directory = directory
+        # number of seconds between two reads of the manifest
+        self.interval = interval
+        # set to stop the polling thread
+        self.stopped = threading.Event()
+        # the polling thread, once started
+        self.thread = None
+
+    def reload(self):
+        """
+        Loads the published version of the index into a separate querier, then swaps it into the querier
+        The old version keeps answering queries while the new one loads; only the swap waits for the running query
+        :param self
+        :return: True if a new version was swapped in, False if the querier already has the published version
+        """
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            raise FileNotFoundError("no index was published to " + self.directory)
+        version, titles, docs, words = manifest
+        if version == self.querier.version:
+            return False
+        # only the loaded index is taken from the snapshot, so it needs no caches of its own; it is built from the
+        # querier's own class, since query.py run as a script is __main__ and importing query would load it again
+        snapshot = type(self.querier)(result_cache_bytes=0, postings_cache_bytes=0)
+        snapshot.load(titles, docs, words)
+        snapshot.version = version
+        self.querier.swap(snapshot)
+        return True
+
+    def run(self):
+        """
+        Polls the manifest until stopped, reloading the index whenever a new version is published
+        A version that fails to load (removed, or not fully written by a broken build) is reported and the
+        querier stays on the version it has
+        :param self
+        :return: n/a
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                if self.reload():
+                    print("loaded version " + str(self.querier.version) + " of " + self.directory,
+                          file=sys.stderr, flush=True)
+            except (OSError, ValueError, KeyError) as error:
+                print("could not reload " + self.directory + ": " + repr(error), file=sys.stderr, flush=True)
+
+    def start(self):
+        """
+        Starts polling the manifest on a background thread
+        :param self
+        :return: n/a
+        """
+        self.thread = threading.Thread(target=self.run, name="index-reloader", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops polling the manifest, waiting for a reload in progress to finish
+        :param self
+        :return: n/a
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
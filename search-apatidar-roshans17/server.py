@@ -0,0 +1,111 @@
+"""
+Provides long-running query service modes for a loaded Query: an asyncio TCP server that answers one
+JSON request per line from many clients at once, and a batch mode that answers one query per line of stdin
+request looks like:
+{"query": "boston celtics"}
+response looks like:
+{"query": "boston celtics", "results": [{"rank": 1, "id": 2, "title": "...", "score": 0.5}, ...], "elapsed_ms": 0.4}
+A server running on one shard of an index also answers the requests of a ShardedQuery coordinator (see
+Query.shard_results), which carry the coordinator's settings and get back raw entries:
+{"query": "boston celtics", "shard": true, "pagerank": false, "and": false, "top_k": 10, "max_expansions": 50,
+ "fuzzy": true}
+{"results": [[2, 0.5, 0, "..."], ...]}
+"""
+import asyncio
+import json
+import time
+
+
+def answer(querier, user_input: str):
+    """
+    Runs a single query and times it
+    :param querier: the Query to search with
+    :param user_input: the search query
+    :return: the response dictionary for the query
+    """
+    start = time.perf_counter()
+    results = querier.query_results(user_input)
+    return {"query": user_input, "results": results, "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+
+def run_batch(querier, input_fh, output_fh):
+    """
+    Answers one query per line of input_fh, writing one line of JSON per query to output_fh
+    :param querier: the Query to search with
+    :param input_fh: the file the queries are read from
+    :param output_fh: the file the responses are written to
+    :return: n/a
+    """
+    for line in input_fh:
+        user_input = line.rstrip("\n")
+        if user_input == "":
+            continue
+        output_fh.write(json.dumps(answer(querier, user_input)) + "\n")
+        output_fh.flush()
+
+
+async def handle_client(querier, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Answers the requests of one client connection until it disconnects
+    Queries run on the event loop between reads, so each one sees the index as a whole and other
+    clients are served as soon as it finishes
+    :param querier: the Query to search with
+    :param reader: the client's stream of requests
+    :param writer: the client's stream of responses
+    :return: n/a
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                if not isinstance(request["query"], str):
+                    raise TypeError("query must be a string")
+                if request.get("shard") and not isinstance(request["top_k"], int):
+                    raise TypeError("top_k must be an integer")
+                if request.get("shard") and not isinstance(request.get("max_expansions", 1), int):
+                    raise TypeError("max_expansions must be an integer")
+                if request.get("shard") and not isinstance(request.get("fuzzy", True), bool):
+                    raise TypeError("fuzzy must be a boolean")
+            except (ValueError, KeyError, TypeError) as error:
+                response = {"error": "bad request: " + str(error)}
+            else:
+                if request.get("shard"):
+                    response = {"results": querier.shard_results({key: request.get(key) for key in
+                                                                  ("query", "pagerank", "and", "top_k",
+                                                                   "max_expansions", "fuzzy")})}
+                else:
+                    response = answer(querier, request["query"])
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start(querier, host: str, port: int):
+    """
+    Starts the query server
+    :param querier: the Query to search with
+    :param host: the address to listen on
+    :param port: the port to listen on (0 picks a free one)
+    :return: the running asyncio server
+    """
+    return await asyncio.start_server(lambda reader, writer: handle_client(querier, reader, writer), host, port)
+
+
+async def serve(querier, host: str, port: int):
+    """
+    Runs the query server until it is interrupted
+    :param querier: the Query to search with
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :return: n/a
+    """
+    query_server = await start(querier, host, port)
+    async with query_server:
+        print(f"serving on {host}:{query_server.sockets[0].getsockname()[1]}", flush=True)
+        await query_server.serve_forever()
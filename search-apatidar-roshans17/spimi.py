@@ -0,0 +1,109 @@
+"""
+Provides block-based (SPIMI) construction of the words index for corpora that do not fit in memory:
+postings are gathered in memory one block at a time, each full block is written to a sorted run on
+disk, and the runs are k-way merged back into one sorted stream of postings when the index is written
+"""
+import heapq
+import os
+import tempfile
+from itertools import groupby
+
+# rough number of bytes a single (word, doc ID) posting costs in the in-memory words dictionary
+BYTES_PER_POSTING = 150
+
+
+def block_size_for(memory_budget: int):
+    """
+    Converts a memory budget into the number of postings a block may hold
+    :param memory_budget: the number of bytes the in-memory block may use
+    :return: the number of postings per block
+    """
+    return max(1, memory_budget // BYTES_PER_POSTING)
+
+
+def read_run(run: str):
+    """
+    Reads the postings of a run back one word at a time
+    :param run: filepath to the run
+    :return: a generator of (word, ids_to_counts) pairs, sorted by word
+    """
+    with open(run, "r") as run_fh:
+        for line in run_fh:
+            split = line.split()
+            yield split[0], {int(split[i]): int(split[i+1]) for i in range(1, len(split), 2)}
+
+
+class SpilledWords:
+    """
+    The words -> ids -> count dictionary of an index that was built in blocks
+    Only the sorted runs live on disk; iterating over it merges the runs again, so it is meant to be
+    read once, by the writers, in sorted order
+    Looking a single word up would merge every run up to it, so it only offers items() and iteration, not the
+    lookups of a dictionary
+    """
+
+    def __init__(self, directory: str = None):
+        """
+        :param directory: where the runs are written (a new temporary directory by default)
+        """
+        self.temp_dir = tempfile.TemporaryDirectory(dir=directory, prefix="spimi-")
+        # filepaths of the runs, in the order their pages were read
+        self.runs = []
+        # number of distinct words, counted by the last merge that went through every run (None until then)
+        self.word_count = None
+
+    def flush(self, words_dict: dict):
+        """
+        Writes a block of postings to a new run, sorted by word (which is also UTF-8 byte order)
+        Within a word, postings keep the order their pages were read in
+        :param self
+        :param words_dict: the block's words -> ids -> count dictionary
+        :return: n/a
+        """
+        run = os.path.join(self.temp_dir.name, "run" + str(len(self.runs)))
+        with open(run, "w") as run_fh:
+            for word in sorted(words_dict):
+                run_fh.write(word)
+                for id_num, count in words_dict[word].items():
+                    run_fh.write(" " + str(id_num) + " " + str(count))
+                run_fh.write("\n")
+        self.runs.append(run)
+        self.word_count = None
+
+    def items(self):
+        """
+        K-way merges the runs into one stream of postings
+        Runs are merged in the order they were written, so a word's postings from earlier pages come first
+        :param self
+        :return: a generator of (word, ids_to_counts) pairs, sorted by word
+        """
+        merged = heapq.merge(*[read_run(run) for run in self.runs], key=lambda item: item[0])
+        word_count = 0
+        for word, group in groupby(merged, key=lambda item: item[0]):
+            ids_to_counts = {}
+            for _, run_counts in group:
+                for id_num, count in run_counts.items():
+                    ids_to_counts[id_num] = ids_to_counts.get(id_num, 0) + count
+            word_count += 1
+            yield word, ids_to_counts
+        self.word_count = word_count
+
+    def __iter__(self):
+        for word, _ in self.items():
+            yield word
+
+    def __len__(self):
+        # the writers have usually merged the runs already; otherwise a merge counts the words once
+        if self.word_count is None:
+            for _ in self.items():
+                pass
+        return self.word_count
+
+    def close(self):
+        """
+        Deletes the runs
+        :param self
+        :return: n/a
+        """
+        self.temp_dir.cleanup()
+        self.runs = []
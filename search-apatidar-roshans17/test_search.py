@@ -1,6 +1,31 @@
 # import pytest
-from pytest import raises
+import asyncio
+import io
+import math
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import weakref
+
+import numpy
+from pytest import raises, approx
 import index
+import analysis
+import file_io
+import codec
+import fuzzy
+import minhash
+import cache
+import benchmark
+import profiling
+import intersect
+import pagerank
+import query
+import reloader
+import server
 
 # ------------------------- UNIT TESTS -------------------------------------
 
@@ -108,30 +133,756 @@ def test_calculate_weights():
 def test_page_rank():
     #testing the values of pagerank with various wiki files that were either created by us or given to us
     #and that the final values all add up to 1. 
+    #(the sparse engine sums in a different order than the pairwise loop, so values match to floating-point tolerance)
 
     ID = index.Index('BostonCelticsWiki.xml')
     expected = {1: 0.33333333333333326, 2: 0.43264271886591577, 3: 0.23402394780075067}
-    assert expected == ID.curr_dict_pr
+    assert ID.curr_dict_pr == approx(expected)
     assert 1 - sum(ID.curr_dict_pr.values()) < .001
 
     ID1 = index.Index('PageRankExample1.xml')
     expected1 = {1: 0.4326427188659158, 2: 0.23402394780075067, 3: 0.33333333333333326}
-    assert expected1 == ID1.curr_dict_pr
+    assert ID1.curr_dict_pr == approx(expected1)
     assert 1 - sum(ID1.curr_dict_pr.values()) < .001
 
     ID2 = index.Index('PageRankExample2.xml')
     expected2 = {1: 0.20184346250214996, 2: 0.03749999999999998, 3: 0.37396603749279056, 4: 0.3866905000050588}
-    assert expected2 == ID2.curr_dict_pr
+    assert ID2.curr_dict_pr == approx(expected2)
     assert 1 - sum(ID2.curr_dict_pr.values()) < .001
 
     ID3 = index.Index('PageRankExample3.xml')
     expected3 = {1: 0.05242784862611451, 2: 0.05242784862611451, 3: 0.4475721513738852, 4: 0.44757215137388523}
-    assert expected3 == ID3.curr_dict_pr
+    assert ID3.curr_dict_pr == approx(expected3)
     assert 1 - sum(ID3.curr_dict_pr.values()) < .001
 
     ID4 = index.Index('PageRankOwnExample.xml')
     expected4 = {1: 0.320011728893252, 2: 0.037499999999999936, 3: 0.3095099695592642, 4: 0.33297830154748215}
-    assert expected4 == ID4.curr_dict_pr
+    assert ID4.curr_dict_pr == approx(expected4)
     assert 1 - sum(ID4.curr_dict_pr.values()) < .001
 
-# ------------------------- SYSTEMS TESTS -------------------------------------
\ No newline at end of file
+def test_streaming_index():
+    # testing that parsing one page at a time produces exactly the same dictionaries, in the same order, 
+    # as parsing the whole tree (links are only resolved once every title has been read)
+    for wiki in ['BostonCelticsWiki.xml', 'PageRankOwnExample.xml', 'SmallWiki.xml']:
+        tree_index = index.Index(wiki)
+        stream_index = index.Index(wiki, streaming=True)
+        assert list(stream_index.title_dict.items()) == list(tree_index.title_dict.items())
+        assert list(stream_index.words_dict.items()) == list(tree_index.words_dict.items())
+        assert stream_index.links_dict == tree_index.links_dict
+        assert stream_index.curr_dict_pr == tree_index.curr_dict_pr
+
+def test_parallel_index():
+    # testing that spreading pages across worker processes and merging their partial indexes gives exactly
+    # the same dictionaries, in the same order, as indexing in a single process
+    for wiki in ['BostonCelticsWiki.xml', 'SmallWiki.xml']:
+        single = index.Index(wiki)
+        parallel = index.Index(wiki, workers=2)
+        assert list(parallel.title_dict.items()) == list(single.title_dict.items())
+        assert list(parallel.words_dict.items()) == list(single.words_dict.items())
+        assert parallel.links_dict == single.links_dict
+        assert parallel.max_word_dict == single.max_word_dict
+        assert parallel.curr_dict_pr == single.curr_dict_pr
+
+def test_block_index(tmp_path):
+    # testing that building the words index in small blocks that are flushed to sorted runs and merged
+    # gives the same postings as building it in memory, and the same binary words file byte for byte
+    in_memory = index.Index('SmallWiki.xml')
+    blocked = index.Index('SmallWiki.xml', streaming=True, block_size=2000)
+    assert len(blocked.words_dict.runs) > 1
+    merged = dict(blocked.words_dict.items())
+    assert list(merged) == sorted(in_memory.words_dict)
+    # the merge counted the words, so their number is known without merging the runs again
+    assert blocked.words_dict.word_count == len(blocked.words_dict) == len(merged)
+    assert merged == in_memory.words_dict
+    assert blocked.max_word_dict == in_memory.max_word_dict
+
+    file_io.write_binary_words_file(str(tmp_path / 'memory'), in_memory.words_dict, 107)
+    file_io.write_binary_words_file(str(tmp_path / 'blocks'), blocked.words_dict, 107)
+    for suffix in ['', '.postings']:
+        assert (tmp_path / ('memory' + suffix)).read_bytes() == (tmp_path / ('blocks' + suffix)).read_bytes()
+    blocked.words_dict.close()
+
+def test_incremental_update(tmp_path):
+    # testing that applying a delta of removed, changed and added pages to a written index gives the same index
+    # as rebuilding the updated wiki from scratch, that links to a newly added title now resolve, and that the
+    # warm started PageRank converges in fewer iterations; positions are kept up to date as well
+    ID = index.Index('SmallWiki.xml', positions=True)
+    titles, docs, words = str(tmp_path / 'titles.txt'), str(tmp_path / 'docs.txt'), str(tmp_path / 'words')
+    file_io.write_title_file(titles, ID.title_dict)
+    file_io.write_docs_file(docs, ID.curr_dict_pr, ID.max_word_dict)
+    file_io.write_links_file(file_io.links_path(docs), ID.link_titles)
+    file_io.write_binary_words_file(words, ID.words_dict, len(ID.title_dict))
+    file_io.write_positions_file(file_io.positions_path(words), ID.positions_dict)
+
+    delta = tmp_path / 'delta.xml'
+    delta.write_text("""<xml>
+    <page deleted="true"><id>5</id></page>
+    <page><title>Popular history</title><id>10</id><text>Popular [[Chronology|dates]] for everyone</text></page>
+    <page><title>Feudalism</title><id>500</id><text>Lords, vassals and [[Macro-historical]] fiefs</text></page>
+</xml>""")
+    updated = index.Index(None, streaming=True)
+    updated.load(titles, docs, words)
+    updated.update(str(delta))
+
+    tree = index.et.parse('SmallWiki.xml')
+    root = tree.getroot()
+    for page in list(root):
+        doc_id = int(page.find('id').text.strip())
+        if doc_id == 5:
+            root.remove(page)
+        elif doc_id == 10:
+            page.find('text').text = 'Popular [[Chronology|dates]] for everyone'
+    new_page = index.et.fromstring('<page><title>Feudalism</title><id>500</id><text>Lords, vassals and [[Macro-historical]] fiefs</text></page>')
+    root.append(new_page)
+    tree.write(str(tmp_path / 'after.xml'))
+    rebuilt = index.Index(str(tmp_path / 'after.xml'), positions=True)
+
+    assert updated.title_dict == rebuilt.title_dict
+    assert updated.words_dict == rebuilt.words_dict
+    assert updated.links_dict == rebuilt.links_dict
+    assert 500 in updated.links_dict[0]
+    assert updated.max_word_dict == rebuilt.max_word_dict
+    assert updated.positions_dict == rebuilt.positions_dict
+    assert updated.curr_dict_pr == approx(rebuilt.curr_dict_pr, abs=2e-3)
+    assert updated.page_rank_iterations < rebuilt.page_rank_iterations
+
+def test_link_graph_file(tmp_path):
+    # testing that the link graph file gives back the graph the indexer ranked, so that recomputing the ranks
+    # from it gives the same ranks, and that every method and extrapolation converges to the same ranks
+    ID = index.Index('SmallWiki.xml')
+    titles, docs, words = str(tmp_path / 'titles.txt'), str(tmp_path / 'docs.txt'), str(tmp_path / 'words')
+    index.write_index(ID, titles, docs, words)
+    doc_ids, indptr, indices = file_io.read_graph_file(file_io.graph_path(docs))
+    assert doc_ids == list(ID.title_dict)
+    assert (indptr == ID.link_graph.indptr).all() and (indices == ID.link_graph.indices).all()
+
+    report = pagerank.recompute(docs)
+    assert report['iterations'] == ID.page_rank_iterations and report['max_difference'] == 0
+    exact, ranks = {}, {}
+    pagerank.recompute(docs, threshold=1e-12, output=str(tmp_path / 'exact.txt'))
+    file_io.read_docs_file(str(tmp_path / 'exact.txt'), exact)
+    for method in pagerank.METHODS:
+        for extrapolation in (None, 'aitken', 'quadratic'):
+            pagerank.recompute(docs, method, extrapolation, every=3, threshold=1e-9, output=str(tmp_path / 'new.txt'))
+            file_io.read_docs_file(str(tmp_path / 'new.txt'), ranks)
+            assert ranks == approx(exact, abs=1e-7)
+    assert pagerank.recompute(docs, 'gauss-seidel')['iterations'] < ID.page_rank_iterations
+    assert pagerank.recompute(docs, warm=True)['iterations'] < ID.page_rank_iterations
+
+def test_near_duplicates(tmp_path):
+    # testing that a near-copy of a page is collapsed into the page before it whichever way pages are parsed, with
+    # links to the copy redirected and its postings left out, that the MinHash estimate is close to the Jaccard
+    # similarity of the shingles, and that SmallWiki (which holds no near-copies) is indexed as without --dedupe
+    text = ' '.join('topic%d' % i for i in range(60))
+    copy = text.replace('topic30', 'changed')
+    wiki = tmp_path / 'wiki.xml'
+    wiki.write_text(f"""<xml>
+    <page><title>Original</title><id>1</id><text>{text}</text></page>
+    <page><title>Linker</title><id>2</id><text>see [[Mirror]] and [[Original]] and [[Other]]</text></page>
+    <page><title>Mirror</title><id>3</id><text>{copy} [[Linker]]</text></page>
+    <page><title>Other</title><id>4</id><text>{' '.join('other%d' % i for i in range(60))}</text></page>
+</xml>""")
+    built = [index.Index(str(wiki), dedupe=0.8, **options)
+             for options in [{}, {'streaming': True}, {'workers': 2}]]
+    for ID in built:
+        assert ID.duplicate_of == {3: 1}
+        assert list(ID.title_dict) == [1, 2, 4]
+        assert ID.links_dict == built[0].links_dict and ID.links_dict[2] == {1, 4}
+        assert ID.words_dict == built[0].words_dict and 'chang' not in ID.words_dict
+        assert 3 not in ID.max_word_dict and 3 not in ID.curr_dict_pr
+    assert built[0].dedupe_stats() == {'pages': 4, 'duplicates': 1, 'canonical_pages': 1, 'postings_skipped': 62}
+    assert list(index.Index(str(wiki)).title_dict) == [1, 2, 3, 4]
+
+    terms = [analysis.ANALYZER.term(word) for word in text.split()]
+    copy_terms = [analysis.ANALYZER.term(word) for word in copy.split()]
+    shingles = [{tuple(page[i:i + minhash.SHINGLE_LENGTH]) for i in range(len(page) - minhash.SHINGLE_LENGTH + 1)}
+                for page in (terms, copy_terms)]
+    jaccard = len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+    assert minhash.similarity(minhash.signature(terms), minhash.signature(copy_terms)) == approx(jaccard, abs=.1)
+    assert minhash.signature([]) is None
+
+    deduped, plain = index.Index('SmallWiki.xml', dedupe=0.8), index.Index('SmallWiki.xml')
+    assert deduped.duplicate_of == {}
+    assert deduped.words_dict == plain.words_dict and deduped.curr_dict_pr == plain.curr_dict_pr
+
+# -----Analysis Tests------
+def test_analyzer():
+    # testing that queries are analyzed like page text: lowercased, stop words dropped, stemmed, punctuation ignored
+    assert analysis.ANALYZER.query_terms('The Boston Celtics, of the NBA') == ['boston', 'celtic', 'nba']
+    ID = index.Index('BostonCelticsWiki.xml')
+    assert analysis.ANALYZER.query_terms('Computer Science') == ['comput', 'scienc']
+    assert all(term in ID.words_dict for term in analysis.ANALYZER.query_terms('Jayson Tatum is the future'))
+
+    # testing that every surface form is stemmed once, that repeats are counted as hits and that a bounded
+    # cache evicts its least recently used forms
+    analyzer = analysis.Analyzer(max_size=2)
+    assert analyzer.stop_stem(['Running', 'the', 'Running', 'jumps', 'Running']) == ['run', 'run', 'jump', 'run']
+    stats = analyzer.cache_stats()
+    assert stats['hits'] == 2 and stats['misses'] == 3 and stats['size'] == 2
+    analyzer.clear()
+    assert analyzer.cache_stats()['hits'] == 0
+
+def test_startup_imports():
+    # testing that the bundled stop words are NLTK's English list and that the stemmer is only loaded when needed
+    assert len(analysis.STOP_WORDS) == 179 and {'the', 'of', "wouldn't"} <= analysis.STOP_WORDS
+    analyzer = analysis.Analyzer()
+    assert analyzer.stemmer is None
+    assert analyzer.analyze('Celtics') == 'celtic' and analyzer.stemmer is not None
+
+    # testing that importing the indexer and the querier leaves the heavy and unused modules unloaded
+    for module in ('index', 'query'):
+        trace = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                               capture_output=True, text=True, check=True).stderr
+        imported = {line.split('|')[-1].strip().split('.')[0] for line in trace.splitlines() if '|' in line}
+        assert module in imported
+        assert not imported & {'nltk', 'pytest', 'attr', 'asyncio', 'multiprocessing', 'cProfile', 'pstats', 'server'}
+
+# -----File IO Tests------
+def test_binary_words_file(tmp_path):
+    # testing that the memory-mapped binary words file reads back exactly the dictionary that was written,
+    # including words that are not in the index and postings that come back sorted by doc id
+    ID = index.Index('SmallWiki.xml')
+    words = str(tmp_path / 'words.bin')
+    file_io.write_binary_words_file(words, ID.words_dict, len(ID.title_dict))
+    assert file_io.is_binary_words_file(words)
+    binary_words = file_io.BinaryWordsIndex(words)
+    assert len(binary_words) == len(ID.words_dict)
+    assert sorted(binary_words) == sorted(ID.words_dict)
+    for word, ids_to_counts in ID.words_dict.items():
+        assert binary_words[word] == ids_to_counts
+    assert 'zzzqqq' not in binary_words and binary_words.get('zzzqqq') is None
+    id_nums, frequencies = binary_words.postings('histori')
+    assert list(id_nums) == sorted(id_nums) and len(frequencies) == len(id_nums)
+
+    # testing that the whole dictionary decodes at once, and that it is smaller than the text format
+    assert dict(binary_words.items()) == ID.words_dict
+    text_words = str(tmp_path / 'words.txt')
+    file_io.write_words_file(text_words, ID.words_dict)
+    assert not file_io.is_binary_words_file(text_words)
+    binary_bytes = os.path.getsize(words) + os.path.getsize(file_io.postings_path(words))
+    assert binary_bytes < os.path.getsize(text_words)
+
+    # testing front coding across several blocks, with long and multi-byte terms sharing prefixes, and the
+    # corpus-wide page counts of a shard
+    words_dict = {'préfixe' * 20 + str(i): {i: 1, i + 300: 2} for i in range(40)}
+    words_dict.update({'a': {1: 1}, 'é': {2: 3}})
+    doc_counts = {word: 5 for word in words_dict}
+    file_io.write_binary_words_file(words, words_dict, 500, doc_counts)
+    binary_words = file_io.BinaryWordsIndex(words)
+    assert list(binary_words) == sorted(words_dict) and dict(binary_words.items()) == words_dict
+    assert all(binary_words[word] == ids_to_counts for word, ids_to_counts in words_dict.items())
+    assert binary_words.idf('é') == math.log(500 / 5) and 'préfixe' not in binary_words
+    assert binary_words.prefix_range('préfixe') == (1, 41)
+    file_io.write_binary_words_file(words, {}, 0)
+    assert len(file_io.BinaryWordsIndex(words)) == 0 and dict(file_io.BinaryWordsIndex(words).items()) == {}
+
+def test_postings_codec():
+    # testing that gaps and frequencies round-trip through the variable-byte codec, including the
+    # single-byte fast path, numbers spanning several bytes and an empty postings list
+    for id_nums, frequencies in [([0, 1, 5, 127], [1, 2, 3, 127]),
+                                 ([3, 200, 20000, 2**32 + 7], [128, 1, 16384, 300]),
+                                 ([], [])]:
+        encoded = codec.encode_postings(id_nums, frequencies)
+        decoded_ids, decoded_frequencies = codec.decode_postings(encoded, len(encoded), len(id_nums))
+        assert decoded_ids.tolist() == id_nums and decoded_frequencies.tolist() == frequencies
+    assert len(codec.encode_varints([127])) == 1 and len(codec.encode_varints([128])) == 2
+
+def test_array_words_index(tmp_path):
+    # testing that the packed in-memory words index holds exactly what read_words_file reads, with every term's
+    # postings sorted by doc id in 4-byte arrays, and that its idf is the querier's
+    ID = index.Index('SmallWiki.xml')
+    words = str(tmp_path / 'words.txt')
+    file_io.write_words_file(words, ID.words_dict)
+    with open(words, 'a') as words_fh:
+        words_fh.write('unsorted 9 2 3 1 5 4 \n')
+    expected = {}
+    file_io.read_words_file(words, expected)
+    array_words = file_io.ArrayWordsIndex(words, len(ID.title_dict))
+    assert len(array_words) == len(expected) and list(array_words) == list(expected)
+    for word, ids_to_counts in expected.items():
+        assert array_words[word] == ids_to_counts
+    assert array_words.doc_ids.dtype.itemsize == array_words.frequencies.dtype.itemsize == 4
+    id_nums, frequencies = array_words.postings('unsorted')
+    assert id_nums.tolist() == [3, 5, 9] and frequencies.tolist() == [1, 4, 2]
+    assert array_words.idf('war') == math.log(len(ID.title_dict) / len(expected['war']))
+    assert array_words.postings('zzzqqq') is None and 'zzzqqq' not in array_words
+    assert len(file_io.ArrayWordsIndex()) == 0
+
+# -----Query Tests------
+def write_index(ID: index.Index, directory, binary: bool):
+    # writes the three index files for an already built index and returns their paths
+    titles, docs, words = str(directory / 'titles.txt'), str(directory / 'docs.txt'), str(directory / 'words')
+    file_io.write_title_file(titles, ID.title_dict)
+    file_io.write_docs_file(docs, ID.curr_dict_pr, ID.max_word_dict)
+    if binary:
+        file_io.write_binary_words_file(words, ID.words_dict, len(ID.title_dict))
+    else:
+        file_io.write_words_file(words, ID.words_dict)
+    return titles, docs, words
+
+def test_precomputed_relevance(tmp_path):
+    # testing that the max counts stored in the docs file match the ones found by scanning every posting, and
+    # that the tf-idf weights recomputed from the compressed binary postings give exactly the scores computed at query time
+    ID = index.Index('SmallWiki.xml')
+    (tmp_path / 'text').mkdir()
+    (tmp_path / 'binary').mkdir()
+    text_query = query.Query()
+    text_query.load(*write_index(ID, tmp_path / 'text', binary=False))
+    binary_query = query.Query()
+    binary_query.load(*write_index(ID, tmp_path / 'binary', binary=True))
+
+    scanned = query.Query()
+    scanned.words_to_doc_relevance = text_query.words_to_doc_relevance
+    scanned.fill_euclidean()
+    assert scanned.ids_to_max_euclidean == text_query.ids_to_max_euclidean
+
+    for word in ['histori', 'war', 'carthag', 'zzzqqq']:
+        assert binary_query.get_relevance(word) == text_query.get_relevance(word)
+    assert binary_query.words_to_doc_relevance.idf('war') == text_query.idf_calculator(len(ID.words_dict['war']))
+
+def test_top_k_matches_full_sort(tmp_path):
+    # testing that the MaxScore top-k evaluation returns exactly the first k results (scores, order and
+    # tie-breaks) of scoring and sorting every matching document, with and without PageRank
+    ID = index.Index('SmallWiki.xml')
+    words = list(ID.words_dict)
+    queries = [['histori'], ['war', 'battl'], ['war', 'war', 'histori'], ['zzzqqq', 'carthag']]
+    queries += [[words[(i * 7919 + j * 104729) % len(words)] for j in range(1 + i % 4)] + ['histori'] for i in range(30)]
+    for binary in [False, True]:
+        directory = tmp_path / str(binary)
+        directory.mkdir()
+        querier = query.Query()
+        querier.load(*write_index(ID, directory, binary))
+        for use_page_rank in [False, True]:
+            querier.use_page_rank = use_page_rank
+            for k in [1, 3, 10, 1000]:
+                querier.top_k = k
+                for queried_words in queries:
+                    results = querier.relevance_doc_matcher(queried_words)
+                    if use_page_rank:
+                        results = {doc: score * querier.ids_to_page_ranks[doc] for (doc, score) in results.items()}
+                    expected = sorted(results.items(), key=lambda x: x[1], reverse=True)[:k]
+                    assert querier.search(queried_words) == expected
+
+def test_pagerank_tiers(tmp_path):
+    # testing that the first tier of a word holds its postings in the top pages by PageRank, and that answering
+    # PageRank queries from the first tiers gives exactly the results of the whole postings lists, whether
+    # the first tiers prove them or the querier has to fall back
+    xml = str(tmp_path / 'wiki.xml')
+    vocabulary = benchmark.generate_wiki(xml, 300, vocabulary=500, words_per_page=40, links_per_page=4)
+    ID = index.Index(xml)
+    titles, docs, words = write_index(ID, tmp_path, binary=True)
+    file_io.write_tiers_file(file_io.tiers_path(words), ID.words_dict, ID.curr_dict_pr, ID.max_word_dict,
+                             len(ID.title_dict), .1)
+    tiers = file_io.TiersIndex(file_io.tiers_path(words))
+    assert tiers.fraction == .1
+    top = sorted(ID.curr_dict_pr, key=lambda doc: (-ID.curr_dict_pr[doc], doc))[:30]
+    word = analysis.ANALYZER.analyze(vocabulary[10])
+    id_nums, frequencies, rest_bound = tiers.tier(word)
+    assert id_nums.tolist() == sorted(doc for doc in ID.words_dict[word] if doc in top)
+    assert frequencies.tolist() == [ID.words_dict[word][doc] for doc in id_nums.tolist()]
+    assert rest_bound > 0 and tiers.tier('zzzqqq') is None
+
+    tiered = query.Query()
+    tiered.load(titles, docs, words)
+    full = query.Query()
+    full.load(titles, docs, words)
+    full.use_tiers = False
+    queries = [[word] for word in vocabulary[:20]] + [[vocabulary[0], vocabulary[1]], [vocabulary[400], 'zzzqqq']]
+    for querier in [tiered, full]:
+        querier.use_page_rank = True
+    proven = 0
+    for k in [1, 10, 300]:
+        tiered.top_k = full.top_k = k
+        for queried_words in queries:
+            queried_words = [analysis.ANALYZER.analyze(word) or word for word in queried_words]
+            results, _ = tiered.rank_first_tier(tiered.result_key(queried_words), queried_words)
+            proven += results is not None
+            assert tiered.search(queried_words) == full.search(queried_words)
+    assert 0 < proven < 3 * len(queries)
+
+def test_phrase_and_conjunctive_queries(tmp_path):
+    # testing that phrase queries and conjunctive (AND) queries return exactly the documents a full scan of the
+    # recorded positions and postings finds, scored as the bag of words query scores them, ties broken by ID,
+    # and that the galloping intersection agrees with a plain set intersection
+    ID = index.Index('SmallWiki.xml', positions=True)
+    assert ID.words_dict == index.Index('SmallWiki.xml').words_dict
+
+    def contains(doc_id, phrase):
+        starts = set(ID.positions_dict.get(phrase[0], {}).get(doc_id, []))
+        for offset, word in enumerate(phrase[1:], 1):
+            starts &= {position - offset for position in ID.positions_dict.get(word, {}).get(doc_id, [])}
+        return bool(starts)
+
+    inputs = ['"military history"', '"history military"', 'war "ancient carthage"', '"the history of rome"',
+              '"zzzqqq history"', 'boston "carthage"']
+    for binary in [False, True]:
+        directory = tmp_path / str(binary)
+        directory.mkdir()
+        files = write_index(ID, directory, binary)
+        file_io.write_positions_file(file_io.positions_path(files[2]), ID.positions_dict)
+        querier = query.Query()
+        querier.load(*files)
+        querier.top_k = 1000
+        for use_page_rank in [False, True]:
+            querier.use_page_rank = use_page_rank
+            for conjunctive in [False, True]:
+                querier.conjunctive = conjunctive
+                for user_input in inputs + ['battle war', 'history roman empire']:
+                    words = analysis.ANALYZER.query_terms(user_input)
+                    phrases = analysis.ANALYZER.query_phrases(user_input)
+                    if not phrases and not conjunctive:
+                        continue
+                    scores = querier.relevance_doc_matcher(words)
+                    matching = [doc_id for doc_id in scores if all(contains(doc_id, phrase) for phrase in phrases)
+                                and (not conjunctive or all(doc_id in ID.words_dict.get(word, {}) for word in words))]
+                    if use_page_rank:
+                        scores = {doc_id: score * querier.ids_to_page_ranks[doc_id] for doc_id, score in scores.items()}
+                    expected = sorted(((doc_id, scores[doc_id]) for doc_id in matching), key=lambda x: (-x[1], x[0]))
+                    assert querier.rank(user_input) == expected
+    querier.use_page_rank = querier.conjunctive = False
+    assert querier.rank('"military history"')[0][0] == 93
+
+    # testing the positions file on its own and the intersection against sets
+    positions = file_io.PositionsIndex(file_io.positions_path(files[2]))
+    assert dict(positions.items()) == ID.positions_dict
+    for lists in [[[1, 3, 5, 7, 9, 11], [2, 3, 4, 9, 10], list(range(0, 100, 3))], [[1, 2], []], [[5], [5], [5]],
+                  [list(range(0, 1000, 2)), list(range(0, 1000, 7)), [14, 500, 994]]]:
+        matches, matched_positions, _ = intersect.intersect(lists)
+        assert matches == sorted(set.intersection(*[set(doc_ids) for doc_ids in lists]))
+        for doc_ids, found in zip(lists, matched_positions):
+            assert [doc_ids[k] for k in found] == matches
+    _, _, compared = intersect.intersect([list(range(100000)), [10, 50000, 99999]])
+    assert compared < 20
+
+def test_batch_and_server(tmp_path):
+    # testing that the batch mode and the TCP server both answer with the same ranked ids, titles and scores as
+    # the querier itself, that the server answers several clients at once and that bad requests get an error
+    ID = index.Index('BostonCelticsWiki.xml')
+    querier = query.Query()
+    querier.load(*write_index(ID, tmp_path, binary=True))
+    expected = querier.query_results('jayson nba')
+    assert [result['id'] for result in expected] == [doc_id for doc_id, _ in querier.rank('jayson nba')]
+    assert expected[0]['title'] == ID.title_dict[expected[0]['id']]
+
+    output = io.StringIO()
+    server.run_batch(querier, io.StringIO('jayson nba\n\nzzzqqq\n'), output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [response['results'] for response in responses] == [expected, []]
+
+    async def ask(port: int, requests: list):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        answers = []
+        for request in requests:
+            writer.write(request.encode('utf-8') + b'\n')
+            answers.append(json.loads(await reader.readline()))
+        writer.close()
+        return answers
+
+    async def run_server():
+        query_server = await server.start(querier, '127.0.0.1', 0)
+        port = query_server.sockets[0].getsockname()[1]
+        async with query_server:
+            return await asyncio.gather(*[ask(port, ['{"query": "jayson nba"}', '{bad']) for _ in range(5)])
+
+    for answers in asyncio.run(run_server()):
+        assert answers[0]['results'] == expected
+        assert 'error' in answers[1]
+
+def test_query_caches(tmp_path):
+    # testing that cached results and postings are served for repeated (and equivalently analyzed) queries
+    # without changing them, that the caches stay within their budgets and that reloading clears them
+    ID = index.Index('SmallWiki.xml')
+    files = write_index(ID, tmp_path, binary=True)
+    uncached = query.Query(result_cache_bytes=0, postings_cache_bytes=0)
+    uncached.load(*files)
+    querier = query.Query()
+    querier.load(*files)
+    for user_input in ['history war', 'History  the WARS', 'carthage', 'history war']:
+        assert querier.rank(user_input) == uncached.rank(user_input)
+    assert querier.result_cache.stats()['hits'] == 2 and querier.result_cache.stats()['misses'] == 2
+    assert querier.postings_cache.stats()['hits'] == 0 and len(querier.postings_cache) == 3
+    assert querier.get_relevance('war') == uncached.get_relevance('war')
+    assert querier.postings_cache.stats()['hits'] == 1
+    assert uncached.result_cache.stats()['entries'] == 0 and uncached.postings_cache.stats()['entries'] == 0
+
+    querier.load(*files)
+    assert len(querier.result_cache) == 0 and len(querier.postings_cache) == 0
+    querier.rank('history war')
+    assert querier.result_cache.stats()['misses'] == 3
+
+    lru = cache.LRUCache(10)
+    lru.put('a', 1, 4)
+    lru.put('b', 2, 4)
+    lru.get('a')
+    lru.put('c', 3, 4)
+    lru.put('d', 4, 11)
+    assert lru.get('b') is None and lru.get('a') == 1 and lru.get('c') == 3 and lru.get('d') is None
+    assert lru.stats()['evictions'] == 1 and lru.stats()['bytes'] == 8
+
+def test_sharded_index(tmp_path):
+    # testing that shards keep the corpus-wide idf, and that merging the top-k lists of shard worker processes
+    # gives exactly the results (scores, order and tie-breaks) of the whole index, in both words file formats
+    ID = index.Index('SmallWiki.xml')
+    words = list(ID.words_dict)
+    queries = ['history', 'battle war', 'war war history', '"roman empire"', 'the of', 'zzzqqq']
+    queries += [' '.join(words[(i * 7919 + j * 104729) % len(words)] for j in range(1 + i % 4)) for i in range(20)]
+    doc_counts = ID.doc_counts()
+    for text in [False, True]:
+        directory = tmp_path / str(text)
+        directory.mkdir()
+        files = [str(directory / name) for name in ('titles.txt', 'docs.txt', 'words')]
+        index.write_index(ID, *files, text=text)
+        whole = query.Query()
+        whole.load(*files)
+        for shard in range(3):
+            part = ID.shard(3, shard)
+            assert all(doc_id % 3 == shard for doc_id in part.title_dict)
+            index.write_index(part, *[file_io.shard_path(path, shard) for path in files], text=text,
+                              total_pages=len(ID.title_dict), doc_counts=doc_counts)
+        shard_query = query.Query()
+        shard_query.load(*[file_io.shard_path(path, 0) for path in files])
+        assert shard_query.words_to_doc_relevance.idf('war') == whole.words_to_doc_relevance.idf('war')
+
+        coordinator = query.ShardedQuery([query.ProcessShard(*[file_io.shard_path(path, shard) for path in files])
+                                          for shard in range(3)])
+        try:
+            for use_page_rank in [False, True]:
+                for conjunctive in [False, True]:
+                    for k in [1, 10, 1000]:
+                        whole.use_page_rank = coordinator.use_page_rank = use_page_rank
+                        whole.conjunctive = coordinator.conjunctive = conjunctive
+                        whole.top_k = coordinator.top_k = k
+                        for user_input in queries:
+                            assert coordinator.rank(user_input) == whole.rank(user_input)
+            assert coordinator.query_results('war') == whole.query_results('war')
+        finally:
+            coordinator.close()
+
+    # testing that a query server answers the requests of a coordinator with the raw entries of its shard
+    request = {"query": "battle war", "pagerank": True, "and": False, "top_k": 5}
+
+    async def ask_server():
+        query_server = await server.start(shard_query, '127.0.0.1', 0)
+        async with query_server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', query_server.sockets[0].getsockname()[1])
+            writer.write(json.dumps(dict(request, shard=True)).encode('utf-8') + b'\n')
+            answer = json.loads(await reader.readline())
+            writer.close()
+            return answer
+
+    assert asyncio.run(ask_server())['results'] == [list(entry) for entry in shard_query.shard_results(request)]
+    assert not shard_query.use_page_rank and shard_query.top_k == 10
+
+    # testing that a shard analyzes (and corrects) each query it answers once
+    analyzed = []
+    analyze = shard_query.analyze
+    shard_query.analyze = lambda user_input: analyzed.append(user_input) or analyze(user_input)
+    shard_query.shard_results(dict(request, query='batle war'))
+    assert analyzed == ['batle war']
+    del shard_query.analyze
+
+def test_wildcard_queries(tmp_path):
+    # testing that wildcard terms expand to the index terms that match them, keeping the most common ones when
+    # there are more than the cap, and that they score a page as the sum of the weights of the terms it contains,
+    # the same in both words file formats
+    ID = index.Index('SmallWiki.xml')
+    vocabulary = sorted(ID.words_dict)
+    assert analysis.ANALYZER.query_terms('Celt* of the B*s*n Wars') == ['celt*', 'b*s*n', 'war']
+    assert analysis.ANALYZER.query_phrases('"roman hist*"') == (('roman',),)
+    queriers = []
+    for binary in [False, True]:
+        directory = tmp_path / str(binary)
+        directory.mkdir()
+        querier = query.Query()
+        querier.load(*write_index(ID, directory, binary))
+        queriers.append(querier)
+        for pattern, matches in [('hist*', lambda term: term.startswith('hist')),
+                                 ('c*tic', lambda term: term.startswith('c') and term.endswith('tic')),
+                                 ('zzz*', lambda term: False)]:
+            positions, idfs = querier.expand(pattern)
+            terms = [querier.words_to_doc_relevance.sorted_term(i) for i in positions.tolist()]
+            assert terms == [term for term in vocabulary if matches(term)]
+            assert idfs.tolist() == [querier.words_to_doc_relevance.idf(term) for term in terms]
+        querier.max_expansions = 2
+        positions, _ = querier.expand('a*')
+        terms = [querier.words_to_doc_relevance.sorted_term(i) for i in positions.tolist()]
+        expected = sorted(sorted((term for term in vocabulary if term.startswith('a')),
+                                 key=lambda term: (-len(ID.words_dict[term]), term))[:2])
+        assert terms == expected
+        querier.max_expansions = query.MAX_EXPANSIONS
+
+        for use_page_rank in [False, True]:
+            querier.use_page_rank = use_page_rank
+            terms = [term for term in vocabulary if term.startswith('hist')]
+            scores = querier.relevance_doc_matcher(terms + ['war'])
+            if use_page_rank:
+                scores = {doc: score * querier.ids_to_page_ranks[doc] for doc, score in scores.items()}
+            expected = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:10]
+            results = querier.rank('hist* war')
+            assert [doc for doc, _ in results] == [doc for doc, _ in expected]
+            assert [score for _, score in results] == approx([score for _, score in expected])
+    assert queriers[0].rank('c*tic hist*') == queriers[1].rank('c*tic hist*')
+
+def test_fuzzy_queries(tmp_path):
+    # testing that a word that is not in the index is replaced by the closest index term (then the most common,
+    # then the first in sorted order) found through the trigram index, the same as comparing it with every term,
+    # and that --no-fuzzy leaves it unmatched
+    assert fuzzy.grams('celtic') == sorted(['$$c', '$ce', 'cel', 'elt', 'lti', 'tic', 'ic$', 'c$$'])
+    # a swap, a substitution, an insertion and a deletion each count as one edit
+    for word, expected in [('celtci', {'celtic': 1, 'celtics': 2, 'cltic': 2, 'boston': 5, 'b': 6, '': 6}),
+                           ('histroy', {'histroy': 0, 'history': 1, 'ahistroy': 1, 'hxstrxy': 2, 'histor': 2,
+                                        'yorthis': 6})]:
+        terms = list(expected)
+        matrix = numpy.zeros((len(terms), max(map(len, terms))), dtype=numpy.uint8)
+        for i, term in enumerate(terms):
+            matrix[i, :len(term)] = list(term.encode('utf-8'))
+        distances = fuzzy.edit_distances(word, matrix, numpy.array([len(term) for term in terms]))
+        assert dict(zip(terms, distances.tolist())) == expected
+
+    ID = index.Index('SmallWiki.xml')
+    files = [str(tmp_path / name) for name in ('titles.txt', 'docs.txt', 'words')]
+    index.write_index(ID, *files)
+    querier = query.Query()
+    querier.load(*files)
+    vocabulary = sorted(ID.words_dict)
+    terms, lengths = querier.trigram_index.terms_at(numpy.arange(len(vocabulary)))
+
+    def closest(word: str):
+        bound = fuzzy.max_distance(word)
+        # only terms with about as many letters can be close enough
+        near = numpy.flatnonzero(numpy.abs(lengths - len(word)) <= bound)
+        distances = fuzzy.edit_distances(word, terms[near][:, :len(word) + bound], lengths[near]).tolist()
+        found = [(distance, -len(ID.words_dict[vocabulary[i]]), vocabulary[i])
+                 for distance, i in zip(distances, near.tolist()) if distance <= bound]
+        return min(found)[2] if found else None
+
+    misspelled = ['celtc', 'histroy', 'bostn', 'zzzzzzzq', 'wr', 'gaul'] + \
+                 [term[:2] + term[3:] for term in vocabulary[::997] if len(term) > 3] + \
+                 [term[:1] + term[2] + term[1] + term[3:] for term in vocabulary[::991] if len(term) > 3] + \
+                 [term + 'x' for term in vocabulary[::983]]
+    for word in misspelled:
+        if word not in ID.words_dict:
+            assert querier.correction(word) == closest(word)
+    assert querier.correction('zzzzzzzq') is None
+    assert querier.analyze('Histroy of "France gaul" celtcs') == \
+        ([closest('histroy'), 'franc', closest('gaul'), closest('celtc')], (('franc', closest('gaul')),))
+    assert querier.correction('histroy') == 'histori'
+    assert querier.rank('histroy wars') == querier.rank('history wars')
+    querier.use_fuzzy = False
+    assert querier.rank('histroy') == []
+
+def test_hot_reload(tmp_path):
+    # testing that a querier picks up each newly published version of an index, that a query running when it is
+    # loaded finishes on the old version, that the old version is freed and unmapped once swapped out and that only the
+    # latest versions are kept in the publish directory
+    directory = str(tmp_path)
+
+    def publish(xml: str, binary: bool):
+        version, version_directory = file_io.new_version_directory(directory)
+        files = [os.path.join(version_directory, name) for name in ('titles.txt', 'docs.txt', 'words')]
+        index.write_index(index.Index(xml), *files, text=not binary)
+        file_io.write_manifest(directory, version, *files)
+        return files
+
+    publish('SmallWiki.xml', binary=True)
+    querier = query.Query()
+    index_reloader = reloader.IndexReloader(querier, directory)
+    assert index_reloader.reload() and querier.version == 1
+    assert not index_reloader.reload()
+    old = querier.rank('celtics')
+    old_words = weakref.ref(querier.words_to_doc_relevance)
+    old_map = querier.words_to_doc_relevance.dictionary_map
+
+    expected = query.Query()
+    expected.load(*publish('BostonCelticsWiki.xml', binary=False))
+    thread = threading.Thread(target=index_reloader.reload)
+    with querier.current_index():
+        thread.start()
+        while querier.pending is None:
+            time.sleep(.01)
+        assert querier.rank_query('celtics') == old and querier.version == 1
+    thread.join()
+    assert querier.version == 2 and querier.pending is None
+    assert querier.query_results('celtics') == expected.query_results('celtics')
+    assert old_words() is None and old_map.closed
+    # the snapshot is built from the querier's own class, which is __main__.Query when query.py runs as a script
+    assert 'Query' not in vars(reloader)
+
+    # a querier that is never idle swaps the new version in at the start of its next query
+    publish('SmallWiki.xml', binary=False)
+    snapshot = query.Query()
+    snapshot.load(*file_io.read_manifest(directory)[1:])
+    snapshot.version = 3
+    querier.pending = snapshot
+    assert querier.rank('celtics') == old and querier.version == 3
+    file_io.remove_old_versions(directory, 2)
+    assert file_io.versions(directory) == [2, 3]
+
+# -----Benchmark Tests------
+def test_synthetic_wiki(tmp_path):
+    # testing that the synthetic wiki is reproducible, indexes cleanly (every link resolves to a generated page)
+    # and that the benchmark reports every indexing phase and the query latencies
+    xml = str(tmp_path / 'wiki.xml')
+    words = benchmark.generate_wiki(xml, 40, vocabulary=300, words_per_page=30, links_per_page=3)
+    with open(xml) as xml_fh:
+        first = xml_fh.read()
+    benchmark.generate_wiki(xml, 40, vocabulary=300, words_per_page=30, links_per_page=3)
+    with open(xml) as xml_fh:
+        assert xml_fh.read() == first
+    assert len(set(words)) == 300
+    ID = index.Index(xml)
+    assert len(ID.title_dict) == 40
+    link_titles = [title for titles in ID.link_titles.values() for title in titles]
+    assert link_titles and all(ID.is_in_corpus(title) for title in link_titles)
+
+    results = benchmark.run_benchmark(30, vocabulary=200, words_per_page=20, queries=10, directory=str(tmp_path))
+    assert set(results['index']['phases_s']) == {'xml_parse', 'title_parse', 'word_parse', 'page_rank',
+                                                 'write_title_file', 'write_docs_file', 'write_links_file',
+                                                 'write_words_file', 'write_binary_words_file', 'write_trigrams_file'}
+    assert results['query']['uncached']['queries'] == 10
+    assert results['query']['cached']['p50_ms'] <= results['query']['cached']['max_ms']
+    json.dumps(results)
+
+    # testing that the worker sweep times a build per number of workers (each checked against the first)
+    results = benchmark.run_workers_benchmark(xml, [1, 2], repeat=1)
+    assert [build['workers'] for build in results['workers']] == [1, 2] and results['workers'][0]['speedup'] == 1.0
+    assert results['environment']['cpus'] >= 1
+
+# -----Profiling Tests------
+def test_profiling(tmp_path):
+    # testing that a profiled build gives the same index as an unprofiled one while reporting every phase, the
+    # page indexing and stemming stages and one PageRank residual per iteration, and that profiled queries give the
+    # same results as unprofiled ones while recording their stages and the postings they scanned
+    profiler = profiling.Profiler()
+    profiled = index.Index('SmallWiki.xml', profiler=profiler)
+    plain = index.Index('SmallWiki.xml')
+    assert profiled.words_dict == plain.words_dict and profiled.curr_dict_pr == plain.curr_dict_pr
+    assert 'index_page' not in vars(plain) and plain.term is analysis.ANALYZER.term
+    assert set(profiler.phases) == {'xml_parse', 'title_parse', 'word_parse', 'page_rank'}
+    assert profiler.stages['index_page']['calls'] == len(plain.title_dict)
+    assert profiler.stages['populate_links_dict']['calls'] == sum(map(len, plain.link_titles.values()))
+    # every word is stemmed, the stop words, which are not indexed, included
+    indexed_words = sum(sum(ids_to_counts.values()) for ids_to_counts in plain.words_dict.values())
+    assert profiler.stages['term']['calls'] > indexed_words
+    residuals = profiler.metrics['page_rank']['residuals']
+    assert len(residuals) == plain.page_rank_iterations == len(plain.page_rank_residuals)
+    assert residuals[-1] <= pagerank.THRESHOLD < residuals[0]
+
+    files = write_index(plain, tmp_path, binary=True)
+    querier = query.Query()
+    querier.load(*files)
+    querier.profiler = profiling.Profiler()
+    expected = query.Query()
+    expected.load(*files)
+    for user_input in ['battle war', 'carthage', 'battle war']:
+        assert querier.rank(user_input) == expected.rank(user_input)
+    records = list(querier.profiler.queries)
+    assert [record['cached'] for record in records] == [False, False, True]
+    assert records[0]['postings'] == len(plain.words_dict['battl']) + len(plain.words_dict['war'])
+    assert set(records[0]['stages_ms']) == {'analyze', 'postings', 'top_k', 'total'}
+    report = querier.profiler.finish(str(tmp_path / 'report.json'))
+    assert report['query_summary']['queries'] == 3 and report['query_summary']['cached'] == 1
+    with open(tmp_path / 'report.json') as report_fh:
+        assert json.load(report_fh)['query_summary'] == report['query_summary']
+
+# ------------------------- SYSTEMS TESTS -------------------------------------
@@ -0,0 +1,140 @@
+"""
+Provides top-k evaluation of a query's postings with MaxScore early termination
+"""
+import heapq
+from bisect import bisect_left
+
+import numpy as np
+
+# relative slack on the pruning threshold, so that rounding in the bound sums never prunes a
+# document whose exact score would tie or beat the k-th best
+SLACK = 1e-9
+
+
+class TermPostings:
+    def __init__(self, doc_ids: list, weights: list, ranks: list, bound: float):
+        """
+        The postings of a single query term, sorted by doc id
+        :param doc_ids: the IDs of the documents containing the term, in ascending order
+        :param weights: the tf-idf weight of the term in each of those documents
+        :param ranks: the position of each posting in the term's original postings order, used to break
+        ties between equal scores the same way a stable sort of the full results does
+        :param bound: an upper bound on the (PageRank-scaled) score the term adds to any document
+        """
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.ranks = ranks
+        self.bound = bound
+        # position of the next posting that has not been read yet
+        self.cursor = 0
+
+    def current(self):
+        """
+        Gets the doc id under the cursor
+        :param self
+        :return: the doc id, or None when every posting has been read
+        """
+        if self.cursor < len(self.doc_ids):
+            return self.doc_ids[self.cursor]
+        return None
+
+    def seek(self, doc_id: int):
+        """
+        Moves the cursor to the first posting whose doc id is at least doc_id, skipping everything before it
+        :param self
+        :param doc_id: the doc id to move to
+        :return: n/a
+        """
+        if self.cursor < len(self.doc_ids) and self.doc_ids[self.cursor] < doc_id:
+            self.cursor = bisect_left(self.doc_ids, doc_id, self.cursor)
+
+
+def top_k(terms: list, k: int, multipliers: dict = None):
+    """
+    Finds the k best scoring documents of a query, where a document's score is the sum of its weights
+    over the query terms (in query order), multiplied by its entry in multipliers when given
+    Terms are sorted by upper bound; once the k-th best score is known, the terms whose bounds add up
+    to less than it can no longer introduce a document on their own, so candidates are only drawn from
+    the remaining (essential) terms and the others are probed by binary search, stopping early when the
+    candidate cannot reach the k-th best score
+    Ties are broken as in a stable sort of the full results: by the first query term containing the
+    document, then by the document's position in that term's postings
+    :param terms: the TermPostings of each query term, in query order
+    :param k: the number of results to keep
+    :param multipliers: mapping of document IDs to the factor their score is multiplied by (optional)
+    :return: a list of (doc id, score) pairs, best first
+    """
+    if k <= 0:
+        return []
+    order = sorted(range(len(terms)), key=lambda t: terms[t].bound)
+    # cumulative[i] bounds the score of a document found only in the terms order[0..i]
+    cumulative = []
+    total = 0
+    for t in order:
+        total += terms[t].bound
+        cumulative.append(total)
+
+    heap = []
+    threshold = None
+    first_essential = 0
+    while True:
+        if threshold is not None:
+            while first_essential < len(order) and cumulative[first_essential] < threshold - SLACK * abs(threshold):
+                first_essential += 1
+        essential = order[first_essential:]
+        candidates = [terms[t].current() for t in essential if terms[t].current() is not None]
+        if not candidates:
+            break
+        doc_id = min(candidates)
+
+        weights = {}
+        for t in essential:
+            if terms[t].current() == doc_id:
+                weights[t] = terms[t].weights[terms[t].cursor]
+        scale = multipliers[doc_id] if multipliers is not None else 1
+        partial = sum(weights.values()) * scale
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if threshold is not None and partial + cumulative[i] < threshold - SLACK * abs(threshold):
+                pruned = True
+                break
+            term = terms[order[i]]
+            term.seek(doc_id)
+            if term.current() == doc_id:
+                weights[order[i]] = term.weights[term.cursor]
+                partial += term.weights[term.cursor] * scale
+
+        if not pruned:
+            first_term = min(weights)
+            entry = (sum(weights[t] for t in sorted(weights)) * scale,
+                     -first_term, -terms[first_term].ranks[terms[first_term].cursor], doc_id)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+            if len(heap) == k:
+                threshold = heap[0][0]
+
+        for t in essential:
+            if terms[t].current() == doc_id:
+                terms[t].cursor += 1
+
+    return [(doc_id, score) for score, _, _, doc_id in sorted(heap, reverse=True)]
+
+
+def top_k_arrays(id_nums: np.ndarray, weights: np.ndarray, k: int, multipliers: np.ndarray = None):
+    """
+    Finds the k best scoring documents of a query with a single term, whose scores are its weights (multiplied
+    by the documents' multipliers when given), scoring and sorting every posting at once
+    Gives the same results as top_k, ties being broken by doc id
+    :param id_nums: the doc ids of the term's postings, in ascending order
+    :param weights: the weight of the term in each of those documents
+    :param k: the number of results to keep
+    :param multipliers: the factor each document's score is multiplied by, aligned with id_nums (optional)
+    :return: a list of (doc id, score) pairs, best first
+    """
+    if k <= 0:
+        return []
+    scores = weights * multipliers if multipliers is not None else weights
+    best = np.lexsort((id_nums, -scores))[:k]
+    return list(zip(id_nums[best].tolist(), scores[best].tolist()))